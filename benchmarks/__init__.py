@@ -0,0 +1,10 @@
+'''
+Benchmarks for dftp. Each module can be run with "python -m benchmarks.<name>"
+from the root of the repository; none of them talk to RTM.
+
+    run         time the hot paths of processing tasks; compare with a baseline
+    export      time exporting to pdf, and the memory used
+    load        run whole dftp commands concurrently; report latency and throughput
+    rtm_server  local stand-in for the RTM API, which load (and the tests) run against
+    payload     synthetic rtm.tasks.getList data used by the others
+'''
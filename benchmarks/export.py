@@ -0,0 +1,56 @@
+#!python3
+
+'''
+Time exporting tasks to pdf, and the peak memory used, at increasing numbers of
+tasks. Each size is run in its own process so peak RSS isn't carried over.
+
+    python -m benchmarks.export [number of tasks ...]
+'''
+
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+
+sizes = [1000, 10000, 100000]
+
+
+def export(number_of_tasks):
+    ''' Export *number_of_tasks* tasks; return the seconds taken and peak RSS in MiB. '''
+
+    from dftp import app
+    from benchmarks.payload import rtm_lists
+
+    app.config['USER SETTINGS']['timezone'] = 'UTC'
+    tasks = app.create_Task_list(rtm_lists(number_of_tasks))
+
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        app.display_tasks('export', 'Benchmark', '', tasks, '',
+                          filename=str(Path(directory).joinpath('tasks')))
+        seconds = time.perf_counter() - start
+
+    # ru_maxrss is in KiB on Linux
+    return seconds, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main(argv):
+    if argv[:1] == ['--child']:
+        print('{:.3f} {:.1f}'.format(*export(int(argv[1]))))
+        return
+
+    print('{:>8} {:>10} {:>14}'.format('tasks', 'seconds', 'peak RSS (MiB)'))
+
+    for number_of_tasks in [int(arg) for arg in argv] or sizes:
+        result = subprocess.run([sys.executable, '-m', 'benchmarks.export', '--child',
+                                 str(number_of_tasks)], stdout=subprocess.PIPE,
+                                universal_newlines=True, check=True)
+        seconds, rss = result.stdout.split()
+        print('{:>8} {:>10} {:>14}'.format(number_of_tasks, seconds, rss))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
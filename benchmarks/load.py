@@ -0,0 +1,202 @@
+#!python3
+
+'''
+Run whole dftp commands, each in a new process as a user would, against the
+stand-in RTM server (benchmarks.rtm_server) or another endpoint, and report
+their latency percentiles and throughput.
+
+    python -m benchmarks.load -n 50 -c 4 --tasks 10000 --latency 0.05 \
+        -x "tasks -i" -x "lists"
+
+Every run has a home directory of its own (so a config file that is already
+authenticated, and no local store) unless --shared-home is given, in which case
+the home is synced with "dftp sync" before the runs start and they show tasks
+from its store. With --serve, they are answered by "dftp serve", started in the
+shared home. dftp's syncs in the background are turned off, so that no run
+leaves one running during the others, or after the load test.
+'''
+
+import argparse
+import configparser
+import math
+from concurrent.futures import ThreadPoolExecutor
+import os
+from pathlib import Path
+import shlex
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.rtm_server import RTMStandIn, settings
+
+
+def make_home(directory):
+    ''' Create a home directory in *directory* with an authenticated dftp config. '''
+
+    config = configparser.ConfigParser()
+    config['USER SETTINGS'] = dict(settings, token='standin-token',
+                                   token_checked=str(int(time.time())),
+                                   username='standin', name='Stand In')
+
+    with open(os.path.join(directory, '.dftp'), 'w') as fp:
+        config.write(fp)
+
+    return directory
+
+
+dftp = [sys.executable, '-c', 'from dftp.app import main; main()']
+
+
+def environment(url, home):
+    ''' Environment to run dftp in with *home* as home directory, against *url*. '''
+
+    env = dict(os.environ, HOME=home, DFTP_METHODS_URL=url, DFTP_BACKGROUND_SYNC='0')
+    package_root = str(Path(__file__).parent.parent)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [package_root, env.get('PYTHONPATH')]))
+
+    return env
+
+
+def invoke(args, url, home):
+    ''' Run "dftp *args*" against *url*; return (seconds, exit status, stderr). '''
+
+    start = time.perf_counter()
+    result = subprocess.run(dftp + args, env=environment(url, home), stdin=subprocess.DEVNULL,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                            universal_newlines=True)
+
+    return time.perf_counter() - start, result.returncode, result.stderr
+
+
+def percentile(values, percent):
+    ''' The *percent* percentile of *values* (sorted), by nearest rank. '''
+    index = max(0, min(len(values), math.ceil(percent / 100 * len(values))) - 1)
+    return values[index]
+
+
+def start_server(url, home):
+    ''' Start "dftp serve" in *home* and return it once it is answering. '''
+
+    server = subprocess.Popen(dftp + ['serve'], env=environment(url, home),
+                              stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
+    socket_file = os.path.join(home, '.dftp.sock')
+
+    while not os.path.exists(socket_file):
+        if server.poll() is not None:
+            raise RuntimeError('dftp serve exited with status {}'.format(server.returncode))
+        time.sleep(0.01)
+
+    return server
+
+
+def run_load(commands, url, number_of_runs, concurrency, shared_home=False, serve=False):
+    '''
+    Run *number_of_runs* of *commands* (lists of arguments, taken in turn),
+    *concurrency* at a time, answered by dftp serve if *serve* is set (which
+    implies *shared_home*). Return {command: (seconds of each run, failures)}
+    and the total seconds taken.
+    '''
+
+    shared_home = shared_home or serve
+    server = None
+
+    with tempfile.TemporaryDirectory() as directory:
+        def home(i):
+            path = os.path.join(directory, 'shared' if shared_home else str(i))
+            if not os.path.isdir(path):
+                os.mkdir(path)
+                make_home(path)
+            return path
+
+        homes = [home(i) for i in range(number_of_runs)]
+        runs = [(commands[i % len(commands)], homes[i]) for i in range(number_of_runs)]
+
+        if shared_home:
+            # create the store the runs read
+            seconds, status, stderr = invoke(['sync'], url, homes[0])
+            if status:
+                raise RuntimeError('dftp sync failed: {}'.format(stderr.strip()))
+        if serve:
+            server = start_server(url, homes[0])
+
+        try:
+            start = time.perf_counter()
+            with ThreadPoolExecutor(concurrency) as executor:
+                results = list(executor.map(lambda run: invoke(run[0], url, run[1]), runs))
+            total_seconds = time.perf_counter() - start
+        finally:
+            if server:
+                server.terminate()
+                server.wait()
+
+    timings = {}
+    for (args, _), (seconds, status, stderr) in zip(runs, results):
+        times, failures = timings.setdefault(' '.join(args), ([], []))
+        times.append(seconds)
+        if status:
+            failures.append(stderr.strip().splitlines()[-1:] or ['exit status {}'.format(status)])
+
+    return timings, total_seconds
+
+
+def report(timings, total_seconds, out=None):
+    out = out or sys.stdout
+    row = '{:<24} {:>6} {:>6} {:>8} {:>8} {:>8} {:>8}\n'
+
+    out.write(row.format('command', 'runs', 'failed', 'p50', 'p90', 'p99', 'max'))
+    runs = 0
+    for command, (times, failures) in timings.items():
+        times = sorted(times)
+        runs += len(times)
+        out.write(row.format(command, len(times), len(failures),
+                             *['{:.3f}'.format(percentile(times, percent))
+                               for percent in (50, 90, 99, 100)]))
+
+    out.write('{} runs in {:.2f}s: {:.2f} commands per second\n'.format(
+        runs, total_seconds, runs / total_seconds))
+
+    for command, (times, failures) in timings.items():
+        for failure in failures[:3]:
+            out.write('{} failed: {}\n'.format(command, failure[0]))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.load', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-x', '--command', action='append', dest='commands',
+                        help='dftp command to run, e.g. "tasks -i" (repeat to alternate)')
+    parser.add_argument('-n', '--runs', type=int, default=20, help='number of commands to run')
+    parser.add_argument('-c', '--concurrency', type=int, default=1, help='commands run at once')
+    parser.add_argument('--shared-home', action='store_true',
+                        help='run all commands with the same home directory')
+    parser.add_argument('--serve', action='store_true',
+                        help='answer the commands with dftp serve (implies --shared-home)')
+    parser.add_argument('--url', help='endpoint to use rather than starting a stand-in server')
+    parser.add_argument('--tasks', type=int, default=1000, help='tasks the stand-in serves')
+    parser.add_argument('--lists', type=int, default=10, help='lists the stand-in serves')
+    parser.add_argument('--fixture', help='recorded rtm.tasks.getList response to serve')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds the stand-in waits per request')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='fraction of requests the stand-in fails')
+    args = parser.parse_args(argv)
+
+    commands = [shlex.split(command) for command in args.commands or ['tasks', 'lists']]
+
+    if args.url:
+        timings, total_seconds = run_load(commands, args.url, args.runs, args.concurrency,
+                                          args.shared_home, args.serve)
+    else:
+        with RTMStandIn(args.tasks, args.lists, args.latency, args.error_rate,
+                        args.fixture) as rtm:
+            timings, total_seconds = run_load(commands, rtm.url, args.runs, args.concurrency,
+                                              args.shared_home, args.serve)
+            print('Requests served: {}'.format(', '.join(
+                '{} {}'.format(count, method) for method, count in sorted(rtm.requests.items()))))
+
+    report(timings, total_seconds)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
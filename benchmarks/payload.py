@@ -0,0 +1,105 @@
+#!python3
+
+'''
+Synthetic rtm.tasks.getList data for the benchmarks, shaped like what RTM
+sends: many lists, tagged taskseries with notes, and recurring taskseries with
+several tasks (one per occurrence, most of them completed).
+'''
+
+import datetime
+import random
+
+
+tags = ['work', 'home', 'errands', 'urgent', 'someday', 'calls', 'reading', 'dftp',
+        'python', 'garden', 'finance', 'health', 'travel', 'family', 'writing']
+
+words = ['call', 'email', 'buy', 'fix', 'write', 'read', 'plan', 'review', 'book',
+         'pay', 'clean', 'the', 'report', 'plumber', 'milk', 'tickets', 'bills', 'car',
+         'notes', 'meeting', 'garden', 'draft', 'taxes', 'dentist', 'library']
+
+# every this many taskseries recurs
+recurring_every = 5
+
+start = datetime.datetime(2018, 1, 1, 5, tzinfo=datetime.timezone.utc)
+
+
+def rtm_lists(number_of_tasks, number_of_lists=1, seed=0):
+    '''
+    Return *number_of_tasks* tasks spread over *number_of_lists* lists, in the
+    structure returned by app.get_rtm_tasks. The same *seed* gives the same
+    tasks. About half of the tasks are due (at a time, or on a day), a third are
+    completed, and every fifth taskseries recurs.
+    '''
+
+    rand = random.Random(seed)
+    lists = [{'id': str(list_id), 'taskseries': []} for list_id in range(number_of_lists)]
+    task_count = 0
+    taskseries_id = 0
+
+    while task_count < number_of_tasks:
+        taskseries_id += 1
+        recurring = taskseries_id % recurring_every == 0
+        occurrences = min(rand.randint(2, 8) if recurring else 1,
+                          number_of_tasks - task_count)
+
+        taskseries = rtm_taskseries(rand, str(taskseries_id), occurrences, recurring)
+        rand.choice(lists)['taskseries'].append(taskseries)
+        task_count += occurrences
+
+    return lists
+
+
+def rtm_taskseries(rand, id, occurrences, recurring):
+    ''' A taskseries with *occurrences* tasks; all but the last completed if *recurring*. '''
+
+    notes = [{'id': '{}-{}'.format(id, i), 'created': rtm_date(start), 'modified': rtm_date(start),
+              'title': sentence(rand, 2), '$t': sentence(rand, rand.randint(5, 40))}
+             for i in range(rand.choice([0, 0, 0, 1, 2]))]
+    taskseries_tags = rand.sample(tags, rand.choice([0, 1, 1, 2, 3]))
+
+    taskseries = {'id': id, 'created': rtm_date(start), 'modified': rtm_date(start),
+                  'name': sentence(rand, rand.randint(2, 12)).capitalize(),
+                  'source': 'js', 'url': '', 'location_id': '',
+                  'tags': {'tag': taskseries_tags} if taskseries_tags else [],
+                  'participants': [],
+                  'notes': {'note': notes} if notes else [],
+                  'task': []}
+
+    if recurring:
+        taskseries['rrule'] = {'every': '1', '$t': 'FREQ=WEEKLY;INTERVAL=1'}
+
+    first_due = start + datetime.timedelta(days=rand.randint(0, 700))
+
+    for i in range(occurrences):
+        has_due_time = rand.random() < 0.3
+        if recurring:
+            due = first_due + datetime.timedelta(weeks=i)
+        elif rand.random() < 0.5:
+            due = start + datetime.timedelta(days=rand.randint(0, 1000))
+        else:
+            due = None
+        if due and has_due_time:
+            due += datetime.timedelta(minutes=15 * rand.randint(0, 60))
+
+        if recurring:
+            completed = due + datetime.timedelta(days=1) if i < occurrences - 1 else None
+        elif rand.random() < 0.33:
+            completed = start + datetime.timedelta(days=rand.randint(0, 1000), hours=14)
+        else:
+            completed = None
+
+        taskseries['task'].append({'id': '{}-{}'.format(id, i),
+                                   'due': rtm_date(due), 'has_due_time': str(int(has_due_time)),
+                                   'added': rtm_date(start), 'completed': rtm_date(completed),
+                                   'deleted': '', 'priority': rand.choice('N123'),
+                                   'postponed': '0', 'estimate': ''})
+
+    return taskseries
+
+
+def rtm_date(date):
+    return date.strftime('%Y-%m-%dT%H:%M:%SZ') if date else ''
+
+
+def sentence(rand, number_of_words):
+    return ' '.join(rand.choice(words) for _ in range(number_of_words))
@@ -0,0 +1,238 @@
+#!python3
+
+'''
+A local stand-in for the RTM REST API, for end-to-end tests and load tests.
+
+It answers rtm.auth.checkToken, rtm.lists.getList, rtm.settings.getList and
+rtm.tasks.getList (by list_id; a last_sync request gets no changes) with
+generated tasks (see benchmarks.payload) or a recorded rtm.tasks.getList
+response, checks every request's signature and auth token as RTM does, and
+can be made slow or unreliable. Requests with a token it doesn't know fail
+with error 98, as RTM's do once a token expires or is revoked, and new
+tokens are given out as by RTM: rtm.auth.getFrob, then a request for the auth
+page (which approves the frob straight away), then rtm.auth.getToken. Point
+dftp at it with DFTP_METHODS_URL, and DFTP_AUTH_URL to authenticate with it:
+
+    python -m benchmarks.rtm_server --tasks 10000 --latency 0.1 --error-rate 0.01
+    DFTP_METHODS_URL=http://127.0.0.1:8765/ DFTP_AUTH_URL=http://127.0.0.1:8765/ dftp tasks
+'''
+
+import argparse
+import gzip
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+from dftp import app
+from benchmarks.payload import rtm_lists
+
+
+settings = {'timezone': 'America/New_York', 'dateformat': '1', 'timeformat': '0',
+            'defaultlist': '0', 'language': 'en-US'}
+
+user = {'id': '1', 'username': 'standin', 'fullname': 'Stand In'}
+
+
+class RTMStandIn:
+    '''
+    The stand-in server, run in a thread. *fixture* is the path of a recorded
+    rtm.tasks.getList response (JSON) to serve instead of *number_of_tasks*
+    generated tasks. Each request waits *latency* seconds, and fails with a 503
+    with probability *error_rate*. Requests are accepted with *token*, or any
+    token it has given out since.
+
+        with RTMStandIn(number_of_tasks=100) as rtm:
+            app.methods_url = rtm.url
+    '''
+
+    def __init__(self, number_of_tasks=1000, number_of_lists=10, latency=0.0, error_rate=0.0,
+                 fixture=None, host='127.0.0.1', port=0, seed=0, token='standin-token'):
+        if fixture:
+            with open(fixture) as f:
+                self.tasks = json.load(f)['rsp']['tasks']['list']
+        else:
+            self.tasks = rtm_lists(number_of_tasks, number_of_lists, seed=seed)
+
+        self.lists = [{'id': rtm_list['id'], 'name': 'List {}'.format(rtm_list['id']),
+                       'deleted': '0', 'locked': '0', 'archived': '0', 'position': '-1',
+                       'smart': '0', 'sort_order': '0'} for rtm_list in self.tasks]
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = {}
+
+        self.tokens = {token}
+        # frobs given out, and whether the user has approved each
+        self.frobs = {}
+
+        # responses that don't change, encoded once
+        self.cache = {}
+
+        handler = type('Handler', (Handler,), {'rtm': self})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return 'http://{}:{}/'.format(host, port)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def fails(self):
+        with self.lock:
+            return self.random.random() < self.error_rate
+
+    def count(self, method):
+        with self.lock:
+            self.requests[method] = self.requests.get(method, 0) + 1
+
+    def answer(self, params):
+        ''' Return the "rsp" element of RTM's answer to a request with *params*. '''
+
+        api_sig = params.pop('api_sig', '')
+        if api_sig != app.make_api_sig(params):
+            return error('96', 'Invalid signature')
+        if params.get('api_key') != app.api_key:
+            return error('100', 'Invalid API Key')
+
+        method = params.get('method', '')
+
+        if method == 'rtm.auth.getFrob':
+            with self.lock:
+                frob = 'frob-{}'.format(len(self.frobs))
+                self.frobs[frob] = False
+            return ok(frob=frob)
+        if not method and params.get('frob') in self.frobs:
+            # the auth page, where the user approves the frob
+            self.frobs[params['frob']] = True
+            return ok()
+        if method == 'rtm.auth.getToken':
+            if not self.frobs.get(params.get('frob')):
+                return error('101', 'Invalid frob - did you authenticate?')
+            with self.lock:
+                token = 'standin-token-{}'.format(len(self.tokens))
+                self.tokens.add(token)
+            return ok(auth={'token': token, 'perms': 'read', 'user': user})
+
+        if params.get('auth_token') not in self.tokens:
+            return error('98', 'Login failed / Invalid auth token')
+
+        if method == 'rtm.auth.checkToken':
+            return ok(auth={'token': params.get('auth_token', ''), 'perms': 'read', 'user': user})
+        if method == 'rtm.lists.getList':
+            return ok(lists={'list': self.lists})
+        if method == 'rtm.settings.getList':
+            return ok(settings=settings)
+        if method == 'rtm.tasks.getList':
+            if params.get('last_sync'):
+                return ok(tasks={'rev': '1'})
+            tasks = [rtm_list for rtm_list in self.tasks
+                     if params.get('list_id', rtm_list['id']) == rtm_list['id']]
+            return ok(tasks={'rev': '1', 'list': tasks})
+
+        return error('112', 'Method "{}" not found'.format(method))
+
+    def response(self, params, encoding):
+        ''' Return the body of the response to *params*, encoded with *encoding*. '''
+
+        key = tuple(sorted(params.items())) + (encoding,)
+        body = self.cache.get(key)
+
+        if body is None:
+            body = json.dumps({'rsp': self.answer(dict(params))}).encode()
+            if encoding == 'gzip':
+                body = gzip.compress(body, compresslevel=5)
+            # only keep what depends on nothing but the request
+            if params.get('method') in ('rtm.lists.getList', 'rtm.settings.getList',
+                                        'rtm.tasks.getList'):
+                self.cache[key] = body
+
+        return body
+
+
+def ok(**data):
+    return dict(stat='ok', **data)
+
+
+def error(code, msg):
+    return {'stat': 'fail', 'err': {'code': code, 'msg': msg}}
+
+
+class Handler(BaseHTTPRequestHandler):
+    ''' Answers GET requests for the RTMStandIn in self.rtm. '''
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        params = dict(parse_qsl(urlsplit(self.path).query, keep_blank_values=True))
+        self.rtm.count(params.get('method', ''))
+
+        if self.rtm.latency:
+            time.sleep(self.rtm.latency)
+
+        if self.rtm.fails():
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        encoding = 'gzip' if 'gzip' in self.headers.get('Accept-Encoding', '') else ''
+        body = self.rtm.response(params, encoding)
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.rtm_server', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tasks', type=int, default=1000, help='number of tasks to generate')
+    parser.add_argument('--lists', type=int, default=10, help='number of lists to generate')
+    parser.add_argument('--fixture', help='recorded rtm.tasks.getList response to serve instead')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds to wait per request')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='fraction of requests to fail with a 503')
+    parser.add_argument('--token', default='standin-token',
+                        help='auth token to accept, besides those given out')
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args(argv)
+
+    rtm = RTMStandIn(args.tasks, args.lists, args.latency, args.error_rate, args.fixture,
+                     port=args.port, token=args.token)
+    print('Serving the RTM API at {} (Ctrl-C to stop)'.format(rtm.url))
+
+    try:
+        rtm.server.serve_forever()
+    except KeyboardInterrupt:
+        rtm.server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,272 @@
+#!python3
+
+'''
+Time the hot paths of processing tasks at increasing numbers of tasks, save the
+results as JSON, and compare them with a baseline (an earlier results file).
+
+    python -m benchmarks.run -o baseline.json
+    ... change things ...
+    python -m benchmarks.run -o new.json -b baseline.json
+
+Exits with status 1 if any benchmark is more than the threshold (default 20%)
+slower than in the baseline. Each time is the best of --repeat runs.
+'''
+
+import argparse
+import contextlib
+import datetime
+import importlib.util
+import io
+import json
+import platform
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.payload import rtm_lists
+
+
+sizes = [1000, 10000, 100000]
+
+number_of_lists = 20
+
+# benchmark name: function that takes the payload and returns the function to time
+benchmarks = {}
+
+
+def benchmark(name):
+    def register(setup):
+        benchmarks[name] = setup
+        return setup
+    return register
+
+
+def dates(**kwargs):
+    return dict({'due': '', 'due_before': '', 'due_after': '', 'completed_on': '',
+                 'completed_before': '', 'completed_after': ''}, **kwargs)
+
+
+date_filters = {'due': dates(due='6/1/18'),
+                'due_before': dates(due_before='6/1/19'),
+                'due_after': dates(due_after='6/1/18'),
+                'completed_on': dates(completed_on='6/1/18'),
+                'completed_before': dates(completed_before='6/1/19'),
+                'completed_after': dates(completed_after='6/1/18')}
+
+
+@benchmark('Task')
+def task_construction(payload):
+    from dftp.app import Task, TaskContext
+
+    def run():
+        context = TaskContext()
+        return [Task(taskseries, task, rtm_list['id'], context) for rtm_list in payload
+                for taskseries in rtm_list['taskseries'] for task in taskseries['task']]
+
+    return run
+
+
+@benchmark('create_Task_list')
+def create_Task_list(payload):
+    from dftp import app
+    return lambda: app.create_Task_list(payload)
+
+
+def create_Task_list_with(filter_dates):
+    ''' Return the setup of a benchmark of create_Task_list with *filter_dates*. '''
+
+    def setup(payload):
+        from dftp import app
+
+        def run():
+            try:
+                return app.create_Task_list(payload, dates=filter_dates)
+            except app.NoTasksException:
+                return []
+
+        return run
+
+    return setup
+
+
+for name, filter_dates in date_filters.items():
+    benchmarks['create_Task_list[{}]'.format(name)] = create_Task_list_with(filter_dates)
+
+
+@benchmark('split_list')
+def split_list(payload):
+    from dftp import app
+    tasks = app.create_Task_list(payload)
+    return lambda: app.split_list(list(tasks))
+
+
+@benchmark('human_date_to_arrow')
+def human_date_to_arrow(payload):
+    from dftp import app
+    user_dates = ['today', 'tomorrow', 'yesterday', '8/5/18', '8/5', '12/31/2019']
+    number_of_tasks = sum(len(taskseries['task']) for rtm_list in payload
+                          for taskseries in rtm_list['taskseries'])
+
+    def run():
+        for i in range(number_of_tasks):
+            app.human_date_to_arrow(user_dates[i % len(user_dates)], 'due')
+
+    return run
+
+
+@benchmark('format_date_display')
+def format_date_display(payload):
+    from dftp import app
+    tasks = app.create_Task_list(payload)
+    return lambda: [app.format_date_display(task.due) for task in tasks]
+
+
+@benchmark('display_tasks[print]')
+def display_tasks_print(payload):
+    from dftp import app
+    tasks = app.create_Task_list(payload)
+
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):
+            app.display_tasks('print', 'Benchmark', '', list(tasks), '')
+
+    return run
+
+
+@benchmark('display_tasks[export]')
+def display_tasks_export(payload):
+    from dftp import app
+    tasks = app.create_Task_list(payload)
+    directory = tempfile.mkdtemp()
+
+    # forced, or every run after the first would find the pdf up to date
+    def run():
+        app.display_tasks('export', 'Benchmark', '', list(tasks), '',
+                          filename=str(Path(directory).joinpath('tasks')), force=True)
+
+    return run
+
+
+@benchmark('display_tasks[export unchanged]')
+def display_tasks_export_unchanged(payload):
+    from dftp import app
+    tasks = app.create_Task_list(payload)
+    filename = str(Path(tempfile.mkdtemp()).joinpath('tasks'))
+    app.display_tasks('export', 'Benchmark', '', list(tasks), '', filename=filename)
+
+    def run():
+        with contextlib.redirect_stderr(io.StringIO()):
+            if app.display_tasks('export', 'Benchmark', '', list(tasks), '', filename=filename):
+                raise RuntimeError('{}.pdf was exported again'.format(filename))
+
+    return run
+
+
+def write_tasks_as(output_format):
+    ''' Return the setup of a benchmark of writing tasks in *output_format* to a file. '''
+
+    def setup(payload):
+        from dftp import app, formats
+        tasks = app.create_Task_list(payload)
+        filename = str(Path(tempfile.mkdtemp()).joinpath('tasks'))
+        return lambda: formats.write_tasks(iter(tasks), output_format, filename)
+
+    return setup
+
+
+for output_format in ['csv', 'jsonl', 'parquet', 'ics']:
+    if output_format == 'parquet' and importlib.util.find_spec('pyarrow') is None:
+        continue
+    benchmarks['write_tasks[{}]'.format(output_format)] = write_tasks_as(output_format)
+
+
+def run_benchmarks(sizes, repeat=3, match=''):
+    '''
+    Return {benchmark name: {number of tasks: seconds}} for the benchmarks
+    whose names contain *match*, each timed as the best of *repeat* runs.
+    '''
+
+    results = {}
+
+    for size in sizes:
+        payload = rtm_lists(size, number_of_lists)
+
+        for name, setup in benchmarks.items():
+            if match not in name:
+                continue
+
+            run = setup(payload)
+            times = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                run()
+                times.append(time.perf_counter() - start)
+
+            results.setdefault(name, {})[str(size)] = min(times)
+            print('{:<36} {:>8} {:>12.6f}'.format(name, size, min(times)), file=sys.stderr)
+
+    return results
+
+
+def compare(results, baseline, threshold):
+    '''
+    Return (name, size, baseline seconds, seconds) of each benchmark in both
+    *results* and *baseline* that is more than *threshold* (e.g. 0.2 for 20%)
+    slower than in the baseline.
+    '''
+
+    regressions = []
+
+    for name, times in results.items():
+        for size, seconds in times.items():
+            baseline_seconds = baseline.get(name, {}).get(size)
+            if baseline_seconds and seconds > baseline_seconds * (1 + threshold):
+                regressions.append((name, size, baseline_seconds, seconds))
+
+    return regressions
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.run', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-s', '--sizes', type=int, nargs='+', default=sizes,
+                        help='numbers of tasks to time each benchmark with')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='runs of each benchmark')
+    parser.add_argument('-k', '--match', default='', help='only benchmarks with this in their name')
+    parser.add_argument('-o', '--output', help='file to save the results to (JSON)')
+    parser.add_argument('-b', '--baseline', help='results file to compare with')
+    parser.add_argument('-t', '--threshold', type=float, default=0.2,
+                        help='how much slower than the baseline is a regression (0.2 = 20%%)')
+    args = parser.parse_args(argv)
+
+    from dftp import app
+    app.config['USER SETTINGS']['timezone'] = 'UTC'
+    app.config['USER SETTINGS']['dateformat'] = '1'
+
+    results = run_benchmarks(args.sizes, args.repeat, args.match)
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(
+            {'python': platform.python_version(), 'machine': platform.platform(),
+             'date': datetime.datetime.now().isoformat(timespec='seconds'),
+             'results': results}, indent=2))
+
+    if not args.baseline:
+        return 0
+
+    baseline = json.loads(Path(args.baseline).read_text())['results']
+    regressions = compare(results, baseline, args.threshold)
+
+    for name, size, baseline_seconds, seconds in regressions:
+        print('Slower: {} at {} tasks, {:.6f}s rather than {:.6f}s (+{:.0%})'.format(
+            name, size, seconds, baseline_seconds, seconds / baseline_seconds - 1))
+
+    if not regressions:
+        print('No regressions against {}.'.format(args.baseline))
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
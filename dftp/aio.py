@@ -0,0 +1,212 @@
+#!python3
+
+'''
+asyncio client for the RTM API, for use alongside (or instead of) the blocking
+functions in dftp.app.
+
+Requests are signed with app.make_api_sig and their responses checked with
+app.handle_response, so errors are dealt with in the same way, except that a
+rejected auth token raises app.AuthenticationException rather than asking the
+user to authenticate again in the middle of the event loop (run, which the
+dftp command uses, does that once the loop has finished). The user's settings
+are read from the config file when a client is created, if they haven't been
+already. This needs the httpx package (pip install "dftp[async]").
+
+    async with RTMClient() as rtm:
+        rtm_lists = await rtm.get_rtm_lists()
+'''
+
+import asyncio
+import time
+
+import click
+
+from dftp import app
+
+
+class RTMClient:
+    ''' Async equivalents of the functions in dftp.app that call the RTM API. '''
+
+    def __init__(self, transport=None):
+        import httpx
+
+        # the dftp command has read them already, but a program using this may not
+        if not app.config['USER SETTINGS']['token']:
+            app.load_config()
+
+        limits = httpx.Limits(
+            max_connections=app.config.getint('HTTP', 'pool_maxsize', fallback=app.pool_maxsize),
+            max_keepalive_connections=app.config.getint('HTTP', 'pool_connections',
+                                                        fallback=app.pool_connections))
+
+        timeout = app.config.getfloat('HTTP', 'timeout', fallback=app.request_timeout)
+
+        self.client = httpx.AsyncClient(limits=limits, transport=transport, timeout=timeout,
+                                        headers={'Accept-Encoding': 'gzip'})
+        self.semaphore = asyncio.Semaphore(app.max_concurrent_requests)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        await self.client.aclose()
+
+    async def rtm_get(self, url, params):
+        '''
+        Send a GET request to RTM, with at most max_concurrent_requests at once
+        and no faster than app's rate limiter allows. Raises
+        app.NetworkException if RTM can't be reached.
+        '''
+
+        import httpx
+
+        async with self.semaphore:
+            delay = app.get_rate_limiter().reserve()
+            if delay:
+                await asyncio.sleep(delay)
+            try:
+                r = await self.client.get(url, params=params)
+            except httpx.TransportError:
+                raise app.NetworkException
+
+        r.reason = r.reason_phrase  # as named by requests, for app.handle_response
+        return r
+
+    async def api_call(self, params):
+        '''
+        Like app.api_call, but raise app.AuthenticationException if RTM rejects
+        the auth token.
+        '''
+
+        params['api_sig'] = app.make_api_sig(params)
+
+        return app.handle_response(await self.rtm_get(app.methods_url, params),
+                                   reauthenticate=False)
+
+    async def get_frob(self):
+        ''' Returns *frob*. Part of the authentication process.'''
+
+        params = {'method':'rtm.auth.getFrob',
+                  'api_key':app.api_key,
+                  'format':'json'}
+
+        data = await self.api_call(params)
+
+        return data['frob']
+
+    async def get_token(self, frob):
+        ''' Return the auth data for a *frob* the user has approved. '''
+
+        params = {'api_key':app.api_key,
+                  'method':'rtm.auth.getToken',
+                  'format':'json',
+                  'frob':frob}
+
+        data = await self.api_call(params)
+
+        return data['auth']
+
+    async def check_token(self):
+        ''' See app.check_token. '''
+
+        params = {'api_key':app.api_key,
+                  'method':'rtm.auth.checkToken',
+                  'format':'json',
+                  'auth_token':app.config['USER SETTINGS']['token']}
+
+        data = await self.api_call(params)
+
+        app.config['USER SETTINGS']['token_checked'] = str(int(time.time()))
+        app.save(app.config)
+
+        return data
+
+    async def get_rtm_lists(self):
+        ''' Get all of the user's lists.'''
+
+        params = {'api_key':app.api_key,
+                  'method':'rtm.lists.getList',
+                  'format':'json',
+                  'auth_token':app.config['USER SETTINGS']['token']}
+
+        data = await self.api_call(params)
+
+        return data['lists']['list']
+
+    async def get_cached_lists(self, refresh=False):
+        ''' See app.get_cached_lists. '''
+
+        store = app.get_store()
+
+        if refresh or app.lists_expired(store):
+            store.set_lists(await self.get_rtm_lists(), time.time())
+
+        return store.get_lists()
+
+    async def get_list_id(self, list_name):
+        ''' See app.get_list_id. '''
+
+        store = app.get_store()
+        list_id = '' if app.lists_expired(store) else store.get_list_id(list_name)
+
+        if not list_id:
+            await self.get_cached_lists(refresh=True)
+            list_id = store.get_list_id(list_name)
+
+        if not list_id:
+            raise app.NoListException
+
+        return list_id
+
+    async def get_rtm_tasks(self, list_name, status, tag='', dates={}, last_sync='', list_id=''):
+        ''' See app.get_rtm_tasks. '''
+
+        if list_name:
+            list_id = await self.get_list_id(list_name)
+
+        params = app.rtm_tasks_params(list_id, status, tag, dates)
+
+        if last_sync:
+            params['last_sync'] = last_sync
+
+        data = await self.api_call(params)
+
+        return data['tasks'].get('list', [])
+
+    async def fetch_rtm_tasks(self, list_names, status, tag='', dates={}):
+        ''' See app.fetch_rtm_tasks; lists are fetched concurrently. '''
+
+        list_names = list(dict.fromkeys(list_names))
+
+        if not list_names:
+            return await self.get_rtm_tasks('', status, tag=tag, dates=dates)
+
+        list_ids = [await self.get_list_id(list_name) for list_name in list_names]
+        results = await asyncio.gather(*[self.get_rtm_tasks('', status, tag=tag, dates=dates,
+                                                            list_id=list_id)
+                                         for list_id in list_ids])
+
+        return [rtm_list for rtm_lists in results for rtm_list in rtm_lists]
+
+
+def run(method, *args, **kwargs):
+    '''
+    Call RTMClient.*method* with *args* and *kwargs* from synchronous code, such
+    as the commands in dftp.app, and return its result. If RTM rejects the auth
+    token, the user is asked to authenticate again and the call is repeated.
+    '''
+
+    async def call():
+        async with RTMClient() as rtm:
+            return await getattr(rtm, method)(*args, **kwargs)
+
+    try:
+        return asyncio.run(call())
+    except app.AuthenticationException:
+        click.secho('Error with Remember the Milk Authentication.', fg='red')
+        app.authenticate()
+
+    return asyncio.run(call())
@@ -1,5 +1,6 @@
 #!python3
 
+import os
 import sys
 from pathlib import Path
 import datetime
@@ -7,16 +8,21 @@ import textwrap
 import hashlib
 import configparser
 import re
+import time
+import heapq
+import threading
+from bisect import bisect_left
+from operator import attrgetter
+from concurrent.futures import ThreadPoolExecutor
 
 import click
-import requests
-import arrow
-from tabulate import tabulate
+from click.globals import resolve_color_default
 
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Table, TableStyle
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib import colors
+from dftp.store import TaskStore, store_file
+
+# requests, arrow, tabulate and reportlab are slow to import; they are imported
+# only in the functions that use them, so that commands that don't need them
+# (and dftp --help) start quickly.
 
 
 # If you want to develop your own application based off this one, please
@@ -24,75 +30,368 @@ from reportlab.lib import colors
 api_key = '4e1d92b0c92e573ca0aafcdee63705c2'
 shared_secret = '648e3b6f390699b7'
 
-auth_url = 'https://www.rememberthemilk.com/services/auth/'
-methods_url = 'https://api.rememberthemilk.com/services/rest/'
+# RTM's auth page and API endpoint; DFTP_AUTH_URL and DFTP_METHODS_URL point
+# dftp at others, such as the stand-in server in benchmarks/rtm_server.py
+auth_url = os.environ.get('DFTP_AUTH_URL', 'https://www.rememberthemilk.com/services/auth/')
+methods_url = os.environ.get('DFTP_METHODS_URL', 'https://api.rememberthemilk.com/services/rest/')
+
+# default sizes of the HTTP connection pool (override in the [HTTP] section of
+# the config file); RTM allows only a few requests at a time anyway
+pool_connections = 2
+pool_maxsize = 4
+
+# seconds to wait for RTM to connect or send data (override in [HTTP] as timeout)
+request_timeout = 30
+
+# whether to use the asyncio client in dftp.aio (set with the --async option)
+use_async = False
+
+# whether to answer only from the local store, without contacting RTM (set with
+# the --offline option)
+offline = False
+
+# RTM allows an average of one request per second, with bursts of up to three;
+# requests are held back to keep to that (see RateLimiter), and no more than
+# max_concurrent_requests are sent at once (override requests_per_second in [HTTP])
+requests_per_second = 1
+max_concurrent_requests = 3
+
+# seconds to trust a successful rtm.auth.checkToken before checking again
+# (override with token_ttl in the config file)
+token_ttl = 24 * 60 * 60
+
+# seconds before the cached lists (used to look up list ids) are fetched again
+# (override with lists_ttl in the config file)
+lists_ttl = 24 * 60 * 60
+
+# seconds before the last sync that the next one asks RTM for changes since, in
+# case the local clock (which times syncs) is ahead of RTM's; changes made then
+# are fetched again, which does no harm, rather than missed
+sync_overlap = 15 * 60
+
+# least seconds between starting syncs in the background, so that several
+# commands run in a row don't each start one
+background_sync_interval = 60
+
+# whether to start those syncs at all; DFTP_BACKGROUND_SYNC=0 turns them off,
+# e.g. for the load tests in benchmarks/load.py
+background_sync = os.environ.get('DFTP_BACKGROUND_SYNC', '1') != '0'
 
+# commands passed to dftp serve when it is running (see dftp.daemon)
+daemon_commands = ('tasks', 'lists')
 
-# create or read config file (in user's home directory)
+
+# user settings, read from (or created as) a config file in the user's home
+# directory by load_config()
 global config
 config = configparser.ConfigParser()
 
 global config_file
 config_file = Path().home().joinpath('.dftp')
 
-if config_file.is_file():
-    config.read(config_file)
-else:
-    config['USER SETTINGS'] = {'token': '',
-                               'username': '',
-                               'name': '',
-                               'timezone': '',
-                               'dateformat': '',
-                               'timeformat': ''}
-    with open(config_file, 'w') as fp:
-        config.write(fp)
+default_settings = {'token': '',
+                    'token_checked': '',
+                    'username': '',
+                    'name': '',
+                    'timezone': '',
+                    'dateformat': '',
+                    'timeformat': ''}
+
+config['USER SETTINGS'] = default_settings
+
+
+# width of the date column when streaming tasks; the longest formatted date is
+# e.g. "Sep 30, 2018 12:00 pm"
+stream_date_width = 21
+
+# rows per table when exporting to pdf
+export_chunk_size = 200
+
+# part of the fingerprint of each exported pdf (see export_fingerprint); change
+# it when the layout changes, so that pdfs exported before are made again
+export_layout = 1
+
+# formats tasks can be written in for other programs (see dftp.formats)
+export_formats = ('csv', 'jsonl', 'parquet', 'ics')
+
+# due or completed time of tasks that don't have one; it's larger than any real
+# timestamp, so tasks without a due date sort after those with one
+NO_DATE = sys.maxsize
 
 
 ################################################################################
 # CLASSES
 ################################################################################
 class Task:
+    '''
+    A single task (one occurrence of an RTM taskseries), holding only what dftp
+    displays or filters on, and the ids of its list and of the task itself (id
+    is the taskseries', which a recurring task's occurrences share). Due and
+    completed times are seconds since the epoch (utc), or NO_DATE if the task
+    doesn't have one; has_due_time is False for a task due on a date but at no
+    particular time (which RTM gives as midnight in the user's timezone).
+
+    Using __slots__ and integer times (rather than an attribute dict, iso strings,
+    and lists of tags, notes and participants) brings the memory a task takes
+    from about 400 to 190 bytes: about 100 for the Task itself, the rest for its
+    times and tuple of tags. Measured with tracemalloc while creating 20,000
+    tasks (names and ids are shared with the RTM data, so aren't counted).
+    '''
+
+    __slots__ = ('id', 'task_id', 'name', 'list_id', 'tags', 'due', 'has_due_time', 'completed',
+                 'is_overdue')
+
+    def __init__(self, taskseries, task, list_id='', context=None):
+        if context is None:
+            context = TaskContext()
 
-    def __init__(self, taskseries, task):
         self.id = taskseries['id']
+        self.task_id = task.get('id', '')
         self.name = taskseries['name']
-        self.url = '' if not taskseries['url'] else taskseries['url']
+        self.list_id = list_id
+        # RTM sends [] for no tags, or {'tag': [tags]}
+        self.tags = as_tuple(taskseries['tags']['tag']) if 'tag' in taskseries['tags'] else ()
+        self.due = to_timestamp(task['due'])
+        self.completed = to_timestamp(task['completed'])
+
+        # a task due on a date but at no particular time is due at midnight (in
+        # the user's timezone) and is only overdue once that day is past
+        has_due_time = task.get('has_due_time')
+        self.has_due_time = has_due_time != '0'
+
+        if self.due == NO_DATE:
+            self.is_overdue = False
+        elif has_due_time == '1':
+            self.is_overdue = self.due < context.now
+        elif has_due_time == '0':
+            self.is_overdue = self.due < context.today_start
+        else:
+            self.is_overdue = self.due < context.now and self.due != context.today_start
 
-        # keep due and completed times as strings in order to enable easy sorting later
-        self.due = 'never' if not task['due'] else task['due']  # iso format, utc
-        self.completed = task['completed']  # iso format, utc
 
-        self.is_overdue = False
+class TaskContext:
+    '''
+    The current time and the start of today in the user's timezone, worked out
+    once for all the Tasks created together, so that whether each one is
+    overdue is an integer comparison.
+    '''
 
-        # set .is_overdue if the task has a due date(time)
-        if self.due != 'never':
-            task_due = arrow.get(task['due']).to(config['USER SETTINGS']['timezone'])
+    __slots__ = ('now', 'today_start', 'tz')
 
-            # if it's due at midnight, it's due sometime that day, so don't
-            # make it overdue unless date (not time) is past
-            if str(task_due.time()) == '00:00:00':
-                if task_due.date() < arrow.get().to(config['USER SETTINGS']['timezone']).date():
-                    self.is_overdue = True
-            else:
-                if task_due < arrow.get(tzinfo=config['USER SETTINGS']['timezone']):
-                    self.is_overdue = True
+    def __init__(self, now=None):
+        from dateutil import tz
+
+        self.tz = tz.gettz(config['USER SETTINGS']['timezone'])
+        now = time.time() if now is None else now
+        today = datetime.datetime.fromtimestamp(now, self.tz).date()
+
+        self.now = int(now)
+        self.today_start = int(datetime.datetime(today.year, today.month, today.day,
+                                                 tzinfo=self.tz).timestamp())
+
+
+class TagFilter:
+    '''
+    The tags a task must have: all of *all_of*, at least one of *any_of* (if
+    given), and none of *none_of*. Each may be one tag or several. Wherever tasks
+    are filtered by tag, one tag or a tuple of tags (which tasks must all have)
+    can be given instead of a TagFilter.
+    '''
+
+    __slots__ = ('all_of', 'any_of', 'none_of')
+
+    def __init__(self, all_of=(), any_of=(), none_of=()):
+        self.all_of = as_tuple(all_of)
+        self.any_of = as_tuple(any_of)
+        self.none_of = as_tuple(none_of)
+
+    def __bool__(self):
+        return bool(self.all_of or self.any_of or self.none_of)
+
+    def matches(self, tags):
+        ''' Return whether a task with *tags* passes the filter. '''
+        return (all(tag in tags for tag in self.all_of)
+                and (not self.any_of or any(tag in tags for tag in self.any_of))
+                and not any(tag in tags for tag in self.none_of))
+
+
+class TaskIndex:
+    '''
+    Tasks kept sorted by due and by completed time, and indexed by tag, so that
+    the tasks matching the filters of the tasks command are found by bisection
+    and set operations rather than by checking every task. Build one once and
+    query it as often as needed, e.g. for several reports from the same tasks.
+
+        index = TaskIndex(iter_tasks(rtm_lists))
+        tasks = index.query({'due_before': 'today'}, 'incomplete',
+                            TagFilter(any_of=('work', 'urgent')))
+    '''
+
+    def __init__(self, tasks):
+        tasks = list(tasks)
+
+        # where each task came in *tasks*, to put tasks found back in that order
+        self.position = {task: i for i, task in enumerate(tasks)}
+
+        self.by_due = sorted(tasks, key=attrgetter('due'))
+        self.due = [task.due for task in self.by_due]
+
+        # sorted stably, so the incomplete tasks at the end stay in order of due
+        self.by_completed = sorted(self.by_due, key=attrgetter('completed'))
+        self.completed = [task.completed for task in self.by_completed]
+        self.first_incomplete = bisect_left(self.completed, NO_DATE)
+        self.incomplete_due = [task.due for task in self.by_completed[self.first_incomplete:]]
+
+        # where each task is in by_due and by_completed
+        self.due_rank = {task: i for i, task in enumerate(self.by_due)}
+        self.completed_rank = {task: i for i, task in enumerate(self.by_completed)}
+
+        self.tasks_by_tag = {}
+        for task in self.by_due:
+            for tag in task.tags:
+                self.tasks_by_tag.setdefault(tag, set()).add(task)
+
+    def __len__(self):
+        return len(self.by_due)
+
+    def query(self, dates={}, status='', tag=''):
+        '''
+        Return the tasks matching *dates*, *status* and *tag* (as for
+        create_Task_list) sorted by due time, or by completed time if filtering
+        on either.
+        '''
+
+        due_range = date_range(dates.get('due'), dates.get('due_before'),
+                               dates.get('due_after'), 'due')
+        completed_range = date_range(dates.get('completed_on'), dates.get('completed_before'),
+                                     dates.get('completed_after'), 'completed')
+
+        # incomplete tasks weren't completed on any date
+        if status == 'incomplete' and completed_range:
+            return []
+
+        # find the run of sorted tasks (tasks[start:stop]) with matching dates
+        if completed_range or status == 'completed':
+            tasks, rank = self.by_completed, self.completed_rank
+            start, stop = self.bounds(self.completed, completed_range or (-NO_DATE, NO_DATE))
+        elif status == 'incomplete':
+            tasks, rank = self.by_completed, self.completed_rank
+            start, stop = self.bounds(self.incomplete_due, due_range)
+            start, stop = start + self.first_incomplete, stop + self.first_incomplete
+            due_range = None
+        else:
+            tasks, rank = self.by_due, self.due_rank
+            start, stop = self.bounds(self.due, due_range)
+            due_range = None
+
+        tag_filter = as_tag_filter(tag)
+        tagged = self.tagged(tag_filter)
+
+        # go through whichever of the tagged tasks and the run is smaller
+        if tagged is not None and len(tagged) < stop - start:
+            found = sorted((task for task in tagged if start <= rank[task] < stop),
+                           key=rank.__getitem__)
+        else:
+            found = tasks[start:stop]
+            if tagged is not None:
+                found = [task for task in found if task in tagged]
+
+        if tag_filter.none_of:
+            excluded = set().union(*(self.tasks_by_tag.get(tag, ()) for tag in tag_filter.none_of))
+            found = [task for task in found if task not in excluded]
+
+        if due_range:
+            found = [task for task in found if due_range[0] <= task.due < due_range[1]]
+
+        return found
+
+    def tagged(self, tag_filter):
+        '''
+        Return the set of tasks with the tags *tag_filter* requires (all of
+        all_of and one of any_of), or None if it doesn't require any.
+        '''
 
-        self.priority = '' if task['priority'] == 'N' else task['priority']
+        sets = [self.tasks_by_tag.get(tag, set()) for tag in tag_filter.all_of]
+
+        if tag_filter.any_of:
+            sets.append(set().union(*(self.tasks_by_tag.get(tag, ()) for tag in tag_filter.any_of)))
+
+        if not sets:
+            return None
+
+        sets.sort(key=len)
+        return sets[0].intersection(*sets[1:])
+
+    @staticmethod
+    def bounds(keys, date_range):
+        '''
+        Return the start and stop of the slice of *keys* (sorted) that are in
+        *date_range* (lowest included, highest excluded), or all of them if None.
+        '''
+
+        if date_range is None:
+            return 0, len(keys)
+
+        return bisect_left(keys, date_range[0]), bisect_left(keys, date_range[1])
+
+
+class RateLimiter:
+    '''
+    Token bucket that keeps requests to RTM within its rate limit: up to *burst*
+    requests straight away, then *rate* a second on average. Shared by the
+    blocking and asyncio clients (see get_rate_limiter), and by threads.
+    *clock* returns the time in seconds, as time.monotonic does.
+    '''
 
-        self.tags = []
-        if 'tag' in taskseries['tags']:
-            for tag in taskseries['tags']['tag']:
-                self.tags.append(tag)
+    def __init__(self, rate, burst, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.tokens = burst
+        self.updated = clock()
+        self.lock = threading.Lock()
 
-        self.notes = []
-        if 'note' in taskseries['notes']:
-            for note in taskseries['notes']['note']:
-                self.notes.append(note['$t'])
+    def reserve(self):
+        '''
+        Take a token for a request and return the seconds to wait before
+        sending it. Tokens taken before they have been refilled are owed, so
+        requests reserved together are spread out at *rate*.
+        '''
+
+        with self.lock:
+            now = self.clock()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class LazyStory(list):
+    '''
+    A list of flowables for reportlab's doc.build that takes them from
+    *flowables* (an iterable) only as they are needed. reportlab only ever looks
+    at the first few flowables and deletes each once it is drawn, so keeping
+    *lookahead* of them in the list is enough.
+    '''
+
+    def __init__(self, flowables, lookahead=2):
+        super().__init__()
+        self.flowables = iter(flowables)
+        self.lookahead = lookahead
+        self.fill()
+
+    def fill(self):
+        while len(self) < self.lookahead:
+            try:
+                self.append(next(self.flowables))
+            except StopIteration:
+                break
+
+    def __delitem__(self, index):
+        super().__delitem__(index)
+        self.fill()
 
-        self.participants = []
-        if 'contact' in taskseries['participants']:
-            for participant in taskseries['participants']['contact']:
-                self.participants.append(participant['fullname'])
 
 class dftpException(BaseException):
     pass
@@ -106,6 +405,27 @@ class NoTasksException(dftpException):
         if not message:
             self.message = 'No tasks with those parameters.'
 
+class NetworkException(dftpException, SystemExit):
+    '''
+    RTM couldn't be reached or didn't answer properly. Unless caught (e.g. to
+    fall back on the local store), it exits with its message, as sys.exit does.
+    '''
+    def __init__(self, message=''):
+        self.message = message
+        if not message:
+            self.message = "Couldn't connect to Remember the Milk."
+        SystemExit.__init__(self, self.message)
+
+class AuthenticationException(dftpException):
+    '''
+    RTM rejected the auth token (error 98) where the user can't be asked to
+    authenticate again then and there, e.g. in the event loop of dftp.aio.
+    '''
+    def __init__(self, message=''):
+        self.message = message
+        if not message:
+            self.message = 'Remember the Milk rejected the auth token: run dftp to authenticate again.'
+
 class NoListException(dftpException):
     def __init__(self, message=''):
         self.message = message
@@ -150,10 +470,7 @@ def get_frob():
               'api_key':api_key,
               'format':'json'}
 
-    # create signature from existing params and add as parameter
-    params['api_sig'] = make_api_sig(params)
-
-    data = handle_response(requests.get(methods_url, params=params))
+    data = api_call(params)
 
     return data['frob']
 
@@ -171,7 +488,7 @@ def authenticate():
               'perms':'read'}
     params['api_sig'] = make_api_sig(params)
 
-    r_auth = requests.get(auth_url, params=params)
+    r_auth = rtm_get(auth_url, params)
 
     if r_auth.status_code != 200:
         click.secho(textwrap.fill('Error ({}:{}) connecting to Remember the Milk. '
@@ -193,12 +510,10 @@ def authenticate():
               'format':'json',
               'frob':frob}
 
-    # sign every request
-    params['api_sig'] = make_api_sig(params)
-
-    data = handle_response(requests.get(methods_url, params=params))
+    data = api_call(params)
 
     config['USER SETTINGS']['token'] = data['auth']['token']
+    config['USER SETTINGS']['token_checked'] = str(int(time.time()))
     config['USER SETTINGS']['username'] = data['auth']['user']['username']
     config['USER SETTINGS']['name'] = data['auth']['user']['fullname']
 
@@ -208,9 +523,7 @@ def authenticate():
               'format':'json',
               'auth_token':config['USER SETTINGS']['token']}
 
-    params['api_sig'] = make_api_sig(params)
-
-    data = handle_response(requests.get(methods_url, params=params))
+    data = api_call(params)
 
     config['USER SETTINGS']['timezone'] = data['settings']['timezone']
     config['USER SETTINGS']['dateformat'] = data['settings']['dateformat']
@@ -224,32 +537,170 @@ def authenticate():
 
     return
 
+
+def token_check_due():
+    ''' Return True if the auth token has not been checked within token_ttl. '''
+
+    try:
+        checked = int(config['USER SETTINGS'].get('token_checked', ''))
+    except ValueError:
+        return True
+
+    ttl = config['USER SETTINGS'].getint('token_ttl', fallback=token_ttl)
+
+    return time.time() - checked >= ttl
+
+
+def check_token():
+    ''' Verify the auth token with RTM and remember when it was verified. '''
+
+    params = {'api_key':api_key,
+              'method':'rtm.auth.checkToken',
+              'format':'json',
+              'auth_token':config['USER SETTINGS']['token']}
+
+    data = api_call(params)
+
+    config['USER SETTINGS']['token_checked'] = str(int(time.time()))
+    save(config)
+
+    return data
+
+
+################################################################################
+# HTTP TRANSPORT
+################################################################################
+global session
+session = None
+
+global rate_limiter
+rate_limiter = None
+
+
+def get_session():
+    '''
+    Return the shared HTTP session used for every request to RTM, creating it
+    on first use. Connections are pooled and kept alive, so only the first
+    request of a run pays for the TCP and TLS handshakes.
+    '''
+
+    global session
+
+    if session is None:
+        import requests
+
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=config.getint('HTTP', 'pool_connections', fallback=pool_connections),
+            pool_maxsize=config.getint('HTTP', 'pool_maxsize', fallback=pool_maxsize))
+
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers.update({'Accept-Encoding': 'gzip', 'Connection': 'keep-alive'})
+
+    return session
+
+
+def get_rate_limiter():
+    ''' Return the RateLimiter every request to RTM waits on, creating it on first use. '''
+
+    global rate_limiter
+
+    if rate_limiter is None:
+        rate_limiter = RateLimiter(
+            config.getfloat('HTTP', 'requests_per_second', fallback=requests_per_second),
+            max_concurrent_requests)
+
+    return rate_limiter
+
+
+def rtm_get(url, params, stream=False):
+    '''
+    Send a GET request to RTM through the shared session, once the rate limiter
+    allows. With *stream*, the body is left to be read from the response's raw
+    attribute. Raises NetworkException if RTM can't be reached.
+    '''
+
+    import requests
+
+    delay = get_rate_limiter().reserve()
+    if delay:
+        time.sleep(delay)
+
+    try:
+        return get_session().get(url, params=params, stream=stream,
+                                 timeout=config.getfloat('HTTP', 'timeout',
+                                                         fallback=request_timeout))
+    except requests.exceptions.RequestException:
+        raise NetworkException
+
+
+def api_call(params, reauthenticate=True):
+    '''
+    Sign *params*, call the RTM API with them and return the response data.
+
+    If RTM rejects the auth token, handle_response re-authenticates the user,
+    and the call is repeated once with the new token; or, if not
+    *reauthenticate* (e.g. where the user can't be asked), it raises
+    AuthenticationException.
+    '''
+
+    params['api_sig'] = make_api_sig(params)
+    data = handle_response(rtm_get(methods_url, params), reauthenticate)
+
+    if data is None and 'auth_token' in params:
+        del params['api_sig']
+        params['auth_token'] = config['USER SETTINGS']['token']
+        params['api_sig'] = make_api_sig(params)
+        data = handle_response(rtm_get(methods_url, params))
+
+    return data
+
+
 ################################################################################
 # GET DATA FROM REMEMBER THE MILK
 ################################################################################
-def handle_response(r):
+def handle_response(r, reauthenticate=True):
     ''' Deal with common responses from RTM API.'''
 
+    check_status(r)
+
+    return handle_data(r.json()['rsp'], reauthenticate)
+
+
+def check_status(r):
+    ''' Raise NetworkException (exiting, unless caught) if RTM could not be reached. '''
+
     if r.status_code != 200:
         click.secho(textwrap.fill('Error ({}:{}) connecting to Remember the '
                 'Milk. Please try again later.'.format(r.status_code, r.reason)), fg='red')
-        sys.exit('Bad Status Code')
-    else:
-        data = r.json()['rsp']
+        raise NetworkException('Bad Status Code')
 
-        if data['stat'] != 'ok':
-            if data['err']['code'] == '98':  # Login failed / Invalid auth token
-                click.secho('Error with Remember the Milk Authentication.', fg='red')
-                authenticate()
-                return
-            else:
-                click.secho('Error: {}'.format(data['err']['msg']), fg='red')
-                sys.exit('Error {}.'.format(data['err']['code']))
 
-        return data
+def handle_data(data, reauthenticate=True):
+    '''
+    Return the "rsp" element of a response from RTM if the call succeeded.
+    Otherwise, re-authenticate the user (and return None) if the token was
+    rejected, or raise AuthenticationException instead if not *reauthenticate*,
+    or exit.
+    '''
+
+    if data['stat'] != 'ok':
+        if data['err']['code'] == '98':  # Login failed / Invalid auth token
+            config['USER SETTINGS']['token_checked'] = ''
+            if not reauthenticate:
+                raise AuthenticationException
+            click.secho('Error with Remember the Milk Authentication.', fg='red')
+            authenticate()
+            return
+        else:
+            click.secho('Error: {}'.format(data['err']['msg']), fg='red')
+            sys.exit('Error {}.'.format(data['err']['code']))
+
+    return data
 
 
-def get_rtm_lists():
+def get_rtm_lists(reauthenticate=True):
     ''' Get all of the user's lists.'''
 
     params = {'api_key':api_key,
@@ -257,152 +708,587 @@ def get_rtm_lists():
               'format':'json',
               'auth_token':config['USER SETTINGS']['token']}
 
+    data = api_call(params, reauthenticate)
+
+    return data['lists']['list']
+
+
+def lists_expired(store):
+    ''' Return True if the lists in *store* are older than lists_ttl. '''
+
+    ttl = config['USER SETTINGS'].getint('lists_ttl', fallback=lists_ttl)
+
+    return time.time() - store.lists_fetched >= ttl
+
+
+def get_cached_lists(refresh=False):
+    '''
+    Return the user's lists from the local store, first fetching them from RTM
+    if they have expired or *refresh* is set.
+    '''
+
+    store = get_store()
+
+    if refresh or lists_expired(store):
+        store.set_lists(get_rtm_lists(), time.time())
+
+    return store.get_lists()
+
+
+def get_list_id(list_name):
+    '''
+    Return the id of the list named *list_name*, looked up in the cached lists.
+    A list missing from them may have been created or renamed since they were
+    fetched, so they are refreshed once before giving up.
+    '''
+
+    store = get_store()
+    list_id = '' if lists_expired(store) else store.get_list_id(list_name)
+
+    if not list_id:
+        get_cached_lists(refresh=True)
+        list_id = store.get_list_id(list_name)
+
+    if not list_id:
+        raise NoListException
+
+    return list_id
+
+
+def stored_list_id(store, list_name):
+    '''
+    Return the id of the list named *list_name* from the lists in *store*, even
+    if they have expired, only asking RTM if the list isn't there (and not
+    --offline).
+    '''
+
+    list_id = store.get_list_id(list_name)
+
+    if not list_id and not offline:
+        list_id = get_list_id(list_name)
+
+    if not list_id:
+        raise NoListException
+
+    return list_id
+
+
+def stored_list_names(store):
+    ''' Return {list id: list name} of the lists in *store*, even if they have expired. '''
+    return {rtm_list['id']: rtm_list['name'] for rtm_list in store.get_lists()}
+
+
+def get_smart_lists(store, list_ids, status, tag='', dates={}):
+    '''
+    Return {list id: tasks, as from get_rtm_tasks} for the smart lists among
+    *list_ids*, fetched from RTM, which works out which tasks are in them from
+    their searches; the store only files tasks under the lists they are in.
+    '''
+
+    smart_ids = [rtm_list['id'] for rtm_list in store.get_lists()
+                 if rtm_list.get('smart') == '1' and rtm_list['id'] in list_ids]
+
+    if smart_ids and offline:
+        raise NoListException("Smart lists are worked out by RTM, so can't be shown --offline.")
+
+    if use_async:
+        from dftp import aio
+        return {list_id: aio.run('get_rtm_tasks', '', status, tag=tag, dates=dates,
+                                 list_id=list_id) for list_id in smart_ids}
+
+    return {list_id: get_rtm_tasks('', status, tag=tag, dates=dates, list_id=list_id)
+            for list_id in smart_ids}
+
+
+def get_rtm_tasks(list_name, status, tag='', dates={}, last_sync='', list_id='',
+                  reauthenticate=True):
+
+    if list_name:
+        list_id = get_list_id(list_name)
+
+    params = rtm_tasks_params(list_id, status, tag, dates)
+
+    # only return taskseries added, modified, or deleted since then
+    if last_sync:
+        params['last_sync'] = last_sync
+
+    data = api_call(params, reauthenticate)
+
+    # if list_name has been passed, this is is a list (with one item) of lists
+    # of the taskseries in that list; if no list_name, this is a list (with as
+    # as many items as the user has lists) of lists of taskseries; if no tasks
+    # match, RTM leaves it out
+    return data['tasks'].get('list', [])
+
+
+def iter_rtm_tasks(list_name, status, tag='', dates={}):
+    '''
+    Like get_rtm_tasks, but return a generator that parses the response as it
+    is downloaded and yields each taskseries as soon as it has been read, as a
+    list (in the same format as RTM's) of its own. That way, only the tasks kept
+    by create_Task_list stay in memory, rather than the whole response.
+
+    This needs the ijson package; without it, the whole response is read at
+    once and then yielded in the same way.
+    '''
+
+    # look up the list now rather than when first iterated, so an unknown list
+    # is reported here
+    list_id = get_list_id(list_name) if list_name else ''
+
+    try:
+        import ijson
+    except ImportError:
+        rtm_lists = get_rtm_tasks('', status, tag=tag, dates=dates, list_id=list_id)
+        return ({'id': rtm_list['id'], 'taskseries': [taskseries]}
+                for rtm_list in rtm_lists for taskseries in rtm_list.get('taskseries', []))
+
+    params = rtm_tasks_params(list_id, status, tag, dates)
     params['api_sig'] = make_api_sig(params)
 
-    data = handle_response(requests.get(methods_url, params=params))
+    def parse():
+        r = rtm_get(methods_url, params, stream=True)
+        check_status(r)
+        r.raw.decode_content = True  # let urllib3 undo any gzip encoding
+
+        taskseries_prefix = 'rsp.tasks.list.item.taskseries.item'
+        rtm_list_id = ''
+        builder = None
+        error = {}
+
+        for prefix, event, value in ijson.parse(r.raw):
+            if builder is not None:
+                builder.event(event, value)
+                if prefix == taskseries_prefix and event == 'end_map':
+                    yield {'id': rtm_list_id, 'taskseries': [builder.value]}
+                    builder = None
+            elif prefix == taskseries_prefix and event == 'start_map':
+                builder = ijson.ObjectBuilder()
+                builder.event(event, value)
+            elif prefix == 'rsp.tasks.list.item.id':
+                rtm_list_id = value
+            elif prefix in ('rsp.stat', 'rsp.err.code', 'rsp.err.msg'):
+                error[prefix.split('.')[-1]] = value
+
+        if error.get('stat') != 'ok':
+            data = handle_data({'stat': error.get('stat'),
+                                'err': {'code': error.get('code'), 'msg': error.get('msg')}})
+
+            # the user has been re-authenticated, so try again with the new token
+            if data is None:
+                yield from iter_rtm_tasks(list_name, status, tag=tag, dates=dates)
+
+    return parse()
+
+
+def fetch_rtm_tasks(list_names, status, tag='', dates={}):
+    '''
+    Return the tasks of all lists named in *list_names* (or of all the user's
+    lists if there are none), in the same format as get_rtm_tasks.
 
-    return data['lists']['list']
+    The lists are fetched concurrently, with no more than max_concurrent_requests
+    requests at once, and no faster than the rate limiter allows.
+    '''
 
+    list_names = list(dict.fromkeys(list_names))  # drop duplicates, keep order
 
-def get_rtm_tasks(list_name, status):
+    if len(list_names) < 2:
+        return iter_rtm_tasks(list_names[0] if list_names else '', status, tag=tag, dates=dates)
+
+    # look up ids (from the local store) and create the session and rate limiter
+    # before starting any threads, since none can be shared while being set up
+    list_ids = [get_list_id(list_name) for list_name in list_names]
+    get_session()
+    get_rate_limiter()
+
+    def fetch(list_id):
+        return get_rtm_tasks('', status, tag=tag, dates=dates, list_id=list_id)
+
+    with ThreadPoolExecutor(max_workers=min(len(list_ids), max_concurrent_requests)) as executor:
+        return [rtm_list for rtm_lists in executor.map(fetch, list_ids)
+                for rtm_list in rtm_lists]
+
+
+def rtm_tasks_params(list_id, status, tag='', dates={}):
+    ''' Return the parameters for a call to rtm.tasks.getList. '''
 
     params = {'api_key':api_key,
               'method':'rtm.tasks.getList',
               'format':'json',
               'auth_token':config['USER SETTINGS']['token']}
 
-    if list_name:
-        rtm_lists = get_rtm_lists()
+    if list_id:
+        params['list_id'] = list_id
 
-        list_id = ''
-        for rtm_list in rtm_lists:
-            if list_name == rtm_list['name']:
-                list_id = rtm_list['id']
+    # have RTM do as much of the filtering as it can, so only matching tasks
+    # are sent; create_Task_list still checks every task it gets
+    rtm_filter = build_rtm_filter(tag, dates, status)
+    if rtm_filter:
+        params['filter'] = rtm_filter
 
-        if not list_id:
-            raise NoListException
+    return params
 
-        params['list_id'] = list_id
 
+def build_rtm_filter(tag='', dates={}, status=''):
+    '''
+    Translate the filters of the tasks command into a query in RTM's search
+    syntax (see https://www.rememberthemilk.com/help/?ctx=basics.search.advanced),
+    with all of them combined with AND. *tag* may be one tag, several, or a
+    TagFilter.
+    '''
 
-    if status == 'completed':
-        params['filter'] = 'status:completed'
+    terms = []
 
+    if status == 'completed':
+        terms.append('status:completed')
     if status == 'incomplete':
-        params['filter'] = 'status:incompleted'
+        terms.append('status:incompleted')
 
-    # if other options included, have to filter for thoese later since
-    # the query can take only one params['filter'] parameter and it doesn't
-    # seem like they can be chained together
+    tag_filter = as_tag_filter(tag)
 
-    params['api_sig'] = make_api_sig(params)
+    for tag in tag_filter.all_of:
+        terms.append(rtm_tag_term(tag))
+    if len(tag_filter.any_of) == 1:
+        terms.append(rtm_tag_term(tag_filter.any_of[0]))
+    elif tag_filter.any_of:
+        terms.append('(' + ' OR '.join(rtm_tag_term(tag) for tag in tag_filter.any_of) + ')')
+    for tag in tag_filter.none_of:
+        terms.append('NOT ' + rtm_tag_term(tag))
+
+    # dates are resolved here, rather than by RTM, so that dates without a year
+    # are interpreted the same way as by create_Task_list
+    operators = [('due', 'due', 'due'),
+                 ('due_before', 'dueBefore', 'due'),
+                 ('due_after', 'dueAfter', 'due'),
+                 ('completed_on', 'completed', 'completed'),
+                 ('completed_before', 'completedBefore', 'completed'),
+                 ('completed_after', 'completedAfter', 'completed')]
+
+    for key, operator, type_of_filter in operators:
+        if dates.get(key):
+            date = human_date_to_arrow(dates[key], type_of_filter)
+            terms.append('{}:"{}"'.format(operator, format_rtm_date(date)))
+
+    return ' AND '.join(terms)
+
+
+def rtm_tag_term(tag):
+    return 'tag:"{}"'.format(tag.replace('"', ''))
+
+
+def format_rtm_date(date):
+    ''' Format *date* the way the user's RTM date format setting expects. '''
+
+    # dateformat is 0 for European (day first) or 1 for American (month first)
+    if config['USER SETTINGS'].get('dateformat') == '0':
+        return '{}/{}/{}'.format(date.day, date.month, date.year)
+
+    return '{}/{}/{}'.format(date.month, date.day, date.year)
+
+
+def sync_store(store, full=False, reauthenticate=True):
+    '''
+    Bring the local task store up to date with RTM. Unless *full* is set (or the
+    store has never been synced), only changes since the last sync (less
+    sync_overlap) are fetched. If RTM rejects the auth token, the user is asked
+    to authenticate again, or AuthenticationException is raised if not
+    *reauthenticate*.
+    '''
+
+    import arrow
+
+    last_sync = '' if full else store.last_sync
+
+    # note the time before the request, so that nothing changed while it is in
+    # flight gets missed by the next sync
+    synced_at = arrow.utcnow().format('YYYY-MM-DDTHH:mm:ss') + 'Z'
+
+    since = ''
+    if last_sync:
+        since = arrow.get(last_sync).shift(seconds=-sync_overlap).format('YYYY-MM-DDTHH:mm:ss') + 'Z'
+
+    rtm_lists = get_rtm_tasks('', '', last_sync=since, reauthenticate=reauthenticate)
+
+    if not last_sync:
+        store.clear()
+
+    store.apply(rtm_lists, synced_at)
+
+    return store
+
+
+def sync_in_background(store):
+    '''
+    Start "dftp sync" in a process of its own, which carries on after this one
+    exits, so that the store is fresher next time. Return False, without
+    starting it, if one was started less than background_sync_interval ago
+    or background_sync is off.
+    '''
+
+    import subprocess
+
+    # dftp serve syncs the store itself
+    if task_index is not None or not background_sync:
+        return False
+
+    if time.time() - int(store.get_meta('sync_started') or 0) < background_sync_interval:
+        return False
+
+    with store.db:
+        store.set_meta('sync_started', str(int(time.time())))
+
+    subprocess.Popen([sys.executable, '-c', 'from dftp.app import main; main()', 'sync'],
+                     stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                     stderr=subprocess.DEVNULL, start_new_session=True)
+
+    return True
+
+
+def show_data_as_of(what, timestamp, refreshing=False):
+    ''' Note on stderr how old the *what* shown from the store are. '''
+
+    click.secho('{} as of {}{}.'.format(what, format_date_display(timestamp),
+                                        ', refreshing in the background' if refreshing else ''),
+                err=True, dim=True)
+
+
+################################################################################
+#  HELPER FUNCTIONS
+################################################################################
+global store
+store = None
+
+# all of the stored tasks, indexed, while running as dftp serve (see
+# dftp.daemon), where commands find tasks in it rather than loading them
+global task_index
+task_index = None
+
+
+def get_store():
+    ''' Return the local store of tasks and lists, opening it on first use. '''
+
+    global store
+
+    if store is None:
+        store = TaskStore(store_file)
+
+    return store
+
+
+def load_config():
+    ''' Read user's settings from the config file, creating it if necessary. '''
+
+    if config_file.is_file():
+        config.read(config_file)
+    else:
+        config['USER SETTINGS'] = default_settings
+        with open(config_file, 'w') as fp:
+            config.write(fp)
+
+    return config
+
+
+def save(config):
+    ''' Save user's RTM settings in config.ini.'''
+
+    for key, value in config['USER SETTINGS'].items():
+        config.set('USER SETTINGS', key, value)
+
+    with open(config_file, 'w') as fp:
+        config.write(fp)
+
+    return
+
+
+def as_tuple(values):
+    ''' Return *values* (one string, or several) as a tuple of strings. '''
+
+    if isinstance(values, str):
+        return (values,) if values else ()
+
+    return tuple(values)
+
+
+def as_tag_filter(tag):
+    ''' Return *tag* (one tag, several, or a TagFilter) as a TagFilter. '''
+
+    if isinstance(tag, TagFilter):
+        return tag
+
+    return TagFilter(all_of=tag)
+
+
+def create_Task_list(rtm_lists, tag='', dates={}, status=''):
+    ''' Return list of Task objects by various attributes.'''
+
+    tasks = list(iter_tasks(rtm_lists, tag=tag, dates=dates, status=status))
+
+    if not tasks:
+        raise NoTasksException
+
+    return tasks
+
+
+def query_task_index(store, list_names, tag='', dates={}, status=''):
+    '''
+    Like iter_tasks, but return a list of the tasks of the lists named
+    *list_names* (or of all lists) from task_index, as kept by dftp serve.
+    Which of its tasks are in a smart list is asked of RTM.
+    '''
+
+    list_ids = [stored_list_id(store, list_name) for list_name in dict.fromkeys(list_names)]
+    smart_lists = get_smart_lists(store, list_ids, status, tag, dates)
+
+    # where each list, or each task of a smart list, comes among those asked for
+    list_positions, task_positions = {}, {}
+    for i, list_id in enumerate(list_ids):
+        if list_id in smart_lists:
+            for rtm_list in smart_lists[list_id]:
+                for taskseries in rtm_list.get('taskseries', []):
+                    for task in taskseries['task']:
+                        task_positions.setdefault((taskseries['id'], task['id']), i)
+        else:
+            list_positions.setdefault(list_id, i)
+
+    def list_position(task):
+        return min(list_positions.get(task.list_id, len(list_ids)),
+                   task_positions.get((task.id, task.task_id), len(list_ids)))
+
+    tasks = task_index.query(dates, status, tag)
+
+    if list_ids:
+        tasks = [task for task in tasks if list_position(task) < len(list_ids)]
+
+    # in the order they come from the store, list by list, so that tasks with
+    # the same dates are shown in the same order as without dftp serve
+    position = task_index.position
+    tasks.sort(key=lambda task: (list_position(task), position[task]))
+
+    return tasks
+
+
+def iter_tasks(rtm_lists, tag='', dates={}, status=''):
+    '''
+    Like create_Task_list, but return a generator that creates the Task objects
+    as *rtm_lists* (which may be a generator itself, see iter_rtm_tasks) is read.
+    Tasks of the same list come one after another.
+    '''
 
-    data = handle_response(requests.get(methods_url, params=params))
+    # compile now rather than when first iterated, so bad dates are reported here
+    matches = compile_filters(tag, dates, status)
+    context = TaskContext()
 
-    # if list_name has been passed, this is is a list (with one item) of lists
-    # of the taskseries in that list; if no list_name, this is a list (with as
-    # as many items as the user has lists) of lists of taskseries
-    return data['tasks']['list']
+    def generate():
+        for rtm_list in rtm_lists:
+            if 'taskseries' in rtm_list:
+                for taskseries in rtm_list['taskseries']:
+                    for task in taskseries['task']:
+                        task = Task(taskseries, task, rtm_list['id'], context)
+                        if matches(taskseries, task):
+                            yield task
 
+    return generate()
 
-################################################################################
-#  HELPER FUNCTIONS
-################################################################################
-def save(config):
-    ''' Save user's RTM settings in config.ini.'''
 
-    for key, value in config['USER SETTINGS'].items():
-        config.set('USER SETTINGS', key, value)
+def compile_filters(tag='', dates={}, status=''):
+    '''
+    Turn the filters of the tasks command into one function that takes a
+    taskseries and one of its Tasks and returns whether the task should be
+    included. *tag* may be one tag or several, which tasks must all have, or a
+    TagFilter.
+
+    User-supplied dates are resolved only once, here, to a range of timestamps
+    (lowest included, highest excluded) that a task's due or completed time has
+    to be in, so checking a task is just a few integer comparisons.
+    '''
 
-    with open(config_file, 'w') as fp:
-        config.write(fp)
+    due_range = date_range(dates.get('due'), dates.get('due_before'),
+                           dates.get('due_after'), 'due')
+    completed_range = date_range(dates.get('completed_on'), dates.get('completed_before'),
+                                 dates.get('completed_after'), 'completed')
 
-    return
+    tag_filter = as_tag_filter(tag)
 
+    def matches(taskseries, task):
+        if tag_filter and not tag_filter.matches(task.tags):
+            return False
+        if status == 'completed' and task.completed == NO_DATE:
+            return False
+        if status == 'incomplete' and task.completed != NO_DATE:
+            return False
+        if due_range and not due_range[0] <= task.due < due_range[1]:
+            return False
+        if completed_range and not completed_range[0] <= task.completed < completed_range[1]:
+            return False
+        return True
 
-def create_Task_list(rtm_lists, tag='', dates={}, status=''):
-    ''' Return list of Task objects by various attributes.'''
+    return matches
 
-    tasks = []
 
-    for rtm_list in rtm_lists:
-        if 'taskseries' in rtm_list:
-            for taskseries in rtm_list['taskseries']:
-                if tag:
-                    if 'tag' in taskseries['tags']:
-                        for task in taskseries['task']:
-                            if tag in taskseries['tags']['tag']:
-                                tasks.append(Task(taskseries, task))
-                else:
-                    for task in taskseries['task']:
-                        tasks.append(Task(taskseries, task))
+def date_range(on, before, after, type_of_filter):
+    '''
+    Return (lowest, highest) timestamps of the days in the user's timezone
+    matched by the *on*, *before* and *after* dates given by the user, or None
+    if none of them were given. The range never includes NO_DATE.
+    '''
 
-    if not tasks:
-        raise NoTasksException
+    if not (on or before or after):
+        return None
 
-    if dates.get('due'):
-        tasks = [task for task in tasks
-                if task.due
-                and task.due != 'never'
-                and arrow.get(task.due).date()
-                    == human_date_to_arrow(dates['due'], 'due')]
-    if dates.get('due_before'):
-        tasks = [task for task in tasks
-                if task.due
-                and task.due != 'never'
-                and arrow.get(task.due).date()
-                    < human_date_to_arrow(dates['due_before'], 'due')]
-    if dates.get('due_after'):
-        tasks = [task for task in tasks
-                if task.due
-                and task.due != 'never'
-                and arrow.get(task.due).date()
-                    > human_date_to_arrow(dates['due_after'], 'due')]
-    if dates.get('completed_on'):
-        tasks = [task for task in tasks
-                if task.completed
-                and arrow.get(task.completed).date()
-                    == human_date_to_arrow(dates['completed_on'], 'completed')]
-    if dates.get('completed_before'):
-        tasks = [task for task in tasks
-                if task.completed
-                and arrow.get(task.completed).date()
-                    < human_date_to_arrow(dates['completed_before'], 'completed')]
-    if dates.get('completed_after'):
-        tasks = [task for task in tasks
-                if task.completed
-                and arrow.get(task.completed).date()
-                    > human_date_to_arrow(dates['completed_after'], 'completed')]
+    lowest, highest = -NO_DATE, NO_DATE
 
-    if not tasks:
-        raise NoTasksException
+    if on:
+        day = human_date_to_arrow(on, type_of_filter)
+        lowest = max(lowest, start_of_day(day))
+        highest = min(highest, start_of_day(day, days=1))
+    if before:
+        highest = min(highest, start_of_day(human_date_to_arrow(before, type_of_filter)))
+    if after:
+        lowest = max(lowest, start_of_day(human_date_to_arrow(after, type_of_filter), days=1))
 
-    return tasks
+    return lowest, highest
 
 
-def split_list(all_tasks):
+def split_list(all_tasks, sort=True):
     '''
     Split list of all tasks into two lists - one of completed tasks and one
-    of incomplete tasks, sorted by either completed date or due date.
+    of incomplete tasks, sorted by either completed date or due date (unless
+    *sort* is False).
     '''
 
     completed_tasks = []
     incomplete_tasks = []
 
     for task in all_tasks:
-        if not task.completed:
+        if task.completed == NO_DATE:
             incomplete_tasks.append(task)
         else:
             completed_tasks.append(task)
 
-    if completed_tasks:
+    if sort and completed_tasks:
         completed_tasks.sort(key=lambda t: t.completed)
-    if incomplete_tasks:
+    if sort and incomplete_tasks:
         incomplete_tasks.sort(key=lambda t: t.due)
 
     return completed_tasks, incomplete_tasks
 
 
+def merge_lists(runs, key):
+    '''
+    Sort each of *runs* (the tasks of one list each) by *key* and return an
+    iterator that merges them in order as it is consumed.
+    '''
+
+    for run in runs:
+        run.sort(key=key)
+
+    return heapq.merge(*runs, key=key)
+
+
+# re to match various month/day/year formats
+date_pattern = re.compile(r'\d{1,2}[./-]\d{1,2}([./-][\d]{2,4})?$')
+
+
 def human_date_to_arrow(date, type_of_filter):
     '''
     Unless user inputted one of the three custom dates (today, tomorrow, yesterday),
@@ -410,6 +1296,8 @@ def human_date_to_arrow(date, type_of_filter):
     then convert that to Arrow datetime.date object and return it.
     '''
 
+    import arrow
+
     # handle some custom date possibilities
     if date.lower() == 'today':
         return arrow.now(config['USER SETTINGS']['timezone']).date()
@@ -418,10 +1306,7 @@ def human_date_to_arrow(date, type_of_filter):
     elif date.lower() == 'yesterday':
         return arrow.now(config['USER SETTINGS']['timezone']).shift(days=-1).date()
 
-    # re to match various month/day/year formats
-    p = re.compile('\d{1,2}[./-]\d{1,2}([./-][\d]{2,4})?$')
-
-    m = p.match(date)
+    m = date_pattern.match(date)
 
     if m:
         # replace . and - with /
@@ -484,11 +1369,13 @@ def human_date_to_arrow(date, type_of_filter):
 
 def format_date_display(task_date):
     '''
-    Convert date string from iso format to "[month abbreviation] day, year"
-    (and possibly time) for displaying to user.
+    Convert timestamp to "[month abbreviation] day, year" (and possibly time)
+    for displaying to user.
     '''
 
-    if task_date != 'never':
+    import arrow
+
+    if task_date != NO_DATE:
         task_date = arrow.get(task_date).to(config['USER SETTINGS']['timezone'])
 
         # RTM stores tasks with no due time as midnight, so if that is the case,
@@ -498,7 +1385,38 @@ def format_date_display(task_date):
         else:
             return task_date.format('MMM D, YYYY h:mm a')
     else:
-        return task_date
+        return 'never'
+
+
+def to_timestamp(date):
+    '''
+    Convert a date(time) in iso format, as RTM sends them, to seconds since the
+    epoch, or to NO_DATE if *date* is empty.
+    '''
+
+    if not date:
+        return NO_DATE
+
+    date = datetime.datetime.fromisoformat(str(date).replace('Z', '+00:00'))
+
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=datetime.timezone.utc)
+
+    return int(date.timestamp())
+
+
+def start_of_day(date, days=0):
+    '''
+    Return the timestamp of midnight, in the user's timezone, at the start of
+    *date* (shifted by *days*).
+    '''
+
+    import arrow
+
+    day = arrow.Arrow(date.year, date.month, date.day,
+                      tzinfo=config['USER SETTINGS']['timezone']).shift(days=days)
+
+    return int(day.datetime.timestamp())
 
 
 def convert_to_list(method, task_name, task_date):
@@ -509,11 +1427,15 @@ def convert_to_list(method, task_name, task_date):
         return ['\n'.join(textwrap.wrap(task_name, 70)), task_date]
 
 
-def display_tasks(method, list_name, tag, tasks, status, filename=''):
-    ''' Display tasks either in terminal or as pdf. '''
+def display_tasks(method, list_name, tag, tasks, status, filename='', sort=True, force=False):
+    '''
+    Display tasks either in terminal or as pdf, sorted by due or completed
+    date unless *sort* is False (e.g. for search results, already in order).
+    A pdf isn't exported again if it would be the same, unless *force* is set.
+    '''
 
-    completed_tasks_as_lists = [['Task', 'Completed']]
-    incomplete_tasks_as_lists = [['Task', 'Due']]
+    if method == 'stream':
+        return stream_tasks(tasks, status, list_names=stored_list_names(get_store()))
 
     if list_name:
         heading1 = list_name + ' - '
@@ -522,115 +1444,332 @@ def display_tasks(method, list_name, tag, tasks, status, filename=''):
     else:
         heading1 = ''
 
-    if method == 'export':
-        doc = SimpleDocTemplate(filename+'.pdf', pagesize=letter)
-        styles=getSampleStyleSheet()
-        table_style = TableStyle([('INNERGRID', (0,0), (-1,-1), 0.25, colors.black),
-                                  ('BOX', (0,0), (-1,-1), 1.25, colors.black),
-                                 ])
-        col1_width, col2_width = 340, 115
-        red_text = ParagraphStyle('red', textColor = colors.red)
-        story = []
-
     if status and status == 'incomplete':
         heading1 += str(len(tasks)) + ' incomplete tasks'
-        tasks.sort(key=lambda t: t.due)
+        if sort:
+            tasks.sort(key=lambda t: t.due)
+        sections = [('', 'Due', tasks)]
 
-        for task in tasks:
-            formatted_date = format_date_display(task.due)
+    elif status and status == 'completed':
+        heading1 += str(len(tasks)) + ' completed tasks'
+        if sort:
+            tasks.sort(key=lambda t: t.completed)
+        sections = [('', 'Completed', tasks)]
+
+    else:
+        heading1 += str(len(tasks)) + ' tasks'
 
-            if task.is_overdue:
-                if method == 'print':
-                    formatted_date = click.style(formatted_date, fg='red')
-                if method == 'export':
-                    formatted_date = Paragraph(formatted_date, red_text)
+        completed_tasks, incomplete_tasks = split_list(tasks, sort=sort)
 
-            incomplete_tasks_as_lists.append(convert_to_list(method, task.name, formatted_date))
+        if incomplete_tasks:
+            incomplete_heading = str(len(incomplete_tasks)) + ' incomplete tasks'
+        else:
+            incomplete_heading = 'No incomplete tasks.'
 
-        if method == 'export':
-            story.append(Paragraph(heading1, styles['Heading1']))
-            t = Table(incomplete_tasks_as_lists, colWidths=(col1_width, col2_width))
-            t.setStyle(table_style)
-            story.append(t)
-        elif method == 'print':
-            click.secho('\nIncomplete Tasks', fg='green')
-            print(tabulate(incomplete_tasks_as_lists, headers="firstrow", tablefmt="fancy_grid"))
+        if completed_tasks:
+            completed_heading = str(len(completed_tasks)) + ' completed tasks'
+        else:
+            completed_heading = 'No completed tasks.'
 
-    elif status and status == 'completed':
-        heading1 += str(len(tasks)) + ' completed tasks'
-        tasks.sort(key=lambda t: t.completed)
+        sections = [(incomplete_heading, 'Due', incomplete_tasks),
+                    (completed_heading, 'Completed', completed_tasks)]
+
+    if method == 'export':
+        return export_tasks(filename, heading1, sections, force)
+
+    from tabulate import tabulate
+
+    for heading2, column, section_tasks in sections:
+        kind = 'Incomplete' if column == 'Due' else 'Completed'
+
+        if not section_tasks:
+            print('')
+            print('No {} tasks.'.format(kind.lower()))
+            if kind == 'Completed':
+                print('')
+            continue
+
+        click.secho('\n{} Tasks'.format(kind), fg='green')
+
+        tasks_as_lists = [['Task', column]]
+
+        for task in section_tasks:
+            formatted_date = format_date_display(getattr(task, column.lower()))
+            if column == 'Due' and task.is_overdue:
+                formatted_date = click.style(formatted_date, fg='red')
+            tasks_as_lists.append(convert_to_list('print', task.name, formatted_date))
+
+        print(tabulate(tasks_as_lists, headers="firstrow", tablefmt="fancy_grid"))
+
+    return
+
+
+def export_tasks(filename, heading1, sections, force=False):
+    '''
+    Export tasks to *filename*.pdf. *sections* are (heading, column, tasks)
+    tuples, where column is "Due" or "Completed". Return False, without
+    exporting them, if the pdf was exported from the same tasks and hasn't
+    changed since (see export_fingerprint), unless *force* is set.
+
+    Each section's tasks are laid out in tables of export_chunk_size rows, which
+    are only created as reportlab gets to them (see LazyStory), so neither the
+    time to lay out a table nor the memory used grows with the number of tasks.
+    '''
+
+    fingerprint = export_fingerprint(heading1, sections)
+
+    if not force and export_is_current(filename, fingerprint):
+        click.secho('{}.pdf is up to date (use --force to export it again).'.format(filename),
+                    err=True, dim=True)
+        return False
+
+    from reportlab.lib.pagesizes import letter
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Table, TableStyle
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.lib import colors
+
+    doc = SimpleDocTemplate(filename+'.pdf', pagesize=letter)
+    styles = getSampleStyleSheet()
+    table_style = [('INNERGRID', (0,0), (-1,-1), 0.25, colors.black),
+                   ('BOX', (0,0), (-1,-1), 1.25, colors.black)]
+    col1_width, col2_width = 340, 115
+
+    def story():
+        yield Paragraph(heading1, styles['Heading1'])
+
+        for heading2, column, tasks in sections:
+            if heading2:
+                yield Paragraph(heading2, styles['Heading2'])
+            if not tasks:
+                yield Paragraph('', styles['Normal'])
+                continue
+
+            # only the first table of a section has a header, so the tables
+            # look like one long one
+            rows = [['Task', column]]
+
+            for start in range(0, len(tasks), export_chunk_size):
+                commands = list(table_style)
+
+                for task in tasks[start:start + export_chunk_size]:
+                    formatted_date = format_date_display(getattr(task, column.lower()))
+                    if column == 'Due' and task.is_overdue:
+                        commands.append(('TEXTCOLOR', (1, len(rows)), (1, len(rows)), colors.red))
+                    rows.append(convert_to_list('export', task.name, formatted_date))
+
+                table = Table(rows, colWidths=(col1_width, col2_width))
+                table.setStyle(TableStyle(commands))
+                yield table
+
+                rows = []
 
+    doc.build(LazyStory(story()))
+
+    stamp = export_stamp(filename, fingerprint)
+    if stamp:
+        with open(filename + '.pdf.fingerprint', 'w') as f:
+            f.write(stamp)
+
+    return True
+
+
+def export_fingerprint(heading1, sections):
+    '''
+    Return a digest of everything a pdf of *heading1* and *sections* (see
+    export_tasks) shows: the headings, and each task's name, dates and whether
+    it is overdue, in order, and what they are shown with (the user's timezone
+    and the layout).
+    '''
+
+    digest = hashlib.sha256()
+    digest.update(repr((export_layout, export_chunk_size, config['USER SETTINGS']['timezone'],
+                        heading1)).encode('utf-8'))
+
+    for heading2, column, tasks in sections:
+        digest.update(repr((heading2, column)).encode('utf-8'))
         for task in tasks:
-            task.completed = format_date_display(task.completed)
-            completed_tasks_as_lists.append(convert_to_list(method, task.name, task.completed))
-
-        if method == 'export':
-            story.append(Paragraph(heading1, styles['Heading1']))
-            t = Table(completed_tasks_as_lists, colWidths=(col1_width, col2_width))
-            t.setStyle(table_style)
-            story.append(t)
-        elif method == 'print':
-            click.secho('\nCompleted Tasks', fg='green')
-            print(tabulate(completed_tasks_as_lists, headers="firstrow", tablefmt='fancy_grid'))
+            digest.update(repr((task.id, task.name, task.due, task.completed,
+                                task.is_overdue)).encode('utf-8'))
 
-    else:
-        heading1 += str(len(tasks)) + ' tasks'
+    return digest.hexdigest()
 
-        completed_tasks, incomplete_tasks = split_list(tasks)
-        completed_tasks.sort(key=lambda t: t.completed)
-        incomplete_tasks.sort(key=lambda t: t.due)
 
-        for task in completed_tasks:
-            task.completed = format_date_display(task.completed)
-            completed_tasks_as_lists.append(convert_to_list(method, task.name, task.completed))
-
-        for task in incomplete_tasks:
-            formatted_date = format_date_display(task.due)
-            if task.is_overdue:
-                if method == 'print':
-                    formatted_date = click.style(formatted_date, fg='red')
-                if method == 'export':
-                    formatted_date = Paragraph(formatted_date, red_text)
-            incomplete_tasks_as_lists.append(convert_to_list(method, task.name, formatted_date))
-
-        if method == 'export':
-            story.append(Paragraph(heading1, styles['Heading1']))
-
-            if incomplete_tasks:
-                story.append(Paragraph(str(len(incomplete_tasks)) + ' incomplete tasks', styles['Heading2']))
-                t = Table(incomplete_tasks_as_lists, colWidths=(col1_width, col2_width))
-                t.setStyle(table_style)
-                story.append(t)
-            else:
-                story.append(Paragraph('No incomplete tasks.', styles['Heading2']))
-                story.append(Paragraph('', styles['Normal']))
-
-            if completed_tasks:
-                story.append(Paragraph(str(len(completed_tasks)) + ' completed tasks', styles['Heading2']))
-                t = Table(completed_tasks_as_lists, colWidths=(col1_width, col2_width))
-                t.setStyle(table_style)
-                story.append(t)
-            else:
-                story.append(Paragraph('No completed tasks.', styles['Heading2']))
-                story.append(Paragraph('', styles['Normal']))
+def export_stamp(filename, fingerprint):
+    '''
+    Return *fingerprint* with the size and modification time of *filename*.pdf,
+    as saved alongside it in *filename*.pdf.fingerprint, or '' if there's no pdf.
+    '''
 
-        elif method == 'print':
-            if len(incomplete_tasks_as_lists) > 1:
-                click.secho('\nIncomplete Tasks', fg='green')
-                print(tabulate(incomplete_tasks_as_lists, headers="firstrow", tablefmt='fancy_grid'))
-            else:
-                print('')
-                print("No incomplete tasks.")
-            if len(completed_tasks_as_lists) > 1:
-                click.secho('\nCompleted Tasks', fg='green')
-                print(tabulate(completed_tasks_as_lists, headers="firstrow", tablefmt='fancy_grid'))
-            else:
-                print('')
-                print("No completed tasks.")
-                print('')
+    try:
+        stat = os.stat(filename + '.pdf')
+    except OSError:
+        return ''
+
+    return '{} {} {}'.format(fingerprint, stat.st_size, stat.st_mtime_ns)
+
+
+def export_is_current(filename, fingerprint):
+    '''
+    Return whether *filename*.pdf was exported from tasks with *fingerprint*,
+    and hasn't been changed (or replaced) since.
+    '''
+
+    try:
+        with open(filename + '.pdf.fingerprint') as f:
+            saved = f.read()
+    except OSError:
+        return False
+
+    stamp = export_stamp(filename, fingerprint)
+
+    return bool(stamp) and saved == stamp
 
-    if method == 'export':
-        doc.build(story)
+
+def export_all_lists(tasks, tag, status, filename, output_format='', force=False):
+    '''
+    Export *tasks* to one pdf (or file in *output_format*) per list, named
+    "*filename* - <list name>". The pdfs are laid out in separate processes,
+    since reportlab is CPU-bound; as with export_tasks, those that would be
+    the same aren't exported again unless *force* is set.
+    '''
+
+    tasks_by_list = {}
+
+    for task in tasks:
+        tasks_by_list.setdefault(task.list_id, []).append(task)
+
+    # as stored_list_id does: the stored lists, even if expired, only asking RTM
+    # if a list isn't there (and not --offline)
+    store = get_store()
+    list_names = stored_list_names(store)
+
+    if not offline and not set(tasks_by_list) <= set(list_names):
+        get_cached_lists(refresh=True)
+        list_names = stored_list_names(store)
+
+    exports = []
+    for list_id, list_tasks in tasks_by_list.items():
+        list_name = list_names.get(list_id, list_id)
+        exports.append((list_name, list_tasks,
+                        '{} - {}'.format(filename, list_name.replace(os.sep, '-'))))
+
+    if output_format:
+        from dftp import formats
+        for list_name, list_tasks, list_filename in exports:
+            formats.write_tasks(list_tasks, output_format, list_filename)
+        return
+
+    if len(exports) < 2:
+        for list_name, list_tasks, list_filename in exports:
+            display_tasks('export', list_name, tag, list_tasks, status, list_filename,
+                          force=force)
+        return
+
+    # imported here as it brings in multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    # workers get the user's settings (e.g. timezone) explicitly, as they
+    # don't inherit the config where processes are spawned rather than forked
+    with ProcessPoolExecutor(max_workers=min(len(exports), os.cpu_count() or 1),
+                             initializer=set_user_settings,
+                             initargs=(dict(config['USER SETTINGS']),)) as executor:
+        futures = [executor.submit(display_tasks, 'export', list_name, tag, list_tasks,
+                                   status, list_filename, force=force)
+                   for list_name, list_tasks, list_filename in exports]
+
+        for future in futures:
+            future.result()
+
+    return
+
+
+def set_user_settings(settings):
+    ''' Use *settings* as the user's settings, e.g. in a worker process. '''
+    config['USER SETTINGS'] = settings
+
+
+def stream_tasks(tasks, status, out=None, list_names={}):
+    '''
+    Write *tasks* (any iterable, e.g. from iter_tasks) to the terminal one line
+    at a time, date first, rather than as a table, as they are read. The first
+    section (incomplete tasks, unless only completed ones are wanted) is written
+    a list at a time, each list's tasks sorted as soon as the list ends and
+    headed by its name (from *list_names*, by list id). The other can only be
+    written once all the tasks have been read, so its lists are merged into one
+    order as its rows are written.
+    '''
+
+    out = out or click.get_text_stream('stdout')
+
+    # as click.echo does: as set for the command (e.g. by dftp serve for the
+    # terminal it answers), or if writing to a terminal
+    color = resolve_color_default()
+    if color is None:
+        color = out.isatty()
+
+    sections = []
+    if status != 'completed':
+        sections.append(('Incomplete Tasks', 'due'))
+    if status != 'incomplete':
+        sections.append(('Completed Tasks', 'completed'))
+
+    def write_heading(heading):
+        out.write('\n' + (click.style(heading, fg='green') if color else heading) + '\n')
+
+    def write_list_heading(list_id):
+        list_heading = '{}:'.format(list_names.get(list_id, list_id))
+        out.write((click.style(list_heading, bold=True) if color else list_heading) + '\n')
+
+    def write_rows(tasks, attribute):
+        for task in tasks:
+            formatted_date = format_date_display(getattr(task, attribute))
+            if color and attribute == 'due' and task.is_overdue:
+                formatted_date = click.style(formatted_date.ljust(stream_date_width), fg='red')
+            out.write('{:<{}} {}\n'.format(formatted_date, stream_date_width, task.name))
+        out.flush()
+
+    (heading, attribute), later = sections[0], sections[1:]
+    first_incomplete = attribute == 'due'
+    key = attrgetter(attribute)
+
+    # the tasks of the current list in the first section, and of each list so
+    # far in the other
+    run, held_runs = [], []
+    written = False
+    last_list_id = None
+
+    def write_run(run):
+        if not run:
+            return written
+        if not written:
+            write_heading(heading)
+        write_list_heading(run[0].list_id)
+        run.sort(key=key)
+        write_rows(run, attribute)
+        return True
+
+    for task in tasks:
+        if task.list_id != last_list_id:
+            written = write_run(run)
+            run, last_list_id = [], task.list_id
+            held_runs.append([])
+        if (task.completed == NO_DATE) == first_incomplete:
+            run.append(task)
+        elif later:
+            held_runs[-1].append(task)
+
+    if not write_run(run):
+        out.write('\nNo {}.\n'.format(heading.lower()))
+
+    for heading, attribute in later:
+        runs = [run for run in held_runs if run]
+        if not runs:
+            out.write('\nNo {}.\n'.format(heading.lower()))
+            continue
+        write_heading(heading)
+        write_rows(merge_lists(runs, key=attrgetter(attribute)), attribute)
+
+    out.flush()
 
     return
 
@@ -638,25 +1777,79 @@ def display_tasks(method, list_name, tag, tasks, status, filename=''):
 ################################################################################
 # commands
 ################################################################################
-@click.group()
-def main():
+class Group(click.Group):
+    '''
+    click.Group that keeps the arguments it was given in ctx.meta['args'], so a
+    command can be passed on to dftp serve as it was given.
+    '''
+
+    def parse_args(self, ctx, args):
+        ctx.meta['args'] = list(args)
+        return super().parse_args(ctx, args)
+
+
+@click.group(cls=Group)
+@click.option('--async', 'async_client', is_flag=True,
+              help='Talk to RTM with the asyncio client (needs httpx).')
+@click.option('--offline', 'offline_only', is_flag=True,
+              help="Show tasks and lists as of the last sync, without contacting RTM.")
+@click.option('--profile', is_flag=True,
+              help='Show how long the command spent in each part of dftp (on stderr).')
+@click.option('--profile-output', metavar='FILE', default='',
+              help='With --profile, also save cProfile stats to FILE (e.g. dftp.pstats).')
+@click.pass_context
+def main(ctx, async_client, offline_only, profile, profile_output):
     '''Don't Forget the Python: command-line interface for Remember the Milk.
 
     Type "<command> --help" to see options and additional info.'''
 
+    global use_async, offline
+
+    # nothing is timed unless asked, so there's no cost otherwise
+    if profile:
+        from dftp import timing
+        ctx.call_on_close(timing.start(profile_output))
+
+    # let dftp serve answer from the tasks it keeps in memory, if it's running
+    # (and this isn't it); what would be timed happens there, so not if profiling
+    if ctx.invoked_subcommand in daemon_commands and task_index is None and not profile:
+        from dftp import daemon
+        status = daemon.forward(ctx.meta['args'])
+        if status is not None:
+            ctx.exit(status)
+
+    if async_client:
+        try:
+            import httpx
+        except ImportError:
+            raise click.UsageError('--async needs the httpx package (pip install "dftp[async]").')
+
+    # set on every invocation, as dftp serve runs many in one process
+    use_async = async_client
+
+    load_config()
+
+    offline = offline_only
+    if offline:
+        return
+
     # authenticate user if not yet authenticated or ini file corrupted
     if not config['USER SETTINGS']['token']:
         authenticate()
 
-    # # reauthenticate user if token expired or if they revoked authorization
-    params = {'api_key':api_key,
-              'method':'rtm.auth.checkToken',
-              'format':'json',
-              'auth_token':config['USER SETTINGS']['token']}
-
-    params['api_sig'] = make_api_sig(params)
-
-    data = handle_response(requests.get(methods_url, params=params))
+    # reauthenticate user if token expired or if they revoked authorization; this
+    # is only checked once every token_ttl seconds, since any other call made
+    # with a bad token gets error 98, which is handled by handle_response. If RTM
+    # can't be reached, it's checked next time instead.
+    if token_check_due():
+        try:
+            if use_async:
+                from dftp import aio
+                aio.run('check_token')
+            else:
+                check_token()
+        except NetworkException:
+            pass
 
     return
 
@@ -665,10 +1858,39 @@ def main():
 @click.option('--archived', is_flag=True, help="Show archived lists.")
 @click.option('--smart', is_flag=True, help="Show smart lists.")
 @click.option('--all', is_flag=True, help="Show all lists.")
-def lists(archived, smart, all):
-    '''List your lists!'''
+@click.option('--refresh', is_flag=True, help="Fetch lists from RTM rather than the local cache.")
+def lists(archived, smart, all, refresh):
+    '''
+    List your lists!
+
+    Lists are shown as last fetched (and fetched again in the background once a
+    day), unless --refresh is given.
+    '''
+
+    store = get_store()
+    from_store = offline or (store.lists_fetched and not refresh)
+    show_as_of = offline
+
+    if not from_store:
+        try:
+            if use_async:
+                from dftp import aio
+                aio.run('get_cached_lists', refresh=True)
+            else:
+                get_cached_lists(refresh=True)
+        except NetworkException as e:
+            # without stored lists to fall back on, exit
+            if not store.lists_fetched:
+                raise
+            click.secho(e.message, fg='red')
+            from_store = show_as_of = True
+
+    refreshing = False
+    if from_store and not offline and lists_expired(store):
+        refreshing = sync_in_background(store)
+        show_as_of = True
 
-    rtm_lists = get_rtm_lists()
+    rtm_lists = store.get_lists()
 
     sub_list = []
 
@@ -694,15 +1916,44 @@ def lists(archived, smart, all):
     else:
         for rtm_list in sorted(sub_list, key=lambda k: k['name'].lower()):
             click.echo(rtm_list['name'])
+
+    if show_as_of and store.lists_fetched:
+        show_data_as_of('Lists', store.lists_fetched, refreshing)
+    return
+
+
+@main.command()
+@click.option('--full', is_flag=True, help="Download all tasks again rather than only changes.")
+def sync(full):
+    '''
+    Sync your tasks (and lists) to a local store.
+
+    After the first sync, only tasks added, modified, or deleted since the
+    previous sync are downloaded. The tasks command shows tasks from the store
+    straight away and syncs it again in the background.
+    '''
+
+    if offline:
+        raise click.UsageError("Can't sync while --offline.")
+
+    store = sync_store(get_store(), full=full)
+    get_cached_lists()
+    click.echo('Tasks synced as of {}.'.format(store.last_sync))
     return
 
 
 @main.command()
 @click.option('--print', '-p', 'method', flag_value='print', default=True, help='Print tasks to terminal (default).')
 @click.option('--export', '-e', 'method', flag_value='export', help='Export tasks to pdf.')
+@click.option('--stream', '-s', 'method', flag_value='stream', help='Print tasks to terminal one per line as they are processed (for large lists or pagers).')
+@click.option('--export-all-lists', 'all_lists', is_flag=True, help='Export tasks to one pdf per list, named "<filename> - <list name>".')
+@click.option('--force', is_flag=True, help='Export to pdf even if the tasks are the same as when last exported.')
+@click.option('--format', 'output_format', type=click.Choice(export_formats), help='Write tasks as csv, jsonl, parquet or ics for other programs: to stdout, or with -e to "<filename>.<format>".')
 @click.option('--filename', '-f', default='RTM tasks', help='Name of file to create when exporting to pdf (defaults to "RTM tasks").')
-@click.option('--list_name', '-l', default='', help='Tasks from a particular list.')
-@click.option('--tag', '-t', default='', help='Tasks with a particular tag.')
+@click.option('--list_name', '-l', multiple=True, help='Tasks from a particular list (repeat for several lists).')
+@click.option('--tag', '-t', multiple=True, help='Tasks with a particular tag (repeat for tasks with all of several tags).')
+@click.option('--any', 'any_tag', is_flag=True, help='Tasks with any rather than all of the tags given with -t.')
+@click.option('--not-tag', multiple=True, help='Leave out tasks with a particular tag (repeat for several tags).')
 @click.option('--incomplete', '-i', 'status', flag_value='incomplete', help='Incomplete tasks only.')
 @click.option('--completed', '-c', 'status', flag_value='completed', help='Completed tasks only.')
 @click.option('--due', '-d', default='', help='Tasks due on particular date.')
@@ -711,11 +1962,28 @@ def lists(archived, smart, all):
 @click.option('--completed_on', '-co', default='', help='Tasks completed on a particular date.')
 @click.option('--completed_before', '-cb', default='', help='Tasks completed before a particular date.')
 @click.option('--completed_after', '-ca', default='', help='Tasks completed after a particular date.')
-def tasks(method, list_name, tag, status, due, due_before, due_after, completed_on,
-        completed_before, completed_after, filename):
+def tasks(method, all_lists, force, output_format, list_name, tag, any_tag, not_tag, status, due, due_before,
+        due_after, completed_on, completed_before, completed_after, filename):
     '''
     List your tasks. All options can be used together, except, of course,
-    for -p and -e and -i and -c.
+    for -p and -e and -i and -c. Use -l more than once to get the tasks of
+    several lists together, or --export-all-lists to export each list (or
+    each of those given with -l) to its own pdf.
+
+    Tasks must have all of the tags given with -t, or any of them with --any,
+    and none of those given with --not-tag.
+
+    Once you have synced (see sync), tasks are shown from the local store as of
+    the last sync, which is synced again in the background for next time. The
+    tasks of smart lists are still asked of RTM, which works out what's in them.
+
+    With --format, tasks are written one record per task, as they are read,
+    without sorting or formatting dates: csv, JSON Lines (jsonl) or iCalendar
+    (ics) to stdout, or to a file with -e; or Parquet, which needs -e and the
+    pyarrow package.
+
+    A pdf isn't exported again if it would be the same as when it was last
+    exported (and hasn't been changed since), unless --force is given.
 
     For dates, you can use "today", "yesterday", or "tomorrow" as well as dates
     in the format M/D/YY, e.g. 8/5/18. Use the before and after date options
@@ -727,21 +1995,80 @@ def tasks(method, list_name, tag, status, due, due_before, due_after, completed_
     if completed_on or completed_before or completed_after:
         status = 'completed'
 
-    try:
-        rtm_tasks = get_rtm_tasks(list_name, status)
-    except NoListException as e:
-        click.secho(e.message, fg='red')
-        return
-    except NoTasksException as e:
-        click.secho(e.message, fg='red')
-        return
+    if all_lists:
+        method = 'export'
+
+    if output_format == 'parquet':
+        if method != 'export':
+            raise click.UsageError('--format parquet writes to a file: add -e (and -f to name it).')
+        try:
+            import pyarrow
+        except ImportError:
+            raise click.UsageError('--format parquet needs the pyarrow package '
+                                   '(pip install "dftp[parquet]").')
+
+    # tasks streamed or written for other programs are written as they are
+    # created, and there being none isn't an error
+    streamed = method == 'stream' or bool(output_format)
 
     dates = {'due':due, 'due_before':due_before, 'due_after':due_after,
              'completed_on':completed_on, 'completed_before':completed_before,
              'completed_after':completed_after}
 
+    if any_tag:
+        tag_filter = TagFilter(any_of=tag, none_of=not_tag)
+    else:
+        tag_filter = TagFilter(all_of=tag, none_of=not_tag)
+
+    store = get_store()
+    as_of = refreshing = None
+    fetched = False
+
+    if offline and not store.last_sync:
+        click.secho('No tasks synced yet: run "dftp sync" while online.', fg='red')
+        return
+
     try:
-        tasks = create_Task_list(rtm_tasks, tag=tag, dates=dates, status=status)
+        if task_index is not None:
+            # in dftp serve, which keeps the stored tasks indexed, and syncs them
+            as_of = to_timestamp(store.last_sync)
+            tasks = query_task_index(store, list_name, tag=tag_filter, dates=dates,
+                                     status=status)
+            if not tasks and not streamed:
+                raise NoTasksException
+        else:
+            # once the user has synced, show tasks from the local store straight
+            # away, and sync it in the background for next time
+            if store.last_sync:
+                as_of = to_timestamp(store.last_sync)
+                if not offline:
+                    refreshing = sync_in_background(store)
+                if list_name:
+                    # read list by list as the tasks are used (see stream_tasks)
+                    list_ids = [stored_list_id(store, name) for name in dict.fromkeys(list_name)]
+                    smart_lists = get_smart_lists(store, list_ids, status, tag=tag_filter,
+                                                  dates=dates)
+                    rtm_tasks = (rtm_list for list_id in list_ids
+                                 for rtm_list in (smart_lists[list_id] if list_id in smart_lists
+                                                  else store.get_rtm_tasks(list_id, status)))
+                else:
+                    rtm_tasks = store.get_rtm_tasks('', status)
+            else:
+                if use_async:
+                    from dftp import aio
+                    rtm_tasks = aio.run('fetch_rtm_tasks', list_name, status, tag=tag_filter,
+                                        dates=dates)
+                else:
+                    rtm_tasks = fetch_rtm_tasks(list_name, status, tag=tag_filter, dates=dates)
+                fetched = True
+
+            if streamed:
+                tasks = iter_tasks(rtm_tasks, tag=tag_filter, dates=dates, status=status)
+            else:
+                tasks = create_Task_list(rtm_tasks, tag=tag_filter, dates=dates, status=status)
+    except NoListException as e:
+        click.secho(e.message, fg='red')
+        return
     except NoTasksException as e:
         click.secho(e.message, fg='red')
         return
@@ -752,11 +2079,83 @@ def tasks(method, list_name, tag, status, due, due_before, due_after, completed_
         click.secho(e.message, fg='red')
         return
 
+    list_name, tag = ', '.join(list_name), (' or ' if any_tag else ', ').join(tag)
 
-    if method == 'print':
-        return display_tasks('print', list_name, tag, tasks, status)
+    if all_lists:
+        export_all_lists(tasks, tag, status, filename, output_format, force)
+    elif output_format:
+        from dftp import formats
+        formats.write_tasks(tasks, output_format, filename if method == 'export' else '')
+    elif method == 'export':
+        display_tasks('export', list_name, tag, tasks, status, filename, force=force)
     else:
-        return display_tasks('export', list_name, tag, tasks, status, filename)
+        display_tasks(method, list_name, tag, tasks, status)
+
+    if as_of:
+        show_data_as_of('Tasks', as_of, refreshing)
+    elif fetched:
+        # keep a copy of all tasks, so that they're shown from it next time
+        sync_in_background(store)
+    return
+
+
+@main.command()
+@click.option('--interval', default=background_sync_interval, show_default=True,
+              help='Seconds between syncs of the tasks kept in memory.')
+def serve(interval):
+    '''
+    Keep your tasks in memory and answer the tasks and lists commands.
+
+    Until stopped (with Ctrl-C), tasks and lists commands are passed to this
+    process, which answers them straight away from tasks it keeps in memory,
+    rather than each one starting from scratch. The tasks are synced every
+    --interval seconds (unless --offline). Without it running, commands run
+    as usual.
+    '''
+
+    from dftp import daemon
+
+    daemon.serve(interval, sync=not offline)
+    return
+
+
+@main.command()
+@click.option('--print', '-p', 'method', flag_value='print', default=True, help='Print tasks to terminal (default).')
+@click.option('--export', '-e', 'method', flag_value='export', help='Export tasks to pdf.')
+@click.option('--filename', '-f', default='RTM tasks', help='Name of file to create when exporting to pdf (defaults to "RTM tasks").')
+@click.option('--incomplete', '-i', 'status', flag_value='incomplete', help='Incomplete tasks only.')
+@click.option('--completed', '-c', 'status', flag_value='completed', help='Completed tasks only.')
+@click.option('--force', is_flag=True, help='Export to pdf even if the tasks are the same as when last exported.')
+@click.argument('terms', nargs=-1, required=True)
+def search(method, filename, status, force, terms):
+    '''
+    Search the names and notes of your synced tasks, best matches first.
+
+    Tasks must contain all of the TERMS; end a term with * to match words
+    starting with it. Searches your tasks as of the last sync, without
+    contacting RTM.
+    '''
+
+    store = get_store()
+
+    if not store.last_sync:
+        click.secho('Run "dftp sync" first to search your tasks.', fg='red')
+        return
+    if not store.searchable:
+        click.secho("Search isn't available: this SQLite has no FTS5.", fg='red')
+        return
+
+    try:
+        tasks = create_Task_list(store.search(terms, status), status=status)
+    except NoTasksException as e:
+        click.secho(e.message, fg='red')
+        return
+
+    heading = '"{}"'.format(' '.join(terms))
+
+    display_tasks(method, heading, '', tasks, status, filename, sort=False, force=force)
+    show_data_as_of('Tasks', to_timestamp(store.last_sync))
+    return
 
 
 if __name__ == "__main__":
@@ -0,0 +1,244 @@
+#!python3
+
+'''
+"dftp serve": a resident dftp that keeps the user's stored tasks in memory,
+indexed (see app.TaskIndex), and answers the tasks and lists commands over a
+Unix socket. While it is running, dftp passes those commands to it (see
+forward) rather than reading the config, checking the token and loading tasks
+itself, and runs them itself when it isn't.
+
+The daemon runs each command with dftp.app.main, just as dftp would, one at a
+time, and sends back what it wrote to stdout and stderr and its exit status.
+The store is synced, and the tasks indexed again, in a thread of their own
+every so often, so the tasks are never older than that and tasks that have
+since become overdue are shown as such.
+'''
+
+from contextlib import redirect_stderr, redirect_stdout
+import io
+import json
+import os
+from pathlib import Path
+import signal
+import socket
+import socketserver
+import sys
+import threading
+import time
+import traceback
+
+import click
+
+from dftp import app
+from dftp.store import TaskStore
+
+
+socket_file = Path().home().joinpath('.dftp.sock')
+
+
+def forward(args):
+    '''
+    Run "dftp *args*" in the daemon, if it's running, and write its output here.
+    Return its exit status, or None if there is no daemon to run it (or it
+    failed to), in which case it should be run here instead.
+    '''
+
+    if not hasattr(socket, 'AF_UNIX'):
+        return None
+
+    request = {'args': args, 'cwd': os.getcwd(), 'color': sys.stdout.isatty()}
+
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.connect(str(socket_file))
+            client.sendall(json.dumps(request).encode('utf-8') + b'\n')
+            client.shutdown(socket.SHUT_WR)
+            response = json.loads(receive(client))
+    except (OSError, ValueError):
+        return None
+
+    sys.stdout.write(response['stdout'])
+    sys.stdout.flush()
+    sys.stderr.write(response['stderr'])
+
+    return response['status']
+
+
+def receive(client):
+    ''' Read from *client* until the other end closes it. '''
+
+    chunks = []
+
+    while True:
+        chunk = client.recv(65536)
+        if not chunk:
+            return b''.join(chunks).decode('utf-8')
+        chunks.append(chunk)
+
+
+def running():
+    ''' Return whether a daemon is answering on socket_file. '''
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        try:
+            client.connect(str(socket_file))
+        except OSError:
+            return False
+
+    return True
+
+
+def run(args, cwd, color):
+    '''
+    Run "dftp *args*" in *cwd*, with colored output if *color* is set, and
+    return what it wrote to stdout and stderr and its exit status.
+    '''
+
+    stdout, stderr = io.StringIO(), io.StringIO()
+
+    with redirect_stdout(stdout), redirect_stderr(stderr):
+        try:
+            os.chdir(cwd)
+            status = invoke(args, color)
+        except OSError as e:
+            sys.stderr.write('{}\n'.format(e))
+            status = 1
+
+    return {'stdout': stdout.getvalue(), 'stderr': stderr.getvalue(), 'status': status}
+
+
+def invoke(args, color):
+    ''' Run "dftp *args*" and return its exit status, as if run on its own. '''
+
+    try:
+        status = app.main.main(args, prog_name='dftp', standalone_mode=False, color=color)
+    except click.ClickException as e:
+        e.show()
+        return e.exit_code
+    except click.Abort:
+        sys.stderr.write('Aborted!\n')
+        return 1
+    except SystemExit as e:
+        # dftp exits with a message on errors, e.g. from RTM
+        if e.code is None or isinstance(e.code, int):
+            return e.code or 0
+        sys.stderr.write('{}\n'.format(e.code))
+        return 1
+    except Exception:
+        # a bug in one command shouldn't stop the daemon answering others
+        traceback.print_exc()
+        return 1
+
+    return status if isinstance(status, int) else 0
+
+
+class Handler(socketserver.StreamRequestHandler):
+    ''' Runs the command sent on a connection and sends back its output. '''
+
+    def handle(self):
+        request = json.loads(self.rfile.readline().decode('utf-8'))
+        response = run(request['args'], request['cwd'], request['color'])
+        self.wfile.write(json.dumps(response).encode('utf-8'))
+
+
+class Server(socketserver.UnixStreamServer):
+    ''' Answers one command at a time, as the commands use dftp.app's globals. '''
+
+    def server_bind(self):
+        # only the user can connect
+        umask = os.umask(0o177)
+        try:
+            super().server_bind()
+        finally:
+            os.umask(umask)
+
+
+def index_tasks(store):
+    ''' Return a TaskIndex of all the tasks in *store*. '''
+    return app.TaskIndex(app.iter_tasks(store.get_rtm_tasks('', '')))
+
+
+def refresh(interval, sync, stopped):
+    '''
+    Every *interval* seconds until *stopped* is set, sync the store (and the
+    lists, once they expire) if *sync* is set, and index the tasks again. Errors
+    are reported on stderr rather than stopping the refreshes.
+    '''
+
+    # sqlite connections can't be shared between threads
+    store = TaskStore(app.store_file)
+
+    while not stopped.wait(interval):
+        # in any case, serve the tasks as of the last sync and try again next time
+        if sync:
+            try:
+                # the user can't be asked to authenticate again from here
+                app.sync_store(store, reauthenticate=False)
+                if app.lists_expired(store):
+                    store.set_lists(app.get_rtm_lists(reauthenticate=False), time.time())
+            except app.AuthenticationException as e:
+                click.secho(e.message, err=True, fg='red')
+            except SystemExit as e:
+                # RTM couldn't be reached, or answered with an error
+                click.secho(str(e.code), err=True, fg='red')
+            except Exception:
+                # e.g. the store locked by a "dftp sync" running at the same time
+                traceback.print_exc()
+
+        try:
+            app.task_index = index_tasks(store)
+        except Exception:
+            traceback.print_exc()
+
+    store.close()
+
+
+def serve(interval, sync=True):
+    '''
+    Index the stored tasks and answer commands on socket_file until stopped
+    (with Ctrl-C or SIGTERM), syncing them every *interval* seconds if *sync*
+    is set.
+    '''
+
+    if not hasattr(socket, 'AF_UNIX'):
+        raise click.UsageError("dftp serve needs Unix domain sockets, which this system lacks.")
+
+    if running():
+        raise click.UsageError('dftp serve is already running ({}).'.format(socket_file))
+
+    # left behind by a daemon that was killed
+    if socket_file.exists():
+        socket_file.unlink()
+
+    store = app.get_store()
+
+    if not store.last_sync:
+        if not sync:
+            raise click.UsageError('No tasks synced yet: run "dftp sync" while online.')
+        app.sync_store(store)
+    if sync and (not store.lists_fetched or app.lists_expired(store)):
+        app.get_cached_lists(refresh=True)
+
+    app.task_index = index_tasks(store)
+
+    stopped = threading.Event()
+    refresher = threading.Thread(target=refresh, args=(interval, sync, stopped), daemon=True)
+
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    with Server(str(socket_file), Handler) as server:
+        refresher.start()
+        click.echo('Serving {} tasks at {} (Ctrl-C to stop).'.format(len(app.task_index),
+                                                                    socket_file))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            stopped.set()
+            app.task_index = None
+            if socket_file.exists():
+                socket_file.unlink()
+
+    return
@@ -0,0 +1,246 @@
+#!python3
+
+'''
+Tasks as CSV, JSON Lines, Parquet or iCalendar, for other programs rather than
+people (see "dftp tasks --format").
+
+Each Task is one record, written as it comes (tasks can be a generator, e.g.
+from iter_tasks) and without any of the formatting display_tasks does for the
+terminal or pdfs. Records have the fields in `fields`: RTM's taskseries and
+task ids (together they identify the task; the occurrences of a recurring task
+share a taskseries), tags as a list (joined with commas in csv), due and
+completed as ISO 8601 times in UTC (or empty/null if the task has none),
+whether it is due at a particular time (false if it's due on a date, given as
+midnight in the user's timezone; empty/null if it isn't due), and whether an
+incomplete task is overdue (empty/null for completed tasks). In iCalendar, a
+task due on a date is due on that date rather than at a time.
+Parquet needs pyarrow, and is written in row groups of parquet_batch_size tasks.
+'''
+
+import csv
+import datetime
+from json.encoder import encode_basestring
+import sys
+import time
+
+from dftp.app import NO_DATE, config
+
+
+fields = ('taskseries_id', 'task_id', 'list_id', 'name', 'tags', 'due', 'has_due_time',
+          'completed', 'overdue')
+
+# tasks per row group (and per batch of columns built at once) in parquet files
+parquet_batch_size = 65536
+
+# content lines of iCalendar files are folded at this many octets
+ics_line_length = 75
+
+
+def iso_date(timestamp):
+    ''' Return *timestamp* (seconds since the epoch) in ISO 8601, UTC, or '' for NO_DATE. '''
+
+    if timestamp == NO_DATE:
+        return ''
+
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(timestamp))
+
+
+def has_due_time(task):
+    ''' Return whether *task* is due at a particular time, or None if it isn't due. '''
+    return None if task.due == NO_DATE else task.has_due_time
+
+
+def overdue(task):
+    ''' Return whether *task* is overdue, or None if it has been completed. '''
+    return None if task.completed != NO_DATE else task.is_overdue
+
+
+def write_tasks(tasks, output_format, filename=''):
+    '''
+    Write *tasks* in *output_format* (csv, jsonl, parquet or ics) to
+    "*filename*.<output_format>", or to stdout if there's no *filename* (except
+    parquet, which needs one). Return the number of tasks written.
+    '''
+
+    if output_format == 'parquet':
+        return write_parquet(tasks, '{}.parquet'.format(filename))
+
+    write = writers[output_format]
+
+    if not filename:
+        return write(tasks, sys.stdout)
+
+    with open('{}.{}'.format(filename, output_format), 'w', encoding='utf-8',
+              newline='') as out:
+        return write(tasks, out)
+
+
+def write_csv(tasks, out):
+    ''' Write *tasks* to *out* as csv, with a header row. '''
+
+    writer = csv.writer(out)
+    writer.writerow(fields)
+    values = {True: 'true', False: 'false', None: ''}
+
+    count = 0
+    for task in tasks:
+        writer.writerow((task.id, task.task_id, task.list_id, task.name, ','.join(task.tags),
+                         iso_date(task.due), values[has_due_time(task)], iso_date(task.completed),
+                         values[overdue(task)]))
+        count += 1
+
+    return count
+
+
+# built with encode_basestring (what json.dumps uses for strings) rather than
+# json.dumps, which takes about four times as long for a record like this
+jsonl_record = ('{{"taskseries_id":{},"task_id":{},"list_id":{},"name":{},"tags":[{}],'
+                '"due":{},"has_due_time":{},"completed":{},"overdue":{}}}\n')
+
+
+def json_date(timestamp):
+    return 'null' if timestamp == NO_DATE else '"{}"'.format(iso_date(timestamp))
+
+
+def write_jsonl(tasks, out):
+    ''' Write *tasks* to *out* as JSON Lines: one JSON object per task. '''
+
+    values = {True: 'true', False: 'false', None: 'null'}
+
+    count = 0
+    for task in tasks:
+        out.write(jsonl_record.format(encode_basestring(task.id),
+                                      encode_basestring(task.task_id),
+                                      encode_basestring(task.list_id),
+                                      encode_basestring(task.name),
+                                      ','.join(map(encode_basestring, task.tags)),
+                                      json_date(task.due), values[has_due_time(task)],
+                                      json_date(task.completed), values[overdue(task)]))
+        count += 1
+
+    return count
+
+
+def ics_text(text):
+    ''' Escape *text* for an iCalendar TEXT value. '''
+    return (text.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+            .replace('\n', '\\n'))
+
+
+def ics_date(timestamp):
+    return time.strftime('%Y%m%dT%H%M%SZ', time.gmtime(timestamp))
+
+
+def ics_day(timestamp, zone):
+    ''' Return the date of *timestamp* in *zone* as an iCalendar DATE value. '''
+    return datetime.datetime.fromtimestamp(timestamp, zone).strftime('%Y%m%d')
+
+
+def fold(line):
+    '''
+    Fold *line* into lines of at most ics_line_length octets (after the first,
+    starting with a space), without splitting a character.
+    '''
+
+    if len(line) * 4 <= ics_line_length or len(line.encode('utf-8')) <= ics_line_length:
+        return line
+
+    lines, current, length = [], [], 0
+    for character in line:
+        size = len(character.encode('utf-8'))
+        if length + size > ics_line_length:
+            lines.append(''.join(current))
+            # the space starting each continuation line counts
+            current, length = [' '], 1
+        current.append(character)
+        length += size
+    lines.append(''.join(current))
+
+    return '\r\n'.join(lines)
+
+
+def write_ics(tasks, out):
+    ''' Write *tasks* to *out* as an iCalendar file, one VTODO per task. '''
+
+    from dateutil import tz
+
+    stamp = ics_date(time.time())
+    # the zone whose midnight RTM gives as the due time of tasks due on a date
+    zone = tz.gettz(config['USER SETTINGS']['timezone'])
+
+    out.write("BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//dftp//Don't Forget the Python//EN\r\n")
+
+    count = 0
+    for task in tasks:
+        uid = '{}-{}-{}@dftp'.format(task.list_id, task.id, task.task_id)
+
+        lines = ['BEGIN:VTODO', 'UID:' + uid, 'DTSTAMP:' + stamp,
+                 fold('SUMMARY:' + ics_text(task.name))]
+        if task.due != NO_DATE and task.has_due_time:
+            lines.append('DUE:' + ics_date(task.due))
+        elif task.due != NO_DATE:
+            lines.append('DUE;VALUE=DATE:' + ics_day(task.due, zone))
+        if task.completed != NO_DATE:
+            lines += ['STATUS:COMPLETED', 'COMPLETED:' + ics_date(task.completed)]
+        else:
+            lines.append('STATUS:NEEDS-ACTION')
+        if task.tags:
+            lines.append(fold('CATEGORIES:' + ','.join(map(ics_text, task.tags))))
+        lines.append('END:VTODO\r\n')
+
+        out.write('\r\n'.join(lines))
+        count += 1
+
+    out.write('END:VCALENDAR\r\n')
+
+    return count
+
+
+def write_parquet(tasks, path):
+    '''
+    Write *tasks* to a parquet file at *path*, building the columns of (and
+    writing) parquet_batch_size tasks at a time.
+    '''
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    timestamp = pa.timestamp('s', tz='UTC')
+    schema = pa.schema([('taskseries_id', pa.string()), ('task_id', pa.string()),
+                        ('list_id', pa.string()), ('name', pa.string()),
+                        ('tags', pa.list_(pa.string())), ('due', timestamp),
+                        ('has_due_time', pa.bool_()), ('completed', timestamp),
+                        ('overdue', pa.bool_())])
+
+    def write_batch(writer, batch):
+        columns = [[task.id for task in batch],
+                   [task.task_id for task in batch],
+                   [task.list_id for task in batch],
+                   [task.name for task in batch],
+                   [list(task.tags) for task in batch],
+                   [None if task.due == NO_DATE else task.due for task in batch],
+                   [has_due_time(task) for task in batch],
+                   [None if task.completed == NO_DATE else task.completed for task in batch],
+                   [overdue(task) for task in batch]]
+        writer.write_table(pa.Table.from_arrays(
+            [pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+            schema=schema))
+
+    count = 0
+    with pq.ParquetWriter(path, schema) as writer:
+        batch = []
+        for task in tasks:
+            batch.append(task)
+            if len(batch) == parquet_batch_size:
+                write_batch(writer, batch)
+                count += len(batch)
+                batch = []
+        # a file with no tasks still gets its schema
+        if batch or not count:
+            write_batch(writer, batch)
+            count += len(batch)
+
+    return count
+
+
+writers = {'csv': write_csv, 'jsonl': write_jsonl, 'ics': write_ics}
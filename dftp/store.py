@@ -0,0 +1,294 @@
+#!python3
+
+'''
+Local on-disk copy of the user's RTM tasks (and lists).
+
+The store keeps the raw taskseries and task data returned by rtm.tasks.getList,
+so it can be handed back to create_Task_list in exactly the shape RTM sends it.
+It is brought up to date with incremental syncs (see app.sync_store), which only
+transfer the taskseries added, modified or deleted since the previous sync.
+The names and notes of the taskseries are indexed for full-text search (with
+SQLite's FTS5) as they are stored.
+'''
+
+import json
+import sqlite3
+from pathlib import Path
+
+
+store_file = Path().home().joinpath('.dftp.db')
+
+schema = '''
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS taskseries (
+    id TEXT PRIMARY KEY,
+    list_id TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tasks (
+    id TEXT NOT NULL,
+    taskseries_id TEXT NOT NULL,
+    completed TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (taskseries_id, id)
+);
+CREATE TABLE IF NOT EXISTS lists (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS taskseries_list_id ON taskseries (list_id);
+'''
+
+# full-text index of the names and notes of taskseries, by taskseries rowid;
+# not every build of SQLite has FTS5, so the store works without it
+search_schema = '''
+CREATE VIRTUAL TABLE IF NOT EXISTS search USING fts5 (
+    name, notes, tokenize = 'porter unicode61'
+);
+'''
+
+# how much more a match in a task's name counts than one in its notes
+name_weight = 2.0
+
+
+class TaskStore:
+    ''' SQLite database of taskseries, tasks and lists, keyed by their RTM ids. '''
+
+    def __init__(self, path=store_file):
+        self.path = path
+        self.db = sqlite3.connect(str(path))
+        self.db.executescript(schema)
+
+        try:
+            self.db.executescript(search_schema)
+        except sqlite3.OperationalError:
+            self.searchable = False
+        else:
+            self.searchable = True
+            if not self.get_meta('search_indexed'):
+                self.index_all()
+
+    def close(self):
+        self.db.close()
+
+    def get_meta(self, key):
+        row = self.db.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else ''
+
+    def set_meta(self, key, value):
+        self.db.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+                        (key, value))
+
+    @property
+    def last_sync(self):
+        ''' Time of the last successful sync (iso format, utc), or '' if never synced. '''
+        return self.get_meta('last_sync')
+
+    def clear(self):
+        ''' Remove all tasks, e.g. before a full sync. '''
+        with self.db:
+            self.db.execute('DELETE FROM tasks')
+            self.db.execute('DELETE FROM taskseries')
+            if self.searchable:
+                self.db.execute('DELETE FROM search')
+            self.db.execute("DELETE FROM meta WHERE key = 'last_sync'")
+
+    def apply(self, rtm_lists, synced_at):
+        '''
+        Apply the lists returned from rtm.tasks.getList to the store and record
+        *synced_at* as the time of the last sync.
+
+        When called with the response of an incremental (last_sync) request, each
+        list may contain added or modified taskseries under "taskseries" and
+        deleted ones under "deleted".
+        '''
+
+        with self.db:
+            for rtm_list in rtm_lists:
+                for taskseries in rtm_list.get('taskseries', []):
+                    self._upsert(rtm_list['id'], taskseries)
+
+                if 'deleted' in rtm_list:
+                    for taskseries in rtm_list['deleted'].get('taskseries', []):
+                        self._delete(taskseries)
+
+            self.set_meta('last_sync', synced_at)
+
+    def _upsert(self, list_id, taskseries):
+        data = {key: value for key, value in taskseries.items() if key != 'task'}
+
+        # update rather than replace an existing taskseries, to keep its rowid
+        self.db.execute('INSERT INTO taskseries (id, list_id, data) VALUES (?, ?, ?) '
+                        'ON CONFLICT (id) DO UPDATE SET list_id = excluded.list_id, '
+                        'data = excluded.data', (taskseries['id'], list_id, json.dumps(data)))
+
+        if self.searchable:
+            self._index(taskseries)
+
+        for task in taskseries['task']:
+            self.db.execute('INSERT OR REPLACE INTO tasks (id, taskseries_id, completed, data) '
+                            'VALUES (?, ?, ?, ?)',
+                            (task.get('id', ''), taskseries['id'], task['completed'],
+                             json.dumps(task)))
+
+    def _delete(self, taskseries):
+        for task in taskseries.get('task', []):
+            self.db.execute('DELETE FROM tasks WHERE taskseries_id = ? AND id = ?',
+                            (taskseries['id'], task['id']))
+
+        # drop the taskseries itself once it has no tasks left
+        if self.searchable:
+            self.db.execute('DELETE FROM search WHERE rowid = (SELECT rowid FROM taskseries '
+                            'WHERE id = ? AND NOT EXISTS '
+                            '(SELECT 1 FROM tasks WHERE taskseries_id = ?))',
+                            (taskseries['id'], taskseries['id']))
+        self.db.execute('DELETE FROM taskseries WHERE id = ? AND NOT EXISTS '
+                        '(SELECT 1 FROM tasks WHERE taskseries_id = ?)',
+                        (taskseries['id'], taskseries['id']))
+
+    def _index(self, taskseries):
+        ''' Add *taskseries* (already stored) to the search index, or update it. '''
+
+        # RTM sends [] for no notes, or {'note': [notes]}
+        notes = taskseries.get('notes') or {}
+        notes = notes.get('note', [])
+        if isinstance(notes, dict):
+            notes = [notes]
+
+        self.db.execute('INSERT OR REPLACE INTO search (rowid, name, notes) '
+                        'SELECT rowid, ?, ? FROM taskseries WHERE id = ?',
+                        (taskseries['name'],
+                         '\n'.join('{} {}'.format(note.get('title', ''), note.get('$t', ''))
+                                   for note in notes),
+                         taskseries['id']))
+
+    def index_all(self):
+        ''' (Re)build the search index from all stored taskseries. '''
+
+        with self.db:
+            self.db.execute('DELETE FROM search')
+            for (data,) in self.db.execute('SELECT data FROM taskseries').fetchall():
+                self._index(json.loads(data))
+            self.set_meta('search_indexed', '1')
+
+    @property
+    def lists_fetched(self):
+        ''' Time the lists were last stored (seconds since the epoch), or 0. '''
+        return int(self.get_meta('lists_fetched') or 0)
+
+    def set_lists(self, rtm_lists, fetched_at):
+        ''' Replace the stored lists with those from rtm.lists.getList. '''
+
+        with self.db:
+            self.db.execute('DELETE FROM lists')
+            self.db.executemany('INSERT INTO lists (id, name, data) VALUES (?, ?, ?)',
+                                [(rtm_list['id'], rtm_list['name'], json.dumps(rtm_list))
+                                 for rtm_list in rtm_lists])
+            self.set_meta('lists_fetched', str(int(fetched_at)))
+
+    def get_lists(self):
+        ''' Return the stored lists, as returned from rtm.lists.getList. '''
+        return [json.loads(data) for (data,) in self.db.execute('SELECT data FROM lists')]
+
+    def get_list_id(self, list_name):
+        ''' Return the id of the stored list named *list_name*, or ''. '''
+        row = self.db.execute('SELECT id FROM lists WHERE name = ?', (list_name,)).fetchone()
+        return row[0] if row else ''
+
+    def search(self, terms, status=''):
+        '''
+        Return the stored tasks whose names or notes contain all of *terms*
+        (words, or the start of words if they end in "*"), as a list of RTM lists
+        of one taskseries each, best matches first (ranked with bm25).
+        '''
+
+        query = ' '.join(filter(None, (search_term(term) for term in terms)))
+        if not query:
+            return []
+
+        conditions = ['search MATCH ?']
+        if status == 'completed':
+            conditions.append("tasks.completed != ''")
+        if status == 'incomplete':
+            conditions.append("tasks.completed = ''")
+
+        rows = self.db.execute(
+            'SELECT taskseries.list_id, taskseries.id, taskseries.data, tasks.data '
+            'FROM search JOIN taskseries ON taskseries.rowid = search.rowid '
+            'JOIN tasks ON tasks.taskseries_id = taskseries.id '
+            'WHERE ' + ' AND '.join(conditions) + ' '
+            'ORDER BY bm25(search, ?, 1.0), taskseries.id', (query, name_weight))
+
+        rtm_lists = []
+        current_taskseries = None
+
+        for list_id, taskseries_id, taskseries_data, task_data in rows:
+            if current_taskseries is None or current_taskseries['id'] != taskseries_id:
+                current_taskseries = json.loads(taskseries_data)
+                current_taskseries['task'] = []
+                rtm_lists.append({'id': list_id, 'taskseries': [current_taskseries]})
+            current_taskseries['task'].append(json.loads(task_data))
+
+        return rtm_lists
+
+    def get_rtm_tasks(self, list_id='', status=''):
+        '''
+        Return stored tasks in the same structure as app.get_rtm_tasks: RTM lists,
+        each with its taskseries and their tasks. They are returned by a
+        generator that reads them from the database as it goes, and yields
+        each list as soon as all of its tasks have been read.
+        '''
+
+        query = ('SELECT taskseries.list_id, taskseries.id, taskseries.data, tasks.data '
+                 'FROM taskseries JOIN tasks ON tasks.taskseries_id = taskseries.id')
+        conditions = []
+        params = []
+
+        if list_id:
+            conditions.append('taskseries.list_id = ?')
+            params.append(list_id)
+        if status == 'completed':
+            conditions.append("tasks.completed != ''")
+        if status == 'incomplete':
+            conditions.append("tasks.completed = ''")
+
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY taskseries.list_id, taskseries.id'
+
+        def generate():
+            current_list = current_taskseries = None
+
+            for row_list_id, taskseries_id, taskseries_data, task_data in \
+                    self.db.execute(query, params):
+                if current_list is None or current_list['id'] != row_list_id:
+                    if current_list is not None:
+                        yield current_list
+                    current_list = {'id': row_list_id, 'taskseries': []}
+                    current_taskseries = None
+                if current_taskseries is None or current_taskseries['id'] != taskseries_id:
+                    current_taskseries = json.loads(taskseries_data)
+                    current_taskseries['task'] = []
+                    current_list['taskseries'].append(current_taskseries)
+                current_taskseries['task'].append(json.loads(task_data))
+
+            if current_list is not None:
+                yield current_list
+
+        return generate()
+
+
+def search_term(term):
+    ''' Quote *term* for an FTS5 query, keeping a trailing "*" (prefix search). '''
+
+    prefix = term.endswith('*')
+    term = term.rstrip('*').replace('"', '""')
+
+    if not term.strip():
+        return ''
+
+    return '"{}"{}'.format(term, '*' if prefix else '')
@@ -0,0 +1,199 @@
+#!python3
+
+'''
+Timers around the functions of dftp.app that a command spends its time in, for
+"dftp --profile".
+
+The functions are replaced in dftp.app by timed versions only while profiling,
+and as dftp.app calls them by their global names, calls from within dftp.app
+are timed too. Times are inclusive: get_rtm_tasks includes the rtm_get and
+handle_response calls it makes, and when several lists are fetched at once
+their times add up to more than the time the command took.
+
+Some return generators that do their work as they are read, such as
+iter_rtm_tasks (which downloads and decodes its response as it is read),
+TaskStore.get_rtm_tasks and iter_tasks (which creates Tasks from what it
+reads). Those generators are timed too: the time spent in them counts towards
+the function that returned them (and any that passes them on, as
+fetch_rtm_tasks does iter_rtm_tasks'), rather than the one reading them, which
+may be another of them.
+'''
+
+from functools import wraps
+import sys
+import threading
+import time
+import types
+
+
+# (name, what it is) of the functions timed, in the order they are reported
+phases = [('check_token', 'checking the auth token'),
+          ('sync_store', 'syncing the local store'),
+          ('TaskStore.get_rtm_tasks', 'reading tasks from the store'),
+          ('fetch_rtm_tasks', 'fetching tasks'),
+          ('get_rtm_tasks', 'fetching tasks of a list'),
+          ('iter_rtm_tasks', 'streaming and JSON decoding'),
+          ('rtm_get', 'HTTP requests'),
+          ('handle_response', 'JSON decoding and checks'),
+          ('iter_tasks', 'creating and filtering Tasks'),
+          ('create_Task_list', 'collecting Tasks in a list'),
+          ('display_tasks', 'displaying tasks'),
+          ('tabulate', 'tables for the terminal'),
+          ('export_tasks', 'pdf layout'),
+          ('formats.write_tasks', 'csv, jsonl, parquet or ics')]
+
+
+class Streaming(threading.local):
+    ''' Seconds a thread has spent in timed generators. '''
+
+    seconds = 0.0
+
+
+class TimedGenerator:
+    '''
+    *generator*, timed as each of *names* whenever it is read, less any time
+    spent reading timed generators within it.
+    '''
+
+    def __init__(self, timings, name, generator):
+        self.timings = timings
+        self.names = [name]
+        self.generator = generator
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        streaming = self.timings.streaming
+        streamed = streaming.seconds
+        start = time.perf_counter()
+        try:
+            return next(self.generator)
+        finally:
+            seconds = time.perf_counter() - start - (streaming.seconds - streamed)
+            streaming.seconds += seconds
+            for name in self.names:
+                self.timings.add(name, 0, seconds)
+
+    def close(self):
+        self.generator.close()
+
+
+class Timings:
+    ''' Number of calls and total seconds of each timed function. '''
+
+    def __init__(self):
+        self.totals = {}
+        self.lock = threading.Lock()
+        self.replaced = []
+        self.streaming = Streaming()
+
+    def add(self, name, calls, seconds):
+        with self.lock:
+            total_calls, total_seconds = self.totals.get(name, (0, 0.0))
+            self.totals[name] = (total_calls + calls, total_seconds + seconds)
+
+    def wrap(self, name, function):
+        '''
+        Return *function* timed as *name*, less any time it spends reading
+        timed generators. A generator it returns is timed as *name* too.
+        '''
+
+        streaming = self.streaming
+
+        @wraps(function)
+        def timed(*args, **kwargs):
+            streamed = streaming.seconds
+            start = time.perf_counter()
+            try:
+                result = function(*args, **kwargs)
+            finally:
+                seconds = time.perf_counter() - start - (streaming.seconds - streamed)
+                self.add(name, 1, seconds)
+
+            # one returned by another timed function is passed on, not nested
+            if isinstance(result, TimedGenerator):
+                result.names.append(name)
+            elif isinstance(result, types.GeneratorType):
+                result = TimedGenerator(self, name, result)
+
+            return result
+
+        return timed
+
+    def instrument(self, owner, attribute, name=''):
+        '''
+        Replace *owner*.*attribute* (of a module or class) with a version timed
+        as *name* (or *attribute*), until restore() is called.
+        '''
+
+        function = getattr(owner, attribute)
+        self.replaced.append((owner, attribute, function))
+        setattr(owner, attribute, self.wrap(name or attribute, function))
+
+    def restore(self):
+        for module, name, function in reversed(self.replaced):
+            setattr(module, name, function)
+        self.replaced = []
+
+    def report(self, total_seconds, out=None):
+        ''' Write a table of the timed functions that were called to *out* (stderr). '''
+
+        out = out or sys.stderr
+        row = '{:<23} {:<30} {:>6} {:>10} {:>6}\n'
+
+        out.write(row.format('function', '', 'calls', 'seconds', '%'))
+        for name, description in phases:
+            if name in self.totals:
+                calls, seconds = self.totals[name]
+                out.write(row.format(name, description, calls, '{:.4f}'.format(seconds),
+                                     '{:.0f}'.format(100 * seconds / total_seconds)))
+        out.write(row.format('total', '', '', '{:.4f}'.format(total_seconds), '100'))
+
+
+def start(profile_output=''):
+    '''
+    Start timing the functions in phases (and profiling everything with cProfile
+    if there's a *profile_output* file to save the stats to). Return a function
+    that stops, restores the functions and reports the times.
+    '''
+
+    from dftp import app
+    from dftp.store import TaskStore
+
+    timings = Timings()
+
+    for name, description in phases:
+        if name == 'tabulate':
+            # display_tasks imports tabulate when called, so time it in its module
+            import tabulate
+            timings.instrument(tabulate, 'tabulate')
+        elif name.startswith('TaskStore.'):
+            timings.instrument(TaskStore, name.split('.')[1], name)
+        elif name.startswith('formats.'):
+            from dftp import formats
+            timings.instrument(formats, name.split('.')[1], name)
+        else:
+            timings.instrument(app, name)
+
+    if profile_output:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    started = time.perf_counter()
+
+    def stop():
+        total_seconds = time.perf_counter() - started
+
+        if profile_output:
+            profiler.disable()
+            profiler.dump_stats(profile_output)
+
+        timings.restore()
+        timings.report(total_seconds)
+
+        if profile_output:
+            sys.stderr.write('cProfile stats saved to {}\n'.format(profile_output))
+
+    return stop
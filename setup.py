@@ -12,7 +12,7 @@ setup(
     long_description=long_description,
     long_description_content_type="text/markdown",
     url="https://github.com/kdwarn/dont-forget-the-python",
-    packages=find_packages(),
+    packages=find_packages(exclude=["benchmarks", "benchmarks.*"]),
     classifiers=(
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: MIT License",
@@ -22,9 +22,15 @@ setup(
         "click>=6.7",
         "requests>=2.19.1",
         "arrow>=0.12.1",
+        "python-dateutil>=2.7",
         "reportlab>=3.5.2",
         "tabulate>=0.8.2",
     ],
+    extras_require={
+        "streaming": ["ijson>=2.3"],
+        "async": ["httpx>=0.18"],
+        "parquet": ["pyarrow>=1.0"],
+    },
     entry_points={"console_scripts": ["dftp=dftp.app:main"]},
     setup_requires=["pytest-runner"],
     tests_require=["pytest"],
@@ -0,0 +1,38 @@
+#!python3
+
+import os
+import time
+
+import pytest
+
+from dftp import app, daemon
+
+
+# The tests compare dates computed by dftp (in the user's RTM timezone) with
+# dates computed locally, so run them with both set to the same timezone.
+os.environ['TZ'] = 'America/New_York'
+time.tzset()
+
+app.config['USER SETTINGS']['timezone'] = 'America/New_York'
+
+
+@pytest.fixture(autouse=True)
+def store_file(tmp_path, monkeypatch):
+    ''' Keep the local store of each test in its own temporary directory. '''
+    monkeypatch.setattr(app, 'store_file', tmp_path.joinpath('dftp.db'))
+    monkeypatch.setattr(app, 'store', None)
+    yield
+    if app.store is not None:
+        app.store.close()
+
+
+@pytest.fixture(autouse=True)
+def socket_file(tmp_path, monkeypatch):
+    ''' Don't pass commands on to a dftp serve the user is running. '''
+    monkeypatch.setattr(daemon, 'socket_file', tmp_path.joinpath('dftp.sock'))
+
+
+@pytest.fixture(autouse=True)
+def rate_limiter(monkeypatch):
+    ''' Start each test with a full RateLimiter, so tests don't wait on each other. '''
+    monkeypatch.setattr(app, 'rate_limiter', None)
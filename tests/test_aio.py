@@ -0,0 +1,169 @@
+#!python3
+
+import asyncio
+from urllib.parse import parse_qsl
+
+import pytest
+
+httpx = pytest.importorskip('httpx')
+
+from dftp import aio, app
+from dftp.aio import RTMClient
+
+
+lists = [{'id': '1', 'name': 'Work', 'smart': '0', 'archived': '0'},
+         {'id': '2', 'name': 'Home', 'smart': '0', 'archived': '0'}]
+
+
+@pytest.fixture(autouse=True)
+def token(monkeypatch):
+    ''' As if the user's settings had been read, as the dftp command does. '''
+    monkeypatch.setitem(app.config['USER SETTINGS'], 'token', 'token')
+
+
+def rtm_handler(requests):
+    ''' Return a handler for httpx.MockTransport that answers like RTM. '''
+
+    def handler(request):
+        params = dict(parse_qsl(request.url.query.decode(), keep_blank_values=True))
+        requests.append(params)
+
+        api_sig = params.pop('api_sig')
+        if api_sig != app.make_api_sig(params):
+            return httpx.Response(200, json={'rsp': {'stat': 'fail',
+                                                     'err': {'code': '96', 'msg': 'Invalid signature'}}})
+        if params.get('auth_token') == 'revoked':
+            return httpx.Response(200, json={'rsp': {'stat': 'fail',
+                                                     'err': {'code': '98', 'msg': 'Login failed'}}})
+
+        if params['method'] == 'rtm.lists.getList':
+            return httpx.Response(200, json={'rsp': {'stat': 'ok', 'lists': {'list': lists}}})
+        if params['method'] == 'rtm.tasks.getList':
+            rtm_list = {'id': params.get('list_id', '1'), 'taskseries': []}
+            return httpx.Response(200, json={'rsp': {'stat': 'ok',
+                                                     'tasks': {'rev': '1', 'list': [rtm_list]}}})
+        if params['method'] == 'rtm.auth.getFrob':
+            return httpx.Response(200, json={'rsp': {'stat': 'ok', 'frob': 'abc'}})
+
+        return httpx.Response(500)
+
+    return handler
+
+
+def run(method, *args, **kwargs):
+    ''' Call RTMClient.*method* with a mock transport; return the requests made and its result. '''
+
+    requests = []
+
+    async def call():
+        async with RTMClient(transport=httpx.MockTransport(rtm_handler(requests))) as rtm:
+            return await getattr(rtm, method)(*args, **kwargs)
+
+    return requests, asyncio.run(call())
+
+
+def test_get_frob():
+    requests, frob = run('get_frob')
+    assert frob == 'abc'
+
+
+def test_get_rtm_lists():
+    requests, rtm_lists = run('get_rtm_lists')
+    assert rtm_lists == lists
+
+
+def test_get_rtm_tasks_sends_filter():
+    requests, rtm_lists = run('get_rtm_tasks', '', 'incomplete', tag='work')
+
+    assert requests[0]['filter'] == 'status:incompleted AND tag:"work"'
+    assert rtm_lists == [{'id': '1', 'taskseries': []}]
+
+
+def test_fetch_rtm_tasks_of_several_lists():
+    requests, rtm_lists = run('fetch_rtm_tasks', ['Home', 'Work'], '')
+
+    assert [rtm_list['id'] for rtm_list in rtm_lists] == ['2', '1']
+    assert [params['method'] for params in requests] == \
+        ['rtm.lists.getList', 'rtm.tasks.getList', 'rtm.tasks.getList']
+
+
+def test_fetch_rtm_tasks_raises_NoListException():
+    with pytest.raises(app.NoListException):
+        run('fetch_rtm_tasks', ['Errands'], '')
+
+
+def test_bad_status_code_exits():
+    async def call():
+        transport = httpx.MockTransport(lambda request: httpx.Response(503))
+        async with RTMClient(transport=transport) as rtm:
+            await rtm.get_rtm_lists()
+
+    with pytest.raises(SystemExit) as e:
+        asyncio.run(call())
+
+    assert e.value.code == 'Bad Status Code'
+
+
+def test_unreachable_rtm_raises_NetworkException():
+    def unreachable(request):
+        raise httpx.ConnectError('no route to host')
+
+    async def call():
+        async with RTMClient(transport=httpx.MockTransport(unreachable)) as rtm:
+            await rtm.get_rtm_lists()
+
+    with pytest.raises(app.NetworkException):
+        asyncio.run(call())
+
+
+def test_requests_wait_for_the_shared_rate_limiter(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(app, 'rate_limiter', app.RateLimiter(1, 3, clock=lambda: now[0]))
+    waits = []
+
+    async def sleep(seconds):
+        waits.append(seconds)
+
+    monkeypatch.setattr(asyncio, 'sleep', sleep)
+    monkeypatch.setattr(app, 'session', type('Session', (), {'get': lambda *a, **kw: None})())
+    monkeypatch.setattr(app.time, 'sleep', waits.append)
+
+    # the lists, then the tasks of each
+    run('fetch_rtm_tasks', ['Home', 'Work'], '')
+    app.rtm_get(app.methods_url, {})
+    run('get_rtm_lists')
+
+    # a burst of three, then one a second, whichever client sends them
+    assert waits == [1, 2]
+
+
+def test_client_reads_the_config_file(tmp_path, monkeypatch):
+    # as in a program that imports dftp.aio without running the dftp command
+    monkeypatch.setitem(app.config['USER SETTINGS'], 'token', '')
+    config_file = tmp_path.joinpath('.dftp')
+    config_file.write_text('[USER SETTINGS]\ntoken = from the file\n')
+    monkeypatch.setattr(app, 'config_file', config_file)
+
+    requests, rtm_lists = run('get_rtm_lists')
+
+    assert requests[0]['auth_token'] == 'from the file'
+
+
+def test_rejected_token_raises_AuthenticationException(monkeypatch):
+    monkeypatch.setitem(app.config['USER SETTINGS'], 'token', 'revoked')
+    monkeypatch.setattr(app, 'authenticate', lambda: pytest.fail('authenticated in the loop'))
+
+    with pytest.raises(app.AuthenticationException):
+        run('get_rtm_lists')
+
+
+def test_run_reauthenticates_after_the_loop(monkeypatch, capsys):
+    monkeypatch.setitem(app.config['USER SETTINGS'], 'token', 'revoked')
+    monkeypatch.setattr(app, 'authenticate',
+                        lambda: app.config['USER SETTINGS'].__setitem__('token', 'new'))
+    requests = []
+    transport = httpx.MockTransport(rtm_handler(requests))
+    monkeypatch.setattr(aio, 'RTMClient', lambda: RTMClient(transport=transport))
+
+    assert aio.run('get_rtm_lists') == lists
+    assert [params['auth_token'] for params in requests] == ['revoked', 'new']
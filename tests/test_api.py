@@ -1,9 +1,16 @@
 #!python3
 
+import io
+import json
+import sys
+import threading
+import time
+
 import click
 import pytest
 
-from dftp.app import Task, handle_response
+from dftp import app
+from dftp.app import Task, handle_response, get_session, rtm_get
 
 
 # create dummy response class
@@ -25,7 +32,8 @@ def test_handle_response_exits_with_invalid_status():
     with pytest.raises(SystemExit) as e:
         handle_response(invalid_status)
 
-    assert e.type == SystemExit
+    # NetworkException, so it can be caught to fall back on the store
+    assert isinstance(e.value, app.NetworkException)
     assert e.value.code == 'Bad Status Code'
 
 
@@ -47,3 +55,256 @@ def test_handle_response_returns_data():
     ok_data = DummyResponse(200, "Ok", rsp)
     ok_data_response = handle_response(ok_data)
     assert ok_data_response['dummy'] == 'dummy'
+
+
+def test_get_session_is_shared():
+    assert get_session() is get_session()
+
+
+def test_get_session_pools_connections():
+    session = get_session()
+    adapter = session.get_adapter(app.methods_url)
+
+    assert adapter._pool_maxsize == app.pool_maxsize
+    assert session.headers['Accept-Encoding'] == 'gzip'
+
+
+def test_rtm_get_uses_shared_session(monkeypatch):
+    calls = []
+
+    class DummySession:
+        def get(self, url, params, stream=False, timeout=None):
+            calls.append((url, params))
+            return DummyResponse(200, "Ok", {'rsp': {'stat': 'ok'}})
+
+    monkeypatch.setattr(app, 'session', DummySession())
+    rtm_get(app.methods_url, {'method': 'rtm.test.echo'})
+
+    assert calls == [(app.methods_url, {'method': 'rtm.test.echo'})]
+
+
+def test_token_check_due_without_previous_check(monkeypatch):
+    monkeypatch.setitem(app.config['USER SETTINGS'], 'token_checked', '')
+    assert app.token_check_due() is True
+
+
+def test_token_check_not_due_within_ttl(monkeypatch):
+    monkeypatch.setitem(app.config['USER SETTINGS'], 'token_checked', str(int(time.time()) - 60))
+    assert app.token_check_due() is False
+
+
+def test_token_check_due_after_ttl(monkeypatch):
+    checked = int(time.time()) - app.token_ttl - 1
+    monkeypatch.setitem(app.config['USER SETTINGS'], 'token_checked', str(checked))
+    assert app.token_check_due() is True
+
+
+def test_api_call_retries_after_reauthentication(monkeypatch):
+    responses = [DummyResponse(200, "Ok", {'rsp': {'stat': 'fail', 'err': {'code': '98', 'msg': 'Invalid auth token'}}}),
+                 DummyResponse(200, "Ok", {'rsp': {'stat': 'ok', 'dummy': 'dummy'}})]
+    sent_tokens = []
+
+    def rtm_get(url, params):
+        sent_tokens.append(params['auth_token'])
+        return responses.pop(0)
+
+    def authenticate():
+        app.config['USER SETTINGS']['token'] = 'new'
+
+    monkeypatch.setitem(app.config['USER SETTINGS'], 'token', 'old')
+    monkeypatch.setattr(app, 'rtm_get', rtm_get)
+    monkeypatch.setattr(app, 'authenticate', authenticate)
+
+    data = app.api_call({'method': 'rtm.lists.getList', 'auth_token': 'old'})
+
+    assert sent_tokens == ['old', 'new']
+    assert data['dummy'] == 'dummy'
+
+
+def test_sync_store_without_reauthenticating(monkeypatch):
+    response = DummyResponse(200, "Ok", {'rsp': {'stat': 'fail', 'err': {'code': '98', 'msg': 'Invalid auth token'}}})
+    monkeypatch.setattr(app, 'rtm_get', lambda url, params: response)
+    monkeypatch.setattr(app, 'authenticate', lambda: pytest.fail('authenticated'))
+
+    with pytest.raises(app.AuthenticationException):
+        app.sync_store(app.get_store(), reauthenticate=False)
+
+
+def test_build_rtm_filter_without_filters():
+    assert app.build_rtm_filter() == ''
+
+
+def test_build_rtm_filter_status():
+    assert app.build_rtm_filter(status='incomplete') == 'status:incompleted'
+
+
+def test_build_rtm_filter_combines_filters(monkeypatch):
+    monkeypatch.setitem(app.config['USER SETTINGS'], 'dateformat', '1')
+    dates = {'due_before': '8/7/18', 'due_after': '8/5/18'}
+
+    assert app.build_rtm_filter(tag='work', dates=dates, status='incomplete') == \
+        'status:incompleted AND tag:"work" AND dueBefore:"8/7/2018" AND dueAfter:"8/5/2018"'
+
+
+def test_build_rtm_filter_uses_european_date_format(monkeypatch):
+    monkeypatch.setitem(app.config['USER SETTINGS'], 'dateformat', '0')
+
+    assert app.build_rtm_filter(dates={'completed_on': '8/5/18'}) == 'completed:"5/8/2018"'
+
+
+def test_get_rtm_tasks_sends_filter(monkeypatch):
+    sent = []
+
+    def api_call(params, reauthenticate=True):
+        sent.append(params)
+        return {'tasks': {'rev': '1'}}
+
+    monkeypatch.setattr(app, 'api_call', api_call)
+
+    assert app.get_rtm_tasks('', 'completed', tag='work') == []
+    assert sent[0]['filter'] == 'status:completed AND tag:"work"'
+
+
+# response to rtm.tasks.getList with two lists, read in streaming mode
+class DummyStreamResponse(DummyResponse):
+
+    def __init__(self, rsp):
+        super().__init__(200, "Ok", rsp)
+        self.raw = io.BytesIO(json.dumps(rsp).encode('utf-8'))
+
+
+def rtm_tasks_rsp():
+    def taskseries(id):
+        return {'id': id, 'name': 'task ' + id, 'url': '', 'tags': [], 'notes': [],
+                'participants': [], 'task': [{'id': id, 'due': '', 'completed': '',
+                                              'priority': 'N'}]}
+
+    return {'rsp': {'stat': 'ok',
+                    'tasks': {'rev': '1',
+                              'list': [{'id': 'A', 'taskseries': [taskseries('1'), taskseries('2')]},
+                                       {'id': 'B', 'taskseries': [taskseries('3')]}]}}}
+
+
+@pytest.fixture()
+def streamed_tasks(monkeypatch):
+    monkeypatch.setattr(app, 'rtm_get', lambda url, params, stream=False:
+                        DummyStreamResponse(rtm_tasks_rsp()))
+
+
+def test_iter_rtm_tasks_yields_each_taskseries(streamed_tasks):
+    pytest.importorskip('ijson')
+
+    rtm_lists = list(app.iter_rtm_tasks('', ''))
+
+    assert [(rtm_list['id'], rtm_list['taskseries'][0]['id']) for rtm_list in rtm_lists] == \
+        [('A', '1'), ('A', '2'), ('B', '3')]
+
+
+def test_iter_rtm_tasks_is_lazy(streamed_tasks):
+    pytest.importorskip('ijson')
+
+    rtm_lists = app.iter_rtm_tasks('', '')
+
+    assert next(rtm_lists)['taskseries'][0]['name'] == 'task 1'
+
+
+def test_iter_rtm_tasks_without_ijson(streamed_tasks, monkeypatch):
+    monkeypatch.setitem(sys.modules, 'ijson', None)
+
+    rtm_lists = list(app.iter_rtm_tasks('', ''))
+
+    assert [rtm_list['taskseries'][0]['id'] for rtm_list in rtm_lists] == ['1', '2', '3']
+
+
+def test_iter_rtm_tasks_exits_with_not_ok_data(monkeypatch):
+    pytest.importorskip('ijson')
+    rsp = {'rsp': {'stat': 'fail', 'err': {'code': '1000', 'msg': 'dummy error'}}}
+    monkeypatch.setattr(app, 'rtm_get', lambda url, params, stream=False: DummyStreamResponse(rsp))
+
+    with pytest.raises(SystemExit) as e:
+        list(app.iter_rtm_tasks('', ''))
+
+    assert e.value.code == 'Error 1000.'
+
+
+def test_fetch_rtm_tasks_merges_lists_concurrently(monkeypatch):
+    lock = threading.Lock()
+    running = []
+    most_running = []
+
+    def get_rtm_tasks(list_name, status, tag='', dates={}, last_sync='', list_id=''):
+        with lock:
+            running.append(list_id)
+            most_running.append(len(running))
+        time.sleep(0.05)
+        with lock:
+            running.remove(list_id)
+        return [{'id': list_id, 'taskseries': []}]
+
+    monkeypatch.setattr(app, 'get_list_id', lambda list_name: list_name.lower())
+    monkeypatch.setattr(app, 'get_rtm_tasks', get_rtm_tasks)
+
+    rtm_lists = app.fetch_rtm_tasks(['A', 'B', 'C', 'D', 'E', 'A'], 'incomplete')
+
+    assert [rtm_list['id'] for rtm_list in rtm_lists] == ['a', 'b', 'c', 'd', 'e']
+    assert 1 < max(most_running) <= app.max_concurrent_requests
+
+
+def test_rate_limiter_allows_bursts_then_one_request_a_second():
+    now = [100.0]
+    limiter = app.RateLimiter(1, 3, clock=lambda: now[0])
+
+    # three at once, then each a second after the one before
+    assert [limiter.reserve() for _ in range(5)] == [0, 0, 0, 1, 2]
+
+    # the two owed are paid back first
+    now[0] += 2
+    assert limiter.reserve() == 1
+
+    # refilled to no more than a burst
+    now[0] += 60
+    assert [limiter.reserve() for _ in range(4)] == [0, 0, 0, 1]
+
+
+def test_rtm_get_waits_for_rate_limiter(monkeypatch):
+    waits = []
+
+    class Limiter:
+        def reserve(self):
+            return 0.5
+
+    monkeypatch.setattr(app, 'rate_limiter', Limiter())
+    monkeypatch.setattr(app, 'session', type('Session', (), {'get': lambda *a, **kw: 'sent'})())
+    monkeypatch.setattr(time, 'sleep', waits.append)
+
+    assert rtm_get(app.methods_url, {'method': 'rtm.test.echo'}) == 'sent'
+    assert waits == [0.5]
+
+
+def test_build_rtm_filter_with_several_tags():
+    assert app.build_rtm_filter(tag=('work', 'urgent')) == 'tag:"work" AND tag:"urgent"'
+
+
+def test_build_rtm_filter_with_tag_filter():
+    tag_filter = app.TagFilter(all_of='work', any_of=('urgent', 'important'),
+                               none_of='someday')
+
+    assert app.build_rtm_filter(tag=tag_filter) == \
+        'tag:"work" AND (tag:"urgent" OR tag:"important") AND NOT tag:"someday"'
+
+
+def test_rtm_get_raises_NetworkException_without_connection(monkeypatch):
+    import requests
+
+    class DownSession:
+        def get(self, url, params, stream=False, timeout=None):
+            raise requests.exceptions.ConnectionError('no route to host')
+
+    monkeypatch.setattr(app, 'session', DownSession())
+
+    with pytest.raises(app.NetworkException) as e:
+        rtm_get(app.methods_url, {'method': 'rtm.test.echo'})
+
+    # exits like sys.exit if not caught
+    assert isinstance(e.value, SystemExit)
+    assert e.value.code == e.value.message
@@ -0,0 +1,54 @@
+#!python3
+
+from benchmarks import payload, run
+from dftp import app
+
+
+def test_payload_has_number_of_tasks_asked_for():
+    rtm_lists = payload.rtm_lists(500, number_of_lists=7)
+
+    assert len(rtm_lists) == 7
+    assert len(app.create_Task_list(rtm_lists)) == 500
+
+
+def test_payload_is_repeatable():
+    assert payload.rtm_lists(100, 3, seed=1) == payload.rtm_lists(100, 3, seed=1)
+    assert payload.rtm_lists(100, 3, seed=1) != payload.rtm_lists(100, 3, seed=2)
+
+
+def test_payload_has_recurring_tagged_tasks_with_notes():
+    taskseries = [taskseries for rtm_list in payload.rtm_lists(1000, 5)
+                  for taskseries in rtm_list['taskseries']]
+
+    assert any(len(series['task']) > 1 and 'rrule' in series for series in taskseries)
+    assert any(series['tags'] for series in taskseries)
+    assert any(series['notes'] for series in taskseries)
+
+
+def test_run_benchmarks(capsys):
+    results = run.run_benchmarks([50], repeat=1)
+
+    assert set(results) == set(run.benchmarks)
+    assert all(times['50'] > 0 for times in results.values())
+
+
+def test_compare_finds_regressions():
+    baseline = {'Task': {'1000': 1.0, '10000': 10.0}, 'split_list': {'1000': 1.0}}
+    results = {'Task': {'1000': 1.1, '10000': 13.0}, 'split_list': {'1000': 2.0},
+               'new': {'1000': 5.0}}
+
+    assert run.compare(results, baseline, 0.2) == [('Task', '10000', 10.0, 13.0),
+                                                   ('split_list', '1000', 1.0, 2.0)]
+
+
+def test_export_benchmark_exports_every_run(monkeypatch):
+    exported = []
+    export_tasks = app.export_tasks
+    monkeypatch.setattr(app, 'export_tasks',
+                        lambda *args, **kwargs: exported.append(export_tasks(*args, **kwargs)))
+
+    run_export = run.benchmarks['display_tasks[export]'](payload.rtm_lists(50, 2))
+    run_export()
+    run_export()
+
+    assert exported == [True, True]
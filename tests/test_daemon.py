@@ -0,0 +1,161 @@
+#!python3
+
+import os
+from pathlib import Path
+import sqlite3
+import subprocess
+import sys
+import time
+
+import pytest
+
+from benchmarks import load
+from benchmarks.payload import rtm_lists
+from benchmarks.rtm_server import RTMStandIn
+from dftp import app, daemon
+
+
+package_root = Path(__file__).parent.parent
+
+
+@pytest.fixture()
+def served(monkeypatch):
+    ''' A synced store with its tasks in task_index, as in dftp serve. '''
+
+    monkeypatch.setitem(app.config['USER SETTINGS'], 'token', 'token')
+    monkeypatch.setitem(app.config['USER SETTINGS'], 'token_checked', str(int(time.time())))
+    monkeypatch.setattr(app, 'load_config', lambda: app.config)
+
+    payload = rtm_lists(500, 3)
+    lists = [{'id': rtm_list['id'], 'name': 'List ' + rtm_list['id'], 'smart': '0',
+              'archived': '0'} for rtm_list in payload]
+    monkeypatch.setattr(app, 'get_rtm_lists', lambda: lists)
+
+    store = app.get_store()
+    store.apply(payload, '2018-06-01T00:00:00Z')
+    store.set_lists(lists, time.time())
+
+    monkeypatch.setattr(app, 'task_index', daemon.index_tasks(store))
+
+    return store
+
+
+def test_query_task_index_matches_create_Task_list(served):
+    dates = {'due_after': '1/1/18', 'due_before': '1/1/19'}
+    tag_filter = app.TagFilter(any_of=('work', 'home'), none_of='someday')
+
+    for list_names in [(), ('List 1',), ('List 2', 'List 0')]:
+        # as the tasks command gets them without dftp serve
+        rtm_tasks = [rtm_list for name in list_names
+                     for rtm_list in served.get_rtm_tasks(served.get_list_id(name))]
+        expected = app.create_Task_list(rtm_tasks or served.get_rtm_tasks(), tag=tag_filter,
+                                        dates=dates)
+
+        tasks = app.query_task_index(served, list_names, tag=tag_filter, dates=dates)
+
+        # the same tasks, in the same order
+        assert [(task.id, task.due) for task in tasks] == \
+            [(task.id, task.due) for task in expected]
+
+
+def test_query_task_index_without_matching_tasks(served, tmp_path):
+    assert app.query_task_index(served, (), tag='no such tag') == []
+    assert daemon.run(['tasks', '-t', 'no such tag'], str(tmp_path), False)['stdout'] == \
+        'No tasks with those parameters.\n'
+
+
+def test_run_returns_output_and_status(served, tmp_path):
+    response = daemon.run(['tasks', '-i', '-l', 'List 1'], str(tmp_path), False)
+
+    assert response['status'] == 0
+    assert response['stdout'].startswith('\nIncomplete Tasks\n')
+    assert response['stderr'].startswith('Tasks as of')
+
+
+def test_run_reports_errors(served, tmp_path):
+    assert daemon.run(['tasks', '-l', 'Nope'], str(tmp_path), False)['stdout'] == \
+        'No list by that name found.\n'
+    assert daemon.run(['tasks', '--nope'], str(tmp_path), False)['status'] == 2
+
+
+def test_run_exports_to_cwd(served, tmp_path):
+    response = daemon.run(['tasks', '-e', '-f', 'exported'], str(tmp_path), False)
+
+    assert response['status'] == 0
+    assert tmp_path.joinpath('exported.pdf').exists()
+
+
+def test_run_is_not_forwarded_again(served, tmp_path, monkeypatch):
+    monkeypatch.setattr(daemon, 'forward', lambda args: pytest.fail('forwarded'))
+    assert daemon.run(['lists'], str(tmp_path), False)['status'] == 0
+
+
+class Stopped:
+    ''' Stands in for the threading.Event refresh waits on: set after *refreshes*. '''
+
+    def __init__(self, refreshes):
+        self.refreshes = refreshes
+
+    def wait(self, interval):
+        self.refreshes -= 1
+        return self.refreshes < 0
+
+
+def test_refresh_carries_on_after_errors(served, monkeypatch, capsys):
+    errors = [sqlite3.OperationalError('database is locked'), app.AuthenticationException()]
+
+    def sync_store(store, reauthenticate=True):
+        # the user can't be asked to authenticate again from the refresh thread
+        assert not reauthenticate
+        raise errors.pop(0)
+
+    monkeypatch.setattr(app, 'sync_store', sync_store)
+    monkeypatch.setattr(app, 'authenticate', lambda: pytest.fail('authenticated'))
+    monkeypatch.setattr(app, 'task_index', None)
+
+    daemon.refresh(0, True, Stopped(3))
+
+    assert errors == []
+    assert app.task_index is not None
+    stderr = capsys.readouterr().err
+    assert 'database is locked' in stderr and 'authenticate again' in stderr
+
+
+def test_forward_without_daemon():
+    assert daemon.forward(['tasks']) is None
+
+
+def test_serve_answers_commands(tmp_path, monkeypatch, capsys):
+    home = load.make_home(str(tmp_path))
+    env = dict(os.environ, HOME=home, PYTHONPATH=str(package_root))
+
+    with RTMStandIn(number_of_tasks=200, number_of_lists=2) as rtm:
+        env['DFTP_METHODS_URL'] = rtm.url
+        server = subprocess.Popen([sys.executable, '-c', 'from dftp.app import main; main()',
+                                   'serve'], env=env, stdout=subprocess.PIPE,
+                                  stderr=subprocess.PIPE)
+
+        socket_file = tmp_path.joinpath('.dftp.sock')
+        monkeypatch.setattr(daemon, 'socket_file', socket_file)
+        for _ in range(200):
+            if socket_file.exists() or server.poll() is not None:
+                break
+            time.sleep(0.05)
+
+        try:
+            assert daemon.forward(['tasks', '-i', '-l', 'List 1']) == 0
+            assert 'Incomplete Tasks' in capsys.readouterr().out
+
+            assert daemon.forward(['lists']) == 0
+            assert capsys.readouterr().out == 'List 0\nList 1\n'
+
+            assert daemon.forward(['tasks', '-l', 'Nope']) == 0
+            assert 'No list by that name' in capsys.readouterr().out
+        finally:
+            server.terminate()
+            server.wait(10)
+
+    # stopped cleanly, and removed its socket
+    assert server.returncode == 0
+    assert not socket_file.exists()
+    assert daemon.forward(['tasks']) is None
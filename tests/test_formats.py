@@ -0,0 +1,249 @@
+#!python3
+
+import csv
+import io
+import json
+import sys
+
+from click.testing import CliRunner
+import pytest
+
+from dftp import app, formats
+from dftp.app import NO_DATE, Task, TaskContext
+
+
+def make_task(name, due='', completed='', tags=(), list_id='1', id='1', task_id='1',
+              has_due_time='1'):
+    taskseries = {'id': id, 'name': name, 'tags': {'tag': list(tags)} if tags else []}
+    context = TaskContext(now=1533500000)
+    return Task(taskseries, {'id': task_id, 'due': due, 'has_due_time': has_due_time,
+                             'completed': completed}, list_id, context)
+
+
+@pytest.fixture()
+def tasks():
+    return [make_task('Pay "bills", rent; etc.', due='2018-08-05T14:00:00Z', tags=('home', 'bills')),
+            make_task('Read über\nbook', due='2018-07-31T14:00:00Z',
+                      completed='2018-08-01T09:30:00Z', id='2', list_id='2'),
+            make_task('Someday', id='3')]
+
+
+@pytest.fixture()
+def recurring():
+    ''' Two occurrences of a recurring task: one done, the next overdue. '''
+    return [make_task('Water plants', due='2018-08-01T14:00:00Z',
+                      completed='2018-08-01T15:00:00Z', id='5', task_id='1'),
+            make_task('Water plants', due='2018-08-04T14:00:00Z', id='5', task_id='2')]
+
+
+def test_iso_date():
+    assert formats.iso_date(1533477600) == '2018-08-05T14:00:00Z'
+    assert formats.iso_date(NO_DATE) == ''
+
+
+def test_write_csv(tasks):
+    out = io.StringIO()
+
+    assert formats.write_csv(tasks, out) == 3
+
+    rows = list(csv.reader(io.StringIO(out.getvalue())))
+    assert rows[0] == list(formats.fields)
+    assert rows[1] == ['1', '1', '1', 'Pay "bills", rent; etc.', 'home,bills',
+                       '2018-08-05T14:00:00Z', 'true', '', 'true']
+    # overdue only for incomplete tasks
+    assert rows[2] == ['2', '1', '2', 'Read über\nbook', '', '2018-07-31T14:00:00Z', 'true',
+                       '2018-08-01T09:30:00Z', '']
+    assert rows[3][-3:] == ['', '', 'false']
+
+
+def test_write_jsonl(tasks):
+    out = io.StringIO()
+
+    assert formats.write_jsonl(tasks, out) == 3
+
+    records = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert records[0] == {'taskseries_id': '1', 'task_id': '1', 'list_id': '1',
+                          'name': 'Pay "bills", rent; etc.', 'tags': ['home', 'bills'],
+                          'due': '2018-08-05T14:00:00Z', 'has_due_time': True,
+                          'completed': None, 'overdue': True}
+    assert records[1]['name'] == 'Read über\nbook'
+    assert records[1]['overdue'] is None
+    assert records[2]['due'] is None and records[2]['has_due_time'] is None
+    assert records[2]['tags'] == []
+
+
+def test_task_due_on_a_date(tasks):
+    # due on August 5th in New York (see conftest), at no particular time
+    task = make_task('Call', due='2018-08-05T04:00:00Z', has_due_time='0')
+
+    out = io.StringIO()
+    formats.write_jsonl([task], out)
+
+    assert json.loads(out.getvalue())['has_due_time'] is False
+
+    out = io.StringIO()
+    formats.write_ics([task] + tasks, out)
+    lines = out.getvalue().split('\r\n')
+
+    assert 'DUE;VALUE=DATE:20180805' in lines
+    assert 'DUE:20180805T140000Z' in lines
+
+
+def test_occurrences_of_a_recurring_task_are_told_apart(recurring):
+    out = io.StringIO()
+    formats.write_jsonl(recurring, out)
+    records = [json.loads(line) for line in out.getvalue().splitlines()]
+
+    assert [(record['taskseries_id'], record['task_id']) for record in records] == \
+        [('5', '1'), ('5', '2')]
+    assert [record['overdue'] for record in records] == [None, True]
+
+    out = io.StringIO()
+    formats.write_ics(recurring, out)
+
+    assert sorted(line for line in out.getvalue().split('\r\n') if line.startswith('UID:')) == \
+        ['UID:1-5-1@dftp', 'UID:1-5-2@dftp']
+
+
+def test_write_ics(tasks):
+    out = io.StringIO()
+
+    assert formats.write_ics(tasks, out) == 3
+
+    lines = out.getvalue().split('\r\n')
+    assert lines[0] == 'BEGIN:VCALENDAR' and lines[-2:] == ['END:VCALENDAR', '']
+    assert lines.count('BEGIN:VTODO') == lines.count('END:VTODO') == 3
+    assert 'SUMMARY:Pay "bills"\\, rent\\; etc.' in lines
+    assert 'SUMMARY:Read über\\nbook' in lines
+    assert 'CATEGORIES:home,bills' in lines
+    assert 'DUE:20180805T140000Z' in lines
+    assert 'COMPLETED:20180801T093000Z' in lines
+    assert len({line for line in lines if line.startswith('UID:')}) == 3
+
+
+def test_ics_lines_are_folded():
+    line = formats.fold('SUMMARY:' + 'é' * 100)
+
+    assert all(len(part.encode('utf-8')) <= formats.ics_line_length
+               for part in line.split('\r\n'))
+    assert line.replace('\r\n ', '') == 'SUMMARY:' + 'é' * 100
+
+
+def test_write_tasks_to_file(tasks, tmp_path):
+    filename = str(tmp_path.joinpath('tasks'))
+
+    assert formats.write_tasks(iter(tasks), 'jsonl', filename) == 3
+    assert len(tmp_path.joinpath('tasks.jsonl').read_text(encoding='utf-8').splitlines()) == 3
+
+
+def test_write_parquet_in_batches(tasks, tmp_path, monkeypatch):
+    pq = pytest.importorskip('pyarrow.parquet')
+    monkeypatch.setattr(formats, 'parquet_batch_size', 2)
+    path = str(tmp_path.joinpath('tasks.parquet'))
+
+    assert formats.write_parquet(iter(tasks), path) == 3
+
+    assert pq.ParquetFile(path).num_row_groups == 2
+    table = pq.read_table(path)
+    assert table.column_names == list(formats.fields)
+    assert table.column('name').to_pylist() == [task.name for task in tasks]
+    assert table.column('due').to_pylist()[2] is None
+    assert table.column('has_due_time').to_pylist() == [True, True, None]
+    assert table.column('overdue').to_pylist() == [True, None, False]
+
+
+@pytest.fixture()
+def synced(monkeypatch):
+    ''' Run the tasks command from a synced store, without RTM. '''
+
+    monkeypatch.setattr(app, 'load_config', lambda: app.config)
+    monkeypatch.setattr(app, 'sync_in_background', lambda store: False)
+    # set by --offline, for the tests that follow
+    monkeypatch.setattr(app, 'offline', False)
+
+    store = app.get_store()
+    store.apply([{'id': '1', 'taskseries': [
+        {'id': str(i), 'name': 'task {}'.format(i), 'tags': [], 'notes': [],
+         'task': [{'id': str(i), 'due': '2018-08-0{}T14:00:00Z'.format(i), 'completed': ''}]}
+        for i in range(1, 4)]}], '2018-08-05T00:00:00Z')
+
+
+def test_tasks_command_writes_format_to_stdout(synced):
+    result = CliRunner().invoke(app.main, ['--offline', 'tasks', '--format', 'csv'])
+
+    assert result.exit_code == 0
+    assert result.stdout.splitlines()[1:] == [
+        '{0},{0},1,task {0},,2018-08-0{0}T14:00:00Z,true,,true'.format(i) for i in range(1, 4)]
+
+
+def test_tasks_command_writes_format_to_file(synced, tmp_path):
+    filename = str(tmp_path.joinpath('tasks'))
+
+    result = CliRunner().invoke(app.main, ['--offline', 'tasks', '-e', '-f', filename,
+                                           '--format', 'ics'])
+
+    assert result.exit_code == 0
+    assert tmp_path.joinpath('tasks.ics').read_text().count('BEGIN:VTODO') == 3
+
+
+def test_tasks_command_without_matching_tasks(synced):
+    result = CliRunner().invoke(app.main, ['--offline', 'tasks', '-t', 'none', '--format', 'csv'])
+
+    assert result.exit_code == 0
+    assert result.stdout.splitlines() == [','.join(formats.fields)]
+
+
+def test_parquet_needs_a_file(synced):
+    result = CliRunner().invoke(app.main, ['--offline', 'tasks', '--format', 'parquet'])
+
+    assert result.exit_code == 2
+    assert 'add -e' in result.output
+
+
+def test_parquet_needs_pyarrow(synced, monkeypatch):
+    monkeypatch.setitem(sys.modules, 'pyarrow', None)
+
+    result = CliRunner().invoke(app.main, ['--offline', 'tasks', '-e', '--format', 'parquet'])
+
+    assert result.exit_code == 2
+    assert 'pyarrow' in result.output
+
+
+@pytest.fixture()
+def rtm_lists_calls(monkeypatch):
+    ''' Count calls to rtm.lists.getList, which returns lists "Home" and "Work". '''
+    calls = []
+
+    def get_rtm_lists():
+        calls.append(1)
+        return [{'id': '1', 'name': 'Home'}, {'id': '2', 'name': 'Work'}]
+
+    monkeypatch.setattr(app, 'get_rtm_lists', get_rtm_lists)
+    monkeypatch.setattr(app, 'offline', False)
+    return calls
+
+
+def test_export_all_lists_in_format(tasks, tmp_path, rtm_lists_calls):
+    app.export_all_lists(tasks, '', '', str(tmp_path.joinpath('tasks')), 'jsonl')
+
+    assert len(tmp_path.joinpath('tasks - Home.jsonl').read_text().splitlines()) == 2
+    assert len(tmp_path.joinpath('tasks - Work.jsonl').read_text().splitlines()) == 1
+    assert len(rtm_lists_calls) == 1
+
+
+def test_export_all_lists_uses_expired_lists(tasks, tmp_path, rtm_lists_calls, monkeypatch):
+    app.get_store().set_lists([{'id': '1', 'name': 'Home'}, {'id': '2', 'name': 'Work'}], 0)
+
+    app.export_all_lists(tasks, '', '', str(tmp_path.joinpath('tasks')), 'jsonl')
+
+    assert tmp_path.joinpath('tasks - Work.jsonl').exists()
+    assert rtm_lists_calls == []
+
+    # a list missing from them isn't asked for when offline, but named by its id
+    monkeypatch.setattr(app, 'offline', True)
+    app.get_store().set_lists([{'id': '1', 'name': 'Home'}], 0)
+
+    app.export_all_lists(tasks, '', '', str(tmp_path.joinpath('offline')), 'jsonl')
+
+    assert tmp_path.joinpath('offline - 2.jsonl').exists()
+    assert rtm_lists_calls == []
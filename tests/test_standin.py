@@ -0,0 +1,153 @@
+#!python3
+
+'''
+End-to-end tests of the requests dftp makes (signing, sessions, gzip, streamed
+JSON), against the stand-in RTM server in benchmarks.rtm_server.
+'''
+
+import json
+
+import click
+import pytest
+
+from benchmarks import load
+from benchmarks.rtm_server import RTMStandIn
+from dftp import app
+
+
+@pytest.fixture()
+def rtm(monkeypatch):
+    with RTMStandIn(number_of_tasks=200, number_of_lists=3) as rtm:
+        monkeypatch.setattr(app, 'methods_url', rtm.url)
+        monkeypatch.setattr(app, 'session', None)
+        monkeypatch.setitem(app.config['USER SETTINGS'], 'token', 'standin-token')
+        yield rtm
+
+
+def test_get_rtm_lists(rtm):
+    assert [rtm_list['name'] for rtm_list in app.get_rtm_lists()] == \
+        ['List 0', 'List 1', 'List 2']
+
+
+def test_check_token(rtm, monkeypatch):
+    monkeypatch.setattr(app, 'save', lambda config: None)
+    assert app.check_token()['auth']['token'] == 'standin-token'
+
+
+def test_get_rtm_tasks_of_all_lists(rtm):
+    assert len(app.create_Task_list(app.get_rtm_tasks('', ''))) == 200
+
+
+def test_stream_tasks_of_a_list(rtm):
+    tasks = list(app.iter_tasks(app.fetch_rtm_tasks(['List 1'], '')))
+
+    assert tasks and {task.list_id for task in tasks} == {'1'}
+    assert rtm.requests == {'rtm.lists.getList': 1, 'rtm.tasks.getList': 1}
+
+
+def test_fetch_tasks_of_several_lists(rtm):
+    rtm_lists = app.fetch_rtm_tasks(['List 2', 'List 0'], '')
+
+    assert [rtm_list['id'] for rtm_list in rtm_lists] == ['2', '0']
+
+
+def test_sync_store(rtm):
+    store = app.sync_store(app.get_store())
+    assert len(app.create_Task_list(store.get_rtm_tasks())) == 200
+
+    app.sync_store(store)
+    assert len(app.create_Task_list(store.get_rtm_tasks())) == 200
+    assert rtm.requests['rtm.tasks.getList'] == 2
+
+
+def test_bad_signature_is_rejected(rtm):
+    params = {'api_key': app.api_key, 'method': 'rtm.lists.getList', 'format': 'json',
+              'api_sig': 'forged'}
+
+    with pytest.raises(SystemExit) as e:
+        app.handle_response(app.rtm_get(app.methods_url, params))
+
+    assert e.value.code == 'Error 96.'
+
+
+def test_unknown_token_is_rejected(rtm, monkeypatch):
+    monkeypatch.setitem(app.config['USER SETTINGS'], 'token', 'revoked')
+    params = app.rtm_tasks_params('', '')
+    params['api_sig'] = app.make_api_sig(params)
+
+    with pytest.raises(app.AuthenticationException):
+        app.handle_response(app.rtm_get(app.methods_url, params), reauthenticate=False)
+
+
+def test_rejected_token_is_replaced(rtm, monkeypatch):
+    settings = dict(app.config['USER SETTINGS'])
+    monkeypatch.setitem(app.config['USER SETTINGS'], 'token', 'revoked')
+    monkeypatch.setattr(app, 'auth_url', rtm.url)
+    monkeypatch.setattr(app, 'save', lambda config: None)
+    monkeypatch.setattr(click, 'pause', lambda info='': None)
+
+    try:
+        # authenticates again, then repeats the call with the new token
+        assert len(app.get_rtm_lists()) == 3
+        assert app.config['USER SETTINGS']['token'] in rtm.tokens - {'standin-token'}
+    finally:
+        app.config['USER SETTINGS'] = settings
+
+    assert rtm.requests['rtm.auth.getToken'] == 1
+    assert rtm.requests['rtm.lists.getList'] == 2
+
+
+def test_failing_server_raises_NetworkException(rtm):
+    rtm.error_rate = 1
+
+    with pytest.raises(app.NetworkException):
+        app.get_rtm_lists()
+
+
+def test_recorded_fixture(tmp_path, monkeypatch):
+    recorded = {'rsp': {'stat': 'ok', 'tasks': {'rev': '1', 'list': [
+        {'id': '7', 'taskseries': [{'id': '1', 'name': 'recorded', 'tags': [], 'notes': [],
+                                    'task': [{'id': '1', 'due': '', 'completed': ''}]}]}]}}}
+    fixture = tmp_path.joinpath('tasks.json')
+    fixture.write_text(json.dumps(recorded))
+
+    with RTMStandIn(fixture=str(fixture)) as rtm:
+        monkeypatch.setattr(app, 'methods_url', rtm.url)
+        monkeypatch.setattr(app, 'session', None)
+        monkeypatch.setitem(app.config['USER SETTINGS'], 'token', 'standin-token')
+        tasks = app.create_Task_list(app.get_rtm_tasks('', ''))
+
+    assert [task.name for task in tasks] == ['recorded']
+
+
+def test_async_client(rtm):
+    pytest.importorskip('httpx')
+    from dftp import aio
+
+    rtm_lists = aio.run('fetch_rtm_tasks', ['List 0', 'List 1'], '')
+    assert [rtm_list['id'] for rtm_list in rtm_lists] == ['0', '1']
+
+
+def test_load_runs_dftp_commands(rtm):
+    timings, total_seconds = load.run_load([['lists'], ['tasks', '-i']], rtm.url,
+                                           number_of_runs=2, concurrency=2)
+
+    assert {command: len(failures) for command, (times, failures) in timings.items()} == \
+        {'lists': 0, 'tasks -i': 0}
+    # by "tasks -i" alone, without a sync in the background
+    assert rtm.requests['rtm.tasks.getList'] == 1
+
+
+def test_load_with_shared_home_reads_synced_store(rtm):
+    timings, total_seconds = load.run_load([['tasks', '-i']], rtm.url, number_of_runs=2,
+                                           concurrency=2, shared_home=True)
+
+    assert len(timings['tasks -i'][1]) == 0
+    # only by the dftp sync before the runs
+    assert rtm.requests['rtm.tasks.getList'] == 1
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert [load.percentile(values, percent) for percent in (50, 90, 99, 100)] == \
+        [50, 90, 99, 100]
@@ -0,0 +1,63 @@
+#!python3
+
+import os
+from pathlib import Path
+import subprocess
+import sys
+
+import pytest
+
+
+package_root = Path(__file__).parent.parent
+
+# modules that are slow to import and are only needed by some commands
+heavy_modules = ['requests', 'arrow', 'tabulate', 'reportlab']
+
+# generous upper bound on the cumulative import time of dftp.app, in microseconds
+import_time_budget = 150000
+
+
+def importtime(code, home):
+    '''
+    Run *code* in a fresh interpreter with "-X importtime" and return a dict of
+    module name to cumulative import time in microseconds.
+    '''
+
+    env = dict(os.environ, HOME=str(home))
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                            cwd=str(package_root), env=env, stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE, universal_newlines=True, check=True)
+
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, module = line.split('|')
+        times[module.strip()] = int(cumulative)
+
+    return times
+
+
+@pytest.fixture(scope='module')
+def import_times(tmp_path_factory):
+    return importtime('import dftp.app', tmp_path_factory.mktemp('home'))
+
+
+@pytest.mark.parametrize('module', heavy_modules)
+def test_import_does_not_load_heavy_module(import_times, module):
+    assert module not in import_times
+
+
+def test_import_time_within_budget(import_times):
+    assert import_times['dftp.app'] < import_time_budget
+
+
+def test_help_does_not_load_heavy_modules(tmp_path):
+    times = importtime('import sys; from dftp.app import main; sys.argv = ["dftp", "--help"]; '
+                       'main(standalone_mode=False)', tmp_path)
+    assert not set(heavy_modules) & set(times)
+
+
+def test_import_does_not_create_config_file(tmp_path):
+    importtime('import dftp.app', tmp_path)
+    assert not tmp_path.joinpath('.dftp').exists()
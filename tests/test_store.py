@@ -0,0 +1,334 @@
+#!python3
+
+import time
+
+from click.testing import CliRunner
+import pytest
+
+from dftp import app, daemon
+from dftp.app import create_Task_list, sync_store
+from dftp.store import TaskStore
+
+
+def rtm_taskseries(id, name, task_ids=('1',), completed=''):
+    ''' Taskseries as returned from rtm.tasks.getList. '''
+    return {'id': id, 'name': name, 'url': '', 'tags': [], 'notes': [],
+            'participants': [],
+            'task': [{'id': task_id, 'due': '', 'completed': completed,
+                      'priority': 'N'} for task_id in task_ids]}
+
+
+def deleted_taskseries(id, task_ids=('1',)):
+    return {'id': id, 'task': [{'id': task_id, 'deleted': '2018-08-05T00:00:00Z'}
+                               for task_id in task_ids]}
+
+
+@pytest.fixture()
+def store(tmp_path):
+    store = TaskStore(tmp_path.joinpath('dftp.db'))
+    store.apply([{'id': 'A', 'taskseries': [rtm_taskseries('1', 'one'),
+                                            rtm_taskseries('2', 'two', completed='2018-08-05T00:00:00Z')]},
+                 {'id': 'B', 'taskseries': [rtm_taskseries('3', 'three', task_ids=('1', '2'))]}],
+                '2018-08-05T00:00:00Z')
+    yield store
+    store.close()
+
+
+def names(rtm_lists):
+    return sorted(taskseries['name'] for rtm_list in rtm_lists
+                  for taskseries in rtm_list['taskseries'])
+
+
+def test_store_records_last_sync(store):
+    assert store.last_sync == '2018-08-05T00:00:00Z'
+
+
+def test_store_returns_all_tasks(store):
+    assert len(create_Task_list(store.get_rtm_tasks(), dates={})) == 4
+
+
+def test_store_returns_tasks_list_by_list(store):
+    rtm_lists = store.get_rtm_tasks()
+
+    assert names([next(rtm_lists)]) == ['one', 'two']
+    assert names(rtm_lists) == ['three']
+
+
+def test_store_filters_by_list(store):
+    assert names(store.get_rtm_tasks(list_id='B')) == ['three']
+
+
+def test_store_filters_by_status(store):
+    assert names(store.get_rtm_tasks(status='completed')) == ['two']
+    assert names(store.get_rtm_tasks(status='incomplete')) == ['one', 'three']
+
+
+def test_store_applies_modified_taskseries(store):
+    store.apply([{'id': 'B', 'taskseries': [rtm_taskseries('1', 'one, renamed and moved')]}],
+                '2018-08-06T00:00:00Z')
+
+    assert names(store.get_rtm_tasks(list_id='A')) == ['two']
+    assert names(store.get_rtm_tasks(list_id='B')) == ['one, renamed and moved', 'three']
+    assert store.last_sync == '2018-08-06T00:00:00Z'
+
+
+def test_store_applies_deleted_tasks(store):
+    store.apply([{'id': 'A', 'deleted': {'taskseries': [deleted_taskseries('1')]}},
+                 {'id': 'B', 'deleted': {'taskseries': [deleted_taskseries('3', task_ids=('2',))]}}],
+                '2018-08-06T00:00:00Z')
+
+    assert names(store.get_rtm_tasks()) == ['three', 'two']
+    assert len(next(store.get_rtm_tasks(list_id='B'))['taskseries'][0]['task']) == 1
+
+
+def test_sync_store_sends_last_sync(store, monkeypatch):
+    calls = []
+
+    def get_rtm_tasks(list_name, status, last_sync='', reauthenticate=True):
+        calls.append(last_sync)
+        return [{'id': 'A', 'taskseries': [rtm_taskseries('4', 'four')]}]
+
+    monkeypatch.setattr(app, 'get_rtm_tasks', get_rtm_tasks)
+    sync_store(store)
+
+    # a little before the last sync, in case the local clock was ahead of RTM's
+    assert calls == ['2018-08-04T23:45:00Z']
+    assert store.last_sync != '2018-08-05T00:00:00Z'
+    assert 'four' in names(store.get_rtm_tasks())
+
+
+def test_full_sync_replaces_store(store, monkeypatch):
+    monkeypatch.setattr(app, 'get_rtm_tasks', lambda list_name, status, **kwargs:
+                        [{'id': 'A', 'taskseries': [rtm_taskseries('4', 'four')]}])
+    sync_store(store, full=True)
+
+    assert names(store.get_rtm_tasks()) == ['four']
+
+
+################################################################################
+# test the cache of lists used to look up list ids
+################################################################################
+@pytest.fixture()
+def rtm_lists_calls(monkeypatch):
+    ''' Count calls to rtm.lists.getList, which returns lists "Work" and "Home". '''
+    calls = []
+
+    def get_rtm_lists():
+        calls.append(1)
+        return [{'id': '1', 'name': 'Work', 'smart': '0', 'archived': '0'},
+                {'id': '2', 'name': 'Home', 'smart': '0', 'archived': '0'}]
+
+    monkeypatch.setattr(app, 'get_rtm_lists', get_rtm_lists)
+    return calls
+
+
+def test_get_list_id_fetches_lists_once(rtm_lists_calls):
+    assert app.get_list_id('Work') == '1'
+    assert app.get_list_id('Home') == '2'
+    assert len(rtm_lists_calls) == 1
+
+
+def test_get_list_id_refetches_expired_lists(rtm_lists_calls):
+    app.get_store().set_lists([], time.time() - app.lists_ttl - 1)
+
+    assert app.get_list_id('Work') == '1'
+    assert len(rtm_lists_calls) == 1
+
+
+def test_get_list_id_refreshes_lists_on_miss(rtm_lists_calls):
+    app.get_store().set_lists([{'id': '3', 'name': 'Old', 'smart': '0', 'archived': '0'}],
+                              time.time())
+
+    assert app.get_list_id('Home') == '2'
+    assert len(rtm_lists_calls) == 1
+
+
+def test_get_list_id_raises_NoListException(rtm_lists_calls):
+    with pytest.raises(app.NoListException):
+        app.get_list_id('Errands')
+
+
+def test_get_cached_lists_refresh(rtm_lists_calls):
+    app.get_cached_lists()
+    app.get_cached_lists()
+    app.get_cached_lists(refresh=True)
+
+    assert len(rtm_lists_calls) == 2
+
+
+################################################################################
+# test full-text search of names and notes
+################################################################################
+@pytest.fixture()
+def searchable_store(tmp_path):
+    store = TaskStore(tmp_path.joinpath('dftp.db'))
+    if not store.searchable:
+        pytest.skip('SQLite without FTS5')
+
+    with_note = rtm_taskseries('3', 'call the plumber')
+    with_note['notes'] = {'note': [{'id': '1', 'title': 'Sink', '$t': 'Leaking milk bottles'}]}
+
+    store.apply([{'id': 'A', 'taskseries': [rtm_taskseries('1', 'buy milk'),
+                                            rtm_taskseries('2', 'milk the cows',
+                                                           completed='2018-08-05T00:00:00Z'),
+                                            with_note]},
+                 {'id': 'B', 'taskseries': [rtm_taskseries('4', 'walk the dog')]}],
+                '2018-08-05T00:00:00Z')
+    yield store
+    store.close()
+
+
+def test_search_names_and_notes(searchable_store):
+    assert names(searchable_store.search(['dog'])) == ['walk the dog']
+    assert names(searchable_store.search(['leaking'])) == ['call the plumber']
+    assert names(searchable_store.search(['milk', 'bottle'])) == ['call the plumber']
+    assert searchable_store.search(['elephant']) == []
+
+
+def test_search_ranks_names_above_notes(searchable_store):
+    rtm_lists = searchable_store.search(['milk'])
+    ranked = [rtm_list['taskseries'][0]['name'] for rtm_list in rtm_lists]
+
+    assert ranked[-1] == 'call the plumber'
+    assert [rtm_list['id'] for rtm_list in rtm_lists] == ['A', 'A', 'A']
+
+
+def test_search_by_prefix_and_status(searchable_store):
+    assert names(searchable_store.search(['plum*'])) == ['call the plumber']
+    assert names(searchable_store.search(['milk'], status='completed')) == ['milk the cows']
+
+
+def test_search_ignores_query_syntax(searchable_store):
+    assert searchable_store.search(['"milk', 'AND', 'NOT']) == []
+    assert searchable_store.search(['*']) == []
+
+
+def test_search_index_follows_syncs(searchable_store):
+    searchable_store.apply([{'id': 'A', 'taskseries': [rtm_taskseries('1', 'buy cheese')]},
+                            {'id': 'B', 'deleted': {'taskseries': [deleted_taskseries('4')]}}],
+                           '2018-08-06T00:00:00Z')
+
+    assert names(searchable_store.search(['cheese'])) == ['buy cheese']
+    assert 'buy milk' not in names(searchable_store.search(['milk']))
+    assert searchable_store.search(['dog']) == []
+
+    searchable_store.clear()
+    assert searchable_store.search(['milk']) == []
+
+
+def test_search_index_built_for_existing_store(searchable_store):
+    searchable_store.db.execute('DELETE FROM search')
+    searchable_store.db.execute("DELETE FROM meta WHERE key = 'search_indexed'")
+    searchable_store.db.commit()
+
+    store = TaskStore(searchable_store.path)
+    assert names(store.search(['dog'])) == ['walk the dog']
+    store.close()
+
+
+################################################################################
+# test showing the store while syncing it in the background
+################################################################################
+@pytest.fixture()
+def popen_calls(monkeypatch):
+    import subprocess
+    calls = []
+    monkeypatch.setattr(subprocess, 'Popen', lambda args, **kwargs: calls.append(args))
+    return calls
+
+
+def test_sync_in_background_starts_dftp_sync(store, popen_calls):
+    assert app.sync_in_background(store) is True
+    assert popen_calls[0][-1] == 'sync'
+
+
+def test_sync_in_background_only_once_a_while(store, popen_calls):
+    app.sync_in_background(store)
+
+    assert app.sync_in_background(store) is False
+    assert len(popen_calls) == 1
+
+
+def test_sync_in_background_turned_off(store, popen_calls, monkeypatch):
+    monkeypatch.setattr(app, 'background_sync', False)
+
+    assert app.sync_in_background(store) is False
+    assert popen_calls == []
+
+
+def test_stored_list_id_uses_expired_lists(rtm_lists_calls):
+    store = app.get_store()
+    store.set_lists([{'id': '3', 'name': 'Old', 'smart': '0', 'archived': '0'}], 0)
+
+    assert app.stored_list_id(store, 'Old') == '3'
+    assert app.stored_list_id(store, 'Home') == '2'
+    assert len(rtm_lists_calls) == 1
+
+
+def test_stored_list_id_offline(rtm_lists_calls, monkeypatch):
+    monkeypatch.setattr(app, 'offline', True)
+
+    with pytest.raises(app.NoListException):
+        app.stored_list_id(app.get_store(), 'Home')
+
+    assert rtm_lists_calls == []
+
+
+@pytest.fixture()
+def smart_list(monkeypatch):
+    '''
+    A synced store with list "Work" and smart list "Urgent", whose tasks RTM
+    finds; return the ids of the lists whose tasks are asked of RTM.
+    '''
+
+    monkeypatch.setitem(app.config['USER SETTINGS'], 'token', 'token')
+    monkeypatch.setitem(app.config['USER SETTINGS'], 'token_checked', str(int(time.time())))
+    monkeypatch.setattr(app, 'load_config', lambda: app.config)
+    monkeypatch.setattr(app, 'sync_in_background', lambda store: False)
+    monkeypatch.setattr(app, 'offline', False)
+
+    store = app.get_store()
+    store.apply([{'id': '1', 'taskseries': [rtm_taskseries('1', 'report'),
+                                            rtm_taskseries('2', 'slides')]}],
+                '2018-08-05T00:00:00Z')
+    store.set_lists([{'id': '1', 'name': 'Work', 'smart': '0', 'archived': '0'},
+                     {'id': '9', 'name': 'Urgent', 'smart': '1', 'archived': '0'}], time.time())
+
+    calls = []
+
+    def get_rtm_tasks(list_name, status, tag='', dates={}, last_sync='', list_id=''):
+        calls.append(list_id)
+        return [{'id': '1', 'taskseries': [rtm_taskseries('2', 'slides')]}]
+
+    monkeypatch.setattr(app, 'get_rtm_tasks', get_rtm_tasks)
+    return calls
+
+
+def test_tasks_of_smart_list_are_asked_of_rtm(smart_list):
+    result = CliRunner().invoke(app.main, ['tasks', '-l', 'Urgent'])
+
+    assert result.exit_code == 0
+    assert 'slides' in result.stdout and 'report' not in result.stdout
+    assert smart_list == ['9']
+
+    result = CliRunner().invoke(app.main, ['tasks', '-l', 'Work'])
+
+    assert 'slides' in result.stdout and 'report' in result.stdout
+    assert smart_list == ['9']
+
+
+def test_smart_list_offline(smart_list):
+    result = CliRunner().invoke(app.main, ['--offline', 'tasks', '-l', 'Urgent'])
+
+    assert "can't be shown --offline" in result.stdout
+    assert smart_list == []
+
+
+def test_query_task_index_asks_rtm_for_smart_lists(smart_list, monkeypatch):
+    store = app.get_store()
+    monkeypatch.setattr(app, 'task_index', daemon.index_tasks(store))
+
+    assert [task.name for task in app.query_task_index(store, ['Urgent'])] == ['slides']
+    assert [task.name for task in app.query_task_index(store, ['Urgent', 'Work'])] == \
+        ['slides', 'report']
+    assert smart_list == ['9', '9']
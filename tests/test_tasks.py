@@ -1,14 +1,17 @@
 #!python3
 
+import io
 import random
 import string
+import time
 
 import pytest
 import arrow
 
+from dftp import app
 from dftp.app import Task, convert_to_list, create_Task_list, NoTasksException, \
     human_date_to_arrow, UnrecognizedDateFormat, MonthOrDayTooHigh, \
-    format_date_display, split_list
+    format_date_display, split_list, NO_DATE, iter_tasks, stream_tasks
 
 
 # dictionary keys for variables to create Tasks
@@ -148,6 +151,11 @@ tomorrow_11pm_dt = tomorrow_11pm.datetime
 tomorrow_1am_dt = tomorrow_1am.datetime
 
 
+def timestamp(date):
+    ''' Seconds since the epoch of an Arrow datetime, as stored in Task. '''
+    return int(date.datetime.timestamp())
+
+
 def initialize_dates(due='', due_before='', due_after='',
                      completed_on='', completed_before ='',
                      completed_after = ''):
@@ -291,20 +299,20 @@ def test_incorrect_user_date_raises_MonthOrDayTooHigh(date):
 # (and possibly time)
 
 def test_format_date_never():
-    ''' date of "never" should stay "never" '''
-    assert format_date_display('never') == 'never'
+    ''' no date should be displayed as "never" '''
+    assert format_date_display(NO_DATE) == 'never'
 
 def test_format_date_display_no_due_or_completed_time():
     ''' date with time at midnight should not display time.'''
     today_midnight = arrow.now().replace(hour=0, minute=0, second=0, microsecond=0)
-    assert format_date_display(today_midnight.isoformat()) == today_midnight.format('MMM D, YYYY')
+    assert format_date_display(timestamp(today_midnight)) == today_midnight.format('MMM D, YYYY')
 
 def test_format_date_display_due_or_completed_time():
     ''' date with time at midnight should not display time.'''
     # aug_5_18_8am = arrow.get(datetime(2013, 5, 5), 'US/Pacific')
     aug_5_18_8am = arrow.now().replace(year=2018, month=8, day=5, hour=8, minute=0,
                                        second=0, microsecond=0)
-    assert format_date_display(aug_5_18_8am.isoformat()) == 'Aug 5, 2018 8:00 am'
+    assert format_date_display(timestamp(aug_5_18_8am)) == 'Aug 5, 2018 8:00 am'
 
 
 ################################################################################
@@ -409,7 +417,7 @@ def test_create_Task_list_returns_one_task_with_correct_due_date():
 
     task_list = create_Task_list(make_list_of_rtm_lists(tasks), dates=initialize_dates())
 
-    assert task_list[0].due == today
+    assert task_list[0].due == timestamp(today)
 
 
 def test_create_Task_list_returns_one_task_with_correct_completed_date():
@@ -418,7 +426,7 @@ def test_create_Task_list_returns_one_task_with_correct_completed_date():
 
     task_list = create_Task_list(make_list_of_rtm_lists(tasks), dates=initialize_dates())
 
-    assert task_list[0].completed == today
+    assert task_list[0].completed == timestamp(today)
 
 
 def test_create_Task_list_returns_one_task_with_correct_due_and_completed_date():
@@ -428,7 +436,7 @@ def test_create_Task_list_returns_one_task_with_correct_due_and_completed_date()
     task_list = create_Task_list(make_list_of_rtm_lists(tasks), dates=initialize_dates())
 
     failure = 0
-    if task_list[0].completed != today or task_list[0].due != yesterday:
+    if task_list[0].completed != timestamp(today) or task_list[0].due != timestamp(yesterday):
         failure = 1
 
     assert failure == 0
@@ -477,10 +485,12 @@ def test_create_Task_list_with_tags_desired_raises_exception(tasks_with_tags):
 @pytest.fixture()
 def tasks_with_dates():
 
-    date_1_str = str(arrow.get('2018-08-05'))
-    date_2_str = str(arrow.get('2018-08-06'))
-    date_3_str = str(arrow.get('2018-08-07'))
-    date_4_str = str(arrow.get('2018-08-08'))
+    # RTM stores dates without a time as midnight in the user's timezone
+    tz = config['USER SETTINGS']['timezone']
+    date_1_str = str(arrow.Arrow(2018, 8, 5, tzinfo=tz).to('utc'))
+    date_2_str = str(arrow.Arrow(2018, 8, 6, tzinfo=tz).to('utc'))
+    date_3_str = str(arrow.Arrow(2018, 8, 7, tzinfo=tz).to('utc'))
+    date_4_str = str(arrow.Arrow(2018, 8, 8, tzinfo=tz).to('utc'))
 
     tasks = []
     tasks.append(mock_rtm_taskseries(1, 'do nothing', due=date_1_str))
@@ -578,3 +588,366 @@ def test_create_Task_list_no_tasks_meeting_filters_raises_NoTasksException(tasks
         dates = initialize_dates(due_after='8/9/18')
         with pytest.raises(NoTasksException):
             task_list = create_Task_list(tasks_with_dates, dates=dates)
+
+
+################################################################################
+# test compact Task representation
+################################################################################
+
+def test_task_has_no_instance_dict(tasks_one_random):
+    assert not hasattr(tasks_one_random, '__dict__')
+
+
+def test_tasks_without_due_date_sort_last():
+    tasks = [mock_rtm_taskseries(1, 'whenever'),
+             mock_rtm_taskseries(2, 'do this', due=tomorrow_str),
+             mock_rtm_taskseries(3, 'do that', due=today_str)]
+
+    task_list = create_Task_list(make_list_of_rtm_lists(tasks), dates=initialize_dates())
+    task_list.sort(key=lambda t: t.due)
+
+    assert [task.name for task in task_list] == ['do that', 'do this', 'whenever']
+
+
+def test_create_Task_list_resolves_each_date_filter_once(tasks_with_dates, monkeypatch):
+    calls = []
+
+    def counting_human_date_to_arrow(date, type_of_filter):
+        calls.append(date)
+        return human_date_to_arrow(date, type_of_filter)
+
+    monkeypatch.setattr(app, 'human_date_to_arrow', counting_human_date_to_arrow)
+    dates = initialize_dates(due_after='8/5/18', due_before='8/9/18')
+
+    task_list = create_Task_list(tasks_with_dates, dates=dates)
+
+    assert len(task_list) == 6
+    assert sorted(calls) == ['8/5/18', '8/9/18']
+
+
+def test_create_Task_list_filters_by_status(tasks_with_dates):
+    assert len(create_Task_list(tasks_with_dates, dates=initialize_dates(),
+                                status='completed')) == 8
+
+
+def test_create_Task_list_with_several_tags_returns_tasks_with_all(tasks_with_tags):
+    task_list = create_Task_list(tasks_with_tags, tag=('work', 'python'),
+                                 dates=initialize_dates())
+
+    assert [task.name for task in task_list] == ['do this']
+
+
+@pytest.mark.parametrize('tag_filter, names', [
+    (app.TagFilter(any_of=('python', 'writing')), ['do this', 'do that']),
+    (app.TagFilter(any_of=('python', 'gardening')), ['do this']),
+    (app.TagFilter(all_of='work', none_of='cli'), ['do that']),
+    (app.TagFilter(none_of=('cli', 'writing')), []),
+])
+def test_create_Task_list_with_tag_filter(tasks_with_tags, tag_filter, names):
+    tasks = list(iter_tasks(tasks_with_tags, tag=tag_filter))
+
+    assert [task.name for task in tasks] == names
+
+
+################################################################################
+# test streaming tasks to the terminal
+################################################################################
+
+def two_lists_of_tasks():
+    ''' Two RTM lists, each with tasks out of order. '''
+    dates = [arrow.Arrow(2018, 8, day, 12, tzinfo=config['USER SETTINGS']['timezone'])
+             for day in range(1, 7)]
+
+    list_1 = {'id': 1, 'taskseries': [mock_rtm_taskseries(1, 'five', due=str(dates[4])),
+                                      mock_rtm_taskseries(2, 'one', due=str(dates[0])),
+                                      mock_rtm_taskseries(3, 'four', due=str(dates[3])),
+                                      mock_rtm_taskseries(4, 'done', completed=str(dates[1]))]}
+    list_2 = {'id': 2, 'taskseries': [mock_rtm_taskseries(5, 'three', due=str(dates[2])),
+                                      mock_rtm_taskseries(6, 'two', due=str(dates[1])),
+                                      mock_rtm_taskseries(7, 'never'),
+                                      mock_rtm_taskseries(8, 'done first', completed=str(dates[0]))]}
+    return [list_1, list_2]
+
+
+def streamed_names(tasks, status=''):
+    out = io.StringIO()
+    stream_tasks(tasks, status, out=out)
+    return [line[app.stream_date_width + 1:] for line in out.getvalue().splitlines()
+            if line[:3] in ('Aug', 'nev')]
+
+
+def test_iter_tasks_is_lazy():
+    rtm_lists = iter(two_lists_of_tasks())
+    tasks = iter_tasks(rtm_lists)
+
+    assert next(tasks).name == 'five'
+    assert next(rtm_lists)['id'] == 2
+
+
+def test_stream_tasks_writes_lists_in_order():
+    tasks = iter_tasks(two_lists_of_tasks())
+
+    # incomplete tasks list by list, each list under its name (see below);
+    # completed ones, read by then, merged
+    assert streamed_names(tasks) == ['one', 'four', 'five', 'two', 'three', 'never',
+                                     'done first', 'done']
+
+
+def test_stream_tasks_heads_each_list_with_its_name():
+    out = io.StringIO()
+    stream_tasks(iter_tasks(two_lists_of_tasks()), '', out=out, list_names={1: 'Work'})
+
+    lines = out.getvalue().splitlines()
+
+    assert [line for line in lines if line.endswith(':')] == ['Work:', '2:']
+    assert lines[lines.index('Work:') + 1].endswith(' one')
+    assert lines[lines.index('2:') + 1].endswith(' two')
+
+
+def test_stream_tasks_with_status():
+    tasks = iter_tasks(two_lists_of_tasks(), status='completed')
+
+    assert streamed_names(tasks, status='completed') == ['done', 'done first']
+
+
+def test_stream_tasks_writes_each_list_before_reading_on():
+    out = io.StringIO()
+
+    def rtm_lists():
+        list_1, list_2 = two_lists_of_tasks()
+        yield list_1
+        yield list_2
+        # the first list was written as soon as the second began
+        assert 'one' in out.getvalue() and 'two' not in out.getvalue()
+        yield {'id': 3, 'taskseries': []}
+
+    stream_tasks(iter_tasks(rtm_lists()), '', out=out)
+
+    assert 'two' in out.getvalue()
+
+
+def test_stream_tasks_without_tasks():
+    out = io.StringIO()
+    stream_tasks(iter([]), 'incomplete', out=out)
+
+    assert out.getvalue().strip() == 'No incomplete tasks.'
+
+
+################################################################################
+# test exporting tasks to pdf
+################################################################################
+def test_lazy_story_takes_flowables_as_needed():
+    flowables = iter(range(5))
+    story = app.LazyStory(flowables)
+
+    assert list(story) == [0, 1]
+    del story[0]
+    assert list(story) == [1, 2]
+    assert next(flowables) == 3
+
+
+def test_export_tasks_in_several_tables(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'export_chunk_size', 3)
+    tasks = create_Task_list(two_lists_of_tasks())
+    tables = []
+
+    def build(doc, story):
+        while story:
+            tables.extend(flowable for flowable in story[:1]
+                          if type(flowable).__name__ == 'Table')
+            del story[0]
+
+    monkeypatch.setattr('reportlab.platypus.SimpleDocTemplate.build', build)
+    app.display_tasks('export', 'Work', '', tasks, '', filename=str(tmp_path.joinpath('tasks')))
+
+    # 6 incomplete tasks, 2 completed
+    assert [len(table._cellvalues) for table in tables] == [4, 3, 3]
+    assert tables[0]._cellvalues[0] == ['Task', 'Due']
+    assert tables[2]._cellvalues[0] == ['Task', 'Completed']
+
+
+def test_export_tasks_writes_pdf(tmp_path):
+    tasks = create_Task_list(two_lists_of_tasks())
+    app.display_tasks('export', 'Work', '', tasks, '', filename=str(tmp_path.joinpath('tasks')))
+
+    assert tmp_path.joinpath('tasks.pdf').read_bytes().startswith(b'%PDF')
+
+
+def test_export_all_lists_writes_pdf_per_list(tmp_path, monkeypatch):
+    app.get_store().set_lists([{'id': 1, 'name': 'Work'}, {'id': 2, 'name': 'Home/Garden'}],
+                              time.time())
+    tasks = create_Task_list(two_lists_of_tasks())
+    app.export_all_lists(tasks, '', '', str(tmp_path.joinpath('RTM tasks')))
+
+    assert sorted(path.name for path in tmp_path.glob('RTM tasks*')) == \
+        ['RTM tasks - Home-Garden.pdf', 'RTM tasks - Home-Garden.pdf.fingerprint',
+         'RTM tasks - Work.pdf', 'RTM tasks - Work.pdf.fingerprint']
+
+
+@pytest.fixture()
+def builds(monkeypatch):
+    ''' Count the pdfs reportlab builds. '''
+
+    from reportlab.platypus import SimpleDocTemplate
+
+    built = []
+    original_build = SimpleDocTemplate.build
+
+    def build(doc, *args, **kwargs):
+        built.append(doc.filename)
+        return original_build(doc, *args, **kwargs)
+
+    monkeypatch.setattr(SimpleDocTemplate, 'build', build)
+    return built
+
+
+def test_export_skipped_when_tasks_unchanged(tmp_path, builds):
+    filename = str(tmp_path.joinpath('tasks'))
+
+    assert app.display_tasks('export', 'Work', '', create_Task_list(two_lists_of_tasks()), '',
+                             filename=filename) is True
+    assert app.display_tasks('export', 'Work', '', create_Task_list(two_lists_of_tasks()), '',
+                             filename=filename) is False
+
+    assert len(builds) == 1
+
+
+def test_export_made_again_when_tasks_change(tmp_path, builds):
+    filename = str(tmp_path.joinpath('tasks'))
+    tasks = create_Task_list(two_lists_of_tasks())
+    app.display_tasks('export', 'Work', '', list(tasks), '', filename=filename)
+
+    tasks[0].name = 'renamed'
+    app.display_tasks('export', 'Work', '', list(tasks), '', filename=filename)
+
+    tasks[0].is_overdue = not tasks[0].is_overdue
+    app.display_tasks('export', 'Work', '', list(tasks), '', filename=filename)
+
+    app.display_tasks('export', 'Home', '', list(tasks), '', filename=filename)
+
+    assert len(builds) == 4
+
+
+def test_export_made_again_when_forced_or_pdf_changed(tmp_path, builds):
+    filename = str(tmp_path.joinpath('tasks'))
+    tasks = create_Task_list(two_lists_of_tasks())
+    app.display_tasks('export', 'Work', '', list(tasks), '', filename=filename)
+
+    app.display_tasks('export', 'Work', '', list(tasks), '', filename=filename, force=True)
+    assert len(builds) == 2
+
+    tmp_path.joinpath('tasks.pdf').write_bytes(b'%PDF-1.4 something else')
+    app.display_tasks('export', 'Work', '', list(tasks), '', filename=filename)
+    assert len(builds) == 3
+
+    tmp_path.joinpath('tasks.pdf').unlink()
+    app.display_tasks('export', 'Work', '', list(tasks), '', filename=filename)
+    assert len(builds) == 4
+
+
+################################################################################
+# test whether tasks are overdue
+################################################################################
+@pytest.fixture()
+def context():
+    ''' Evaluation context at noon on Aug 5, 2018 in the user's timezone. '''
+    noon = arrow.Arrow(2018, 8, 5, 12, tzinfo=config['USER SETTINGS']['timezone'])
+    return app.TaskContext(now=noon.timestamp())
+
+
+def overdue(due, context, has_due_time=None):
+    task = {'due': str(due), 'completed': ''}
+    if has_due_time is not None:
+        task['has_due_time'] = has_due_time
+    return Task({'id': '1', 'name': 'task', 'tags': []}, task, context=context).is_overdue
+
+
+def local(*args):
+    return arrow.Arrow(*args, tzinfo=config['USER SETTINGS']['timezone'])
+
+
+def test_context_start_of_today(context):
+    assert context.today_start == timestamp(local(2018, 8, 5))
+
+
+@pytest.mark.parametrize('has_due_time', [None, '0'])
+def test_task_due_today_is_not_overdue(context, has_due_time):
+    assert not overdue(local(2018, 8, 5), context, has_due_time)
+
+
+@pytest.mark.parametrize('has_due_time', [None, '0'])
+def test_task_due_yesterday_is_overdue(context, has_due_time):
+    assert overdue(local(2018, 8, 4), context, has_due_time)
+
+
+@pytest.mark.parametrize('has_due_time', [None, '1'])
+def test_task_due_earlier_today_is_overdue(context, has_due_time):
+    assert overdue(local(2018, 8, 5, 9), context, has_due_time)
+
+
+def test_task_due_later_today_is_not_overdue(context):
+    assert not overdue(local(2018, 8, 5, 15), context, '1')
+
+
+def test_task_without_due_date_is_not_overdue(context):
+    assert not overdue('', context)
+
+
+################################################################################
+# test the sorted index of tasks by due and completed time
+################################################################################
+@pytest.mark.parametrize('dates, status', [
+    ({}, ''),
+    ({}, 'incomplete'),
+    ({}, 'completed'),
+    ({'due': '8/6/18'}, ''),
+    ({'due_before': '8/7/18'}, 'incomplete'),
+    ({'due_after': '8/5/18', 'due_before': '8/8/18'}, ''),
+    ({'completed_on': '8/7/18'}, 'completed'),
+    ({'completed_after': '8/5/18'}, ''),
+    ({'completed_before': '8/5/18'}, 'completed'),
+    ({'due_after': '8/8/18'}, ''),
+    ({'completed_after': '8/5/18'}, 'incomplete'),
+])
+def test_task_index_matches_create_Task_list(tasks_with_dates, dates, status):
+    index = app.TaskIndex(iter_tasks(tasks_with_dates))
+    dates = initialize_dates(**dates)
+
+    try:
+        expected = create_Task_list(tasks_with_dates, dates=dates, status=status)
+    except NoTasksException:
+        expected = []
+
+    assert sorted(task.id for task in index.query(dates, status)) == \
+        sorted(task.id for task in expected)
+
+
+def test_task_index_returns_tasks_in_order(tasks_with_dates):
+    index = app.TaskIndex(iter_tasks(tasks_with_dates))
+
+    due = [task.due for task in index.query(status='incomplete')]
+    completed = [task.completed for task in index.query(status='completed')]
+
+    assert len(index) == 16
+    assert due == sorted(due) and len(due) == 8
+    assert completed == sorted(completed) and len(completed) == 8
+
+
+def test_task_index_with_tag_filter():
+    taskseries = [mock_rtm_taskseries(str(i), 'task {}'.format(i), tags=tags,
+                                      due='2018-08-0{}T04:00:00Z'.format(i))
+                  for i, tags in enumerate([['work'], ['work', 'urgent'], ['home'],
+                                            ['home', 'someday'], []], 1)]
+    index = app.TaskIndex(iter_tasks(make_list_of_rtm_lists(taskseries)))
+
+    def names(*args):
+        return [task.name for task in index.query({}, '', app.TagFilter(*args))]
+
+    assert names('work') == ['task 1', 'task 2']
+    assert names(('work', 'urgent')) == ['task 2']
+    assert names((), ('urgent', 'home')) == ['task 2', 'task 3', 'task 4']
+    assert names((), (), 'someday') == ['task 1', 'task 2', 'task 3', 'task 5']
+    assert names((), ('work', 'home'), ('urgent', 'someday')) == ['task 1', 'task 3']
+    assert names('errands') == []
+    assert [task.name for task in index.query({'due_before': '8/4/18'}, '', 'home')] == \
+        ['task 3']
@@ -0,0 +1,122 @@
+#!python3
+
+import io
+import time
+
+from dftp import app, formats, timing
+
+
+def test_timings_counts_calls():
+    timings = timing.Timings()
+    double = timings.wrap('double', lambda x: 2 * x)
+
+    assert double(2) == 4
+    assert double(3) == 6
+    assert timings.totals['double'][0] == 2
+    assert timings.totals['double'][1] >= 0
+
+
+def test_timings_counts_calls_that_raise():
+    timings = timing.Timings()
+
+    def fail():
+        raise app.NoTasksException
+
+    try:
+        timings.wrap('fail', fail)()
+    except app.NoTasksException:
+        pass
+
+    assert timings.totals['fail'][0] == 1
+
+
+def test_start_times_app_functions_until_stopped(capsys):
+    create_Task_list = app.create_Task_list
+    stop = timing.start()
+
+    assert app.create_Task_list is not create_Task_list
+    app.create_Task_list([{'id': '1', 'taskseries': [
+        {'id': '1', 'name': 'task', 'tags': [], 'task': [{'due': '', 'completed': ''}]}]}])
+    stop()
+
+    assert app.create_Task_list is create_Task_list
+    report = capsys.readouterr().err
+    assert 'create_Task_list' in report
+    assert 'display_tasks' not in report
+
+
+def test_start_saves_cprofile_stats(tmp_path, capsys):
+    output = tmp_path.joinpath('dftp.pstats')
+    timing.start(str(output))()
+
+    assert output.exists()
+
+
+def test_report_lists_phases_in_order():
+    timings = timing.Timings()
+    timings.totals = {'display_tasks': (1, 0.5), 'check_token': (1, 0.25)}
+    out = io.StringIO()
+    timings.report(1.0, out)
+
+    lines = out.getvalue().splitlines()
+    assert [line.split()[0] for line in lines] == ['function', 'check_token', 'display_tasks',
+                                                   'total']
+    assert lines[1].split()[-2:] == ['0.2500', '25']
+
+
+def reported_seconds(report):
+    ''' Return the seconds of each row of a report, by function. '''
+    return {line.split()[0]: float(line.split()[-2]) for line in report.splitlines()[1:]}
+
+
+def test_streamed_fetch_is_timed_as_fetching(monkeypatch, capsys):
+    def iter_rtm_tasks(list_name, status, tag='', dates={}):
+        def parse():
+            for i in range(3):
+                time.sleep(0.02)  # as if downloading and decoding the response
+                yield {'id': '1', 'taskseries': [{'id': str(i), 'name': 'task', 'tags': [],
+                                                  'task': [{'due': '', 'completed': ''}]}]}
+        return parse()
+
+    monkeypatch.setattr(app, 'iter_rtm_tasks', iter_rtm_tasks)
+
+    stop = timing.start()
+    tasks = app.create_Task_list(app.fetch_rtm_tasks([], ''))
+    stop()
+
+    assert len(tasks) == 3
+    seconds = reported_seconds(capsys.readouterr().err)
+    assert seconds['fetch_rtm_tasks'] >= 0.06
+    assert seconds['iter_rtm_tasks'] >= 0.06
+    # reading them, the Tasks are created without the time taken to fetch them
+    assert seconds['iter_tasks'] < 0.03
+    assert seconds['create_Task_list'] < 0.03
+
+
+def test_reading_the_store_is_timed(capsys):
+    store = app.get_store()
+    store.apply([{'id': '1', 'taskseries': [{'id': '1', 'name': 'task', 'tags': [],
+                                             'task': [{'id': '1', 'due': '', 'completed': ''}]}]}],
+                '2018-08-05T00:00:00Z')
+
+    stop = timing.start()
+    app.create_Task_list(store.get_rtm_tasks())
+    stop()
+
+    assert 'TaskStore.get_rtm_tasks' in reported_seconds(capsys.readouterr().err)
+
+
+def test_streamed_and_written_tasks_are_timed(tmp_path, capsys):
+    rtm_lists = [{'id': '1', 'taskseries': [{'id': '1', 'name': 'task', 'tags': [],
+                                             'task': [{'id': '1', 'due': '', 'completed': ''}]}]}]
+
+    stop = timing.start()
+    app.display_tasks('stream', '', '', app.iter_tasks(rtm_lists), '')
+    formats.write_tasks(app.iter_tasks(rtm_lists), 'csv', str(tmp_path.joinpath('tasks')))
+    stop()
+
+    calls = {line.split()[0]: line.split()[-3] for line in
+             capsys.readouterr().err.splitlines()[1:-1]}
+    assert calls['iter_tasks'] == '2'
+    assert calls['display_tasks'] == '1'
+    assert calls['formats.write_tasks'] == '1'